@@ -1,14 +1,39 @@
+import atexit
+import time
+
+# 起動時間の計測用（スクリプトの実行開始時刻。Streamlit は再実行のたびにここから実行する）
+SCRIPT_STARTED_AT = time.perf_counter()
+
 import streamlit as st
-import gspread
 import pandas as pd
+import numpy as np
 import random
 import os
+import pickle
 import base64
+import secrets
+import sqlite3
 import html
-import time
-from itertools import product
+import io
+import json
+import logging
+import marshal
+import socket
+import sys
+import threading
+import zlib
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import permutations, product
 from datetime import datetime, timezone, timedelta
 
+# gspread と altair は初期画面の表示に不要なので、使う関数の中で import する
+IMPORTS_FINISHED_AT = time.perf_counter()
+
+logger = logging.getLogger("barrage")
+
 # --- 定数定義 ---
 SPREADSHEET_KEY = "14sDX_7rw3WcGpWji59Ornhkx9G9obs-ZRn8sgqcs9yA"
 NATION_SHEET = "国家マスタ"
@@ -17,16 +42,341 @@ CONTRACT_SHEET = "初期契約マスタ"
 SCORE_SHEET = "スコア記録"
 PRESET_SHEET = "プリセット"
 BALANCE_SHEET = "バランス調整履歴"
+DRAFT_LOG_SHEET = "ドラフトログ"
+DRAFT_LOG_HEADERS = ["GameID", "Seq", "Event", "Player", "Data"]
 IMAGE_DIR = "images"
 MAX_VP = 16
 MAX_PLAYERS = 5
 
+# GameID = (UNIX秒 * 100 + ノード番号) * 1000 + 連番
+# 15桁に収まるのでスプレッドシートやfloat64でも精度が落ちず、時刻順にソートできる
+GAME_ID_NODE_SPACE = 100
+GAME_ID_SEQ_SPACE = 1000
+GAME_ID_NODE_ENV = "BARRAGE_NODE_ID"
+# 環境変数が未設定のとき、同じマシンのプロセスにノード番号を重ならないように割り当てる表（ローカルのSQLite）
+GAME_ID_NODE_DB = "game_id_nodes.sqlite3"
+
+# 統計画面の計算結果キャッシュの上限
+STATS_CACHE_MAX_ENTRIES = 256
+STATS_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# グラフに送るデータ点数の上限（サーバー側で集約してから渡す）
+CHART_HISTOGRAM_MAX_BINS = 20
+CHART_TIMESERIES_MAX_POINTS = 200
+CHART_ROLLING_WINDOW = 10
+
+# 集計キューブの次元と指標（指標ごとの合算方法）
+# 絞り込みに使う次元はすべてのビューに持たせ、集計のキーごとにビューを分けて
+# セル数を（月 × ボード × 人数 × ドラフト方式 × キーの値）の組み合わせに抑える
+STATS_CUBE_FILTER_DIMS = ["Month", "Board", "PlayerCount", "DraftMethod"]
+STATS_CUBE_VIEWS = [
+    ("PlayerName",),
+    ("Nation",),
+    ("Executive",),
+    ("Nation", "Executive"),
+    ("TurnOrder1R",),
+]
+STATS_CUBE_MEASURES = {
+    "Count": "sum",
+    "Games": "sum",
+    "Wins": "sum",
+    "ScoreSum": "sum",
+    "ScoreSqSum": "sum",
+    "RankSum": "sum",
+    "ScoreMax": "max",
+}
+# 保存時に追記した行をこの件数まで溜めたら、時刻順の行にまとめ直す
+STATS_CUBE_RECENT_ROWS_LIMIT = 64
+
+# ブートストラップ信頼区間（リサンプル回数・信頼水準・並列ワーカー数。0なら同一プロセスで計算）
+BOOTSTRAP_RESAMPLES = 10000
+BOOTSTRAP_CONFIDENCE = 0.95
+BOOTSTRAP_WORKERS_ENV = "BARRAGE_BOOTSTRAP_WORKERS"
+WIN_RATE_CI_LABEL = "勝率95%CI"
+MEAN_SCORE_CI_LABEL = "平均スコア95%CI"
+
+# ドラフト候補の勝率予測モデル（L2正則化ロジスティック回帰）の説明変数と設定
+WIN_MODEL_FEATURES = ["Nation", "Executive", "Combo", "TurnOrder1R", "Board", "PlayerCount"]
+WIN_MODEL_L2 = 2.0
+WIN_MODEL_MAX_ITER = 30
+
+# 国家・重役の出現回数を保持する期間（("games", N) は直近Nゲーム、("days", D) は直近D日）
+USAGE_COUNTER_WINDOWS = [("games", 10), ("games", 30), ("days", 30)]
+# 他の端末での保存やシートの直接編集を取り込むため、この秒数ごとにシートから作り直す
+USAGE_COUNTER_REFRESH_SECONDS = 1800
+
+# 着席プレイヤーの直近の使用履歴として、(プレイヤー, ボード) ごとに保持するゲーム数
+RECENCY_WINDOW_GAMES = 10
+DEFAULT_BOARD = "通常"
+
+# 進行中のセットアップのチェックポイント（ローカルのSQLite）。
+# 再開コードの文字（紛らわしい 0/O・1/I は除く）と桁数、保持する日数
+SESSION_CHECKPOINT_DB = "session_checkpoints.sqlite3"
+SESSION_CHECKPOINT_FORMAT = 3
+SESSION_CHECKPOINT_SCREENS = ("setup", "draft", "draft_result", "auction")
+RESUME_CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+RESUME_CODE_LENGTH = 6
+SESSION_CHECKPOINT_RETENTION_DAYS = 7
+
+# 起動時間の内訳（サーバー起動後の最初の実行で1回だけ記録する）
+STARTUP_PHASE_LABELS = {
+    "imports": "モジュールのimport",
+    "client_auth": "gspreadのimportと認証",
+    "first_render": "初期画面の表示まで",
+    "active_game_fetch": "スコア入力待ちゲームの読み込み",
+    "master_fetch": "マスタ取得",
+}
+
+# シート読み込みのキャッシュ期間（秒）。値は期間ごとの世代をキーに持ち、
+# バックグラウンドのスレッドが期間が切れる少し前に次の世代を読み込んでおく
+CLIENT_CACHE_TTL = 1800
+MASTER_CACHE_TTL = 1800
+SHEET_CACHE_TTL = 60
+WARM_CACHE_TTLS = {
+    "client": CLIENT_CACHE_TTL,
+    "masters": MASTER_CACHE_TTL,
+    "presets": SHEET_CACHE_TTL,
+    "scores": SHEET_CACHE_TTL,
+    "latest_game": SHEET_CACHE_TTL,
+}
+WARM_CACHE_LABELS = {
+    "client": "gspreadクライアント",
+    "masters": "マスタ",
+    "presets": "プリセット",
+    "scores": "スコア記録（統計）",
+    "latest_game": "スコア入力待ちゲーム",
+}
+# 次の世代を読み込むのは切り替わりの何秒前か・この秒数使われていない項目は先読みしない
+CACHE_WARMER_LEAD_SECONDS = 15
+CACHE_WARMER_IDLE_SECONDS = 600
+CACHE_WARMER_POLL_SECONDS = 1
+CACHE_WARMER_THREAD_NAME = "barrage-cache-warmer"
+CACHE_WARMER_ENV = "BARRAGE_CACHE_WARMER"
+
+# バランス重視ペアリングで組み合わせの勝率を国家・重役の勝率へ縮約する強さ（仮想の試合数）
+COMBO_SHRINKAGE_PRIOR = 10
+
+# バランス調整履歴の最初の日付より前にプレイされたゲームのバージョン名
+BALANCE_BASE_VERSION = "調整前"
+
+# レーティング（多人数Elo）: 初期値・Kファクター・チェックポイント間隔（ゲーム数）
+RATING_INITIAL = 1500.0
+RATING_K_FACTOR = 32.0
+RATING_CHECKPOINT_INTERVAL = 100
+RATING_KINDS = {"player": "プレイヤー", "combo": "国家×重役"}
+
+
+# --- 起動時間の計測 ---
+@st.cache_resource
+def get_startup_profile():
+    """起動時間の内訳（プロセス内で共有。各項目は最初の1回だけ記録する）"""
+    return {"lock": threading.Lock(), "phases": {}}
+
+
+def record_startup_phase(phase, seconds):
+    """起動時間の項目を記録する（記録済みなら何もしない）"""
+    profile = get_startup_profile()
+    with profile["lock"]:
+        profile["phases"].setdefault(phase, seconds * 1000)
+
+
+def show_startup_profile():
+    """起動時間の内訳を表示する"""
+    phases = get_startup_profile()["phases"]
+    if not phases:
+        st.caption("まだ記録がありません。")
+        return
+    st.dataframe(
+        pd.DataFrame({
+            "項目": [STARTUP_PHASE_LABELS[p] for p in STARTUP_PHASE_LABELS if p in phases],
+            "時間(ms)": [round(phases[p], 1) for p in STARTUP_PHASE_LABELS if p in phases],
+        }),
+        use_container_width=True,
+        hide_index=True,
+    )
+    st.caption(
+        "「初期画面の表示まで」はスクリプトの実行開始からの時間です。"
+        "シートの読み込み時間には初回の認証も含みます。"
+    )
+
+
+# --- キャッシュのウォームアップ ---
+# シートを読む関数は「TTLごとの世代番号」を引数に取り、st.cache_data / st.cache_resource に
+# 世代ごとの値として残す（キャッシュの期間は2世代分）。ウォームアップ用のスレッドは
+# 起動時に今の世代を読み込み、以後は切り替わりの少し前に次の世代を読み込んでおくので、
+# 世代が切り替わってもユーザーの描画がシートの読み込みを待つことはない。
+# 保存・削除で st.cache_data.clear() したときは、次の1回だけ読み込みを待つ。
+def cache_epoch(ttl, ahead=0):
+    """TTLごとの世代番号（ahead=1 なら次の世代）"""
+    return int(time.time() // ttl) + ahead
+
+
+@st.cache_resource
+def get_cache_warmer():
+    """ウォームアップ用スレッドの状態と、項目ごとのキャッシュ利用の集計"""
+    return {
+        "lock": threading.Lock(),
+        "thread": None,
+        "stats": {
+            name: {
+                "requests": 0,
+                "cold": 0,
+                "refreshes": 0,
+                "errors": 0,
+                "last_access": 0.0,
+                "warmed_epoch": -1,
+            }
+            for name in WARM_CACHE_TTLS
+        },
+    }
+
+
+def is_cache_warmer_thread():
+    return threading.current_thread().name == CACHE_WARMER_THREAD_NAME
+
+
+def note_cache_request(name):
+    """ユーザーの描画からの利用を数える"""
+    if is_cache_warmer_thread():
+        return
+    warmer = get_cache_warmer()
+    with warmer["lock"]:
+        stats = warmer["stats"][name]
+        stats["requests"] += 1
+        stats["last_access"] = time.time()
+
+
+def note_cache_miss(name):
+    """ユーザーの描画がシートの読み込みを待ったこと（コールド）を数える"""
+    if is_cache_warmer_thread():
+        return
+    warmer = get_cache_warmer()
+    with warmer["lock"]:
+        warmer["stats"][name]["cold"] += 1
+
+
+class CacheWarmerLogFilter(logging.Filter):
+    """ウォームアップ用スレッドでの「ScriptRunContext がない」警告を出さない"""
+
+    def filter(self, record):
+        return record.threadName != CACHE_WARMER_THREAD_NAME
+
+
+def warm_cache_entry(name, epoch):
+    """項目 name の世代 epoch を読み込んでキャッシュに載せる"""
+    if name == "client":
+        create_gspread_client(epoch)
+    elif name == "masters":
+        for sheet in (NATION_SHEET, EXECUTIVE_SHEET, CONTRACT_SHEET):
+            fetch_master_data(sheet, epoch)
+    elif name == "presets":
+        fetch_preset_data(epoch)
+    elif name == "scores":
+        df = fetch_all_scores_from_sheet(epoch)
+        try:
+            refresh_win_probability_model(df)
+        except Exception:
+            # 学習の失敗は読み込みの失敗と違って読み直しても直らないので、次の世代まで待つ
+            logger.exception("勝率予測モデルの学習に失敗しました")
+    elif name == "latest_game":
+        fetch_latest_game_from_sheet(epoch)
+
+
+def run_cache_warmer(warmer):
+    """起動時に全項目を読み込み、以後は世代の切り替わり前に次の世代を読み込み続ける"""
+    while True:
+        now = time.time()
+        for name, ttl in WARM_CACHE_TTLS.items():
+            stats = warmer["stats"][name]
+            epoch = int(now // ttl)
+            if now >= (epoch + 1) * ttl - CACHE_WARMER_LEAD_SECONDS:
+                epoch += 1
+            with warmer["lock"]:
+                warmed_epoch = stats["warmed_epoch"]
+                last_access = stats["last_access"]
+            if warmed_epoch >= epoch:
+                continue
+            # 使われていない項目は先読みしない（起動時の1回は必ず読む）
+            if warmed_epoch >= 0 and now - last_access > CACHE_WARMER_IDLE_SECONDS:
+                continue
+            try:
+                warm_cache_entry(name, epoch)
+            except Exception:
+                # 失敗は fetch_* がキャッシュしないので、世代を進めずに次のポーリングで読み直す
+                with warmer["lock"]:
+                    stats["errors"] += 1
+                continue
+            with warmer["lock"]:
+                stats["refreshes"] += 1
+                stats["warmed_epoch"] = epoch
+        time.sleep(CACHE_WARMER_POLL_SECONDS)
+
+
+def start_cache_warmer():
+    """ウォームアップ用スレッドを（まだ動いていなければ）起動する"""
+    if os.environ.get(CACHE_WARMER_ENV, "1") == "0":
+        return
+    warmer = get_cache_warmer()
+    with warmer["lock"]:
+        if warmer["thread"] is not None and warmer["thread"].is_alive():
+            return
+        logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+            CacheWarmerLogFilter()
+        )
+        warmer["thread"] = threading.Thread(
+            target=run_cache_warmer, args=(warmer,), name=CACHE_WARMER_THREAD_NAME, daemon=True
+        )
+        warmer["thread"].start()
+
+
+def show_cache_warmer_stats():
+    """キャッシュのウォーム・コールドの利用回数を表示する"""
+    warmer = get_cache_warmer()
+    with warmer["lock"]:
+        stats = {name: dict(entry) for name, entry in warmer["stats"].items()}
+    names = list(WARM_CACHE_TTLS)
+    requests = [stats[n]["requests"] for n in names]
+    cold = [min(stats[n]["cold"], stats[n]["requests"]) for n in names]
+    total_requests = sum(requests)
+    st.dataframe(
+        pd.DataFrame({
+            "項目": [WARM_CACHE_LABELS[n] for n in names],
+            "利用回数": requests,
+            "ウォーム": [r - c for r, c in zip(requests, cold)],
+            "コールド": cold,
+            "ウォーム率(%)": [
+                round((r - c) / r * 100, 1) if r else None for r, c in zip(requests, cold)
+            ],
+            "先読み回数": [stats[n]["refreshes"] for n in names],
+            "先読みエラー": [stats[n]["errors"] for n in names],
+        }),
+        use_container_width=True,
+        hide_index=True,
+    )
+    if total_requests:
+        st.caption(
+            f"全体のウォーム率: {(total_requests - sum(cold)) / total_requests * 100:.1f}%"
+            "（コールドはユーザーの描画がシートの読み込みを待った回数）"
+        )
+
 
 # --- スプレッドシート操作 ---
-@st.cache_resource(ttl=1800)
 def get_gspread_client():
     """gspreadクライアントを取得する（キャッシュ活用）"""
-    return gspread.service_account_from_dict(st.secrets["gcp_service_account"])
+    note_cache_request("client")
+    return create_gspread_client(cache_epoch(CLIENT_CACHE_TTL))
+
+
+@st.cache_resource(ttl=2 * CLIENT_CACHE_TTL)
+def create_gspread_client(epoch):
+    """世代 epoch のgspreadクライアントを作る"""
+    note_cache_miss("client")
+    started = time.perf_counter()
+    import gspread
+
+    client = gspread.service_account_from_dict(st.secrets["gcp_service_account"])
+    record_startup_phase("client_auth", time.perf_counter() - started)
+    return client
 
 
 def get_score_sheet():
@@ -36,6 +386,142 @@ def get_score_sheet():
     return sh.worksheet(SCORE_SHEET)
 
 
+def is_process_alive(pid):
+    """同じマシンのプロセスがまだ動いているか"""
+    if os.name == "nt":
+        # Windows の os.kill はプロセスを終了させてしまうため、確かめずに生きているとみなす
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def allocate_game_id_node(path=None):
+    """割り当て表から、動いている他のプロセスと重ならないノード番号を確保する
+
+    終了したプロセスの番号は回収して使い回す。空きがなければ None を返す。
+    """
+    host = socket.gethostname()
+    pid = os.getpid()
+    conn = sqlite3.connect(path or GAME_ID_NODE_DB, timeout=30, isolation_level=None)
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS game_id_nodes ("
+            "node INTEGER PRIMARY KEY, host TEXT NOT NULL, pid INTEGER NOT NULL, allocated_at REAL NOT NULL)"
+        )
+        # 書き込みロックを先に取り、空きの確認と登録の間に他のプロセスが割り込まないようにする
+        conn.execute("BEGIN IMMEDIATE")
+        used = set()
+        for node, node_host, node_pid in conn.execute("SELECT node, host, pid FROM game_id_nodes"):
+            if node_host == host and node_pid == pid:
+                conn.execute("COMMIT")
+                return node
+            if node_host == host and not is_process_alive(node_pid):
+                conn.execute("DELETE FROM game_id_nodes WHERE node = ?", (node,))
+            else:
+                used.add(node)
+        node = next((n for n in range(GAME_ID_NODE_SPACE) if n not in used), None)
+        if node is not None:
+            conn.execute(
+                "INSERT INTO game_id_nodes (node, host, pid, allocated_at) VALUES (?, ?, ?, ?)",
+                (node, host, pid, time.time()),
+            )
+        conn.execute("COMMIT")
+        return node
+    finally:
+        conn.close()
+
+
+def release_game_id_node(node, path=None):
+    """プロセスの終了時にノード番号を割り当て表に返す"""
+    conn = sqlite3.connect(path or GAME_ID_NODE_DB, timeout=30)
+    try:
+        conn.execute(
+            "DELETE FROM game_id_nodes WHERE node = ? AND host = ? AND pid = ?",
+            (node, socket.gethostname(), os.getpid()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_game_id_node():
+    """このサーバープロセスのノード番号（0〜99）を決定する
+
+    環境変数で指定されていなければ、ローカルの割り当て表から確保する。
+    割り当て表は同じマシンのプロセス間でしか共有されないため、警告を出す。
+    """
+    env_node = os.environ.get(GAME_ID_NODE_ENV, "").strip()
+    if env_node.isdigit():
+        return int(env_node) % GAME_ID_NODE_SPACE
+
+    try:
+        node = allocate_game_id_node()
+    except sqlite3.Error:
+        logger.warning("GameIDのノード番号の割り当て表を使えませんでした", exc_info=True)
+        node = None
+    if node is None:
+        seed = f"{socket.gethostname()}:{os.getpid()}"
+        node = zlib.crc32(seed.encode()) % GAME_ID_NODE_SPACE
+        logger.warning(
+            "%s が未設定で割り当て表からも確保できなかったため、ノード番号 %d を"
+            "ホスト名とプロセスIDから決めました。他のプロセスと重なるとGameIDが衝突します",
+            GAME_ID_NODE_ENV, node,
+        )
+        return node
+
+    atexit.register(release_game_id_node, node, GAME_ID_NODE_DB)
+    logger.warning(
+        "%s が未設定のため、ノード番号 %d を %s から確保しました。"
+        "複数のマシンで動かす場合は、サーバーごとに異なる %s を設定してください",
+        GAME_ID_NODE_ENV, node, GAME_ID_NODE_DB, GAME_ID_NODE_ENV,
+    )
+    return node
+
+
+@st.cache_resource
+def get_game_id_state():
+    """GameID採番の状態（再実行・セッションをまたいでプロセス内で共有）"""
+    return {
+        "lock": threading.Lock(),
+        "node": get_game_id_node(),
+        "last_second": 0,
+        "last_seq": -1,
+    }
+
+
+def generate_game_id(now=None):
+    """時刻 + ノード + 連番で衝突しないGameIDを採番する（単調増加）"""
+    state = get_game_id_state()
+    second = int(now if now is not None else time.time())
+    with state["lock"]:
+        # 時計が巻き戻っても直前のIDより小さくしない
+        second = max(second, state["last_second"])
+        if second == state["last_second"]:
+            seq = state["last_seq"] + 1
+            if seq >= GAME_ID_SEQ_SPACE:
+                # 同一秒の連番を使い切ったら次の秒を前借りする
+                second += 1
+                seq = 0
+        else:
+            seq = 0
+        state["last_second"] = second
+        state["last_seq"] = seq
+    return (second * GAME_ID_NODE_SPACE + state["node"]) * GAME_ID_SEQ_SPACE + seq
+
+
+def normalize_game_id(game_id):
+    """GameIDを比較用の文字列に正規化する（floatの.0対策）"""
+    try:
+        return str(int(float(game_id)))
+    except (ValueError, TypeError):
+        return str(game_id).strip()
+
+
 def save_draft_to_sheet(
     player_count, draft_order, draft_results, first_round_order, draft_method, board
 ):
@@ -43,8 +529,9 @@ def save_draft_to_sheet(
     try:
         worksheet = get_score_sheet()
         jst = timezone(timedelta(hours=+9), "JST")
-        timestamp = datetime.now(jst).strftime("%Y-%m-%d %H:%M:%S")
-        game_id = int(datetime.now(jst).timestamp())
+        now = datetime.now(jst)
+        timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        game_id = generate_game_id(now.timestamp())
 
         # シートからヘッダーを取得
         all_values = worksheet.get_all_values()
@@ -75,20 +562,21 @@ def save_draft_to_sheet(
             turn_order = first_round_order.index(player_name) + 1
             # In auction mode, VP is deducted, not set to 0
             initial_score = (
-                10 if draft_method == "normal" else 10 - result.get("bid", 0)
+                10 if draft_method == "normal" else 10 - (result.bid or 0)
             )
 
             # データを辞書として作成
+            # GameIDは桁数が多く指数表記にされないよう文字列として書き込む
             data_dict = {
-                "GameID": game_id,
+                "GameID": f"'{game_id}",
                 "Timestamp": timestamp,
                 "PlayerCount": player_count,
                 "PlayerName": player_name,
                 "TurnOrder1R": turn_order,
                 "DraftMethod": draft_method,
-                "Nation": result["nation"],
-                "Executive": result["executive"],
-                "Contract": result["contract"],
+                "Nation": result.nation,
+                "Executive": result.executive,
+                "Contract": result.contract,
                 "InitialScore": initial_score,
                 "FinalScore": "",
                 "Board": board,
@@ -112,49 +600,152 @@ def save_draft_to_sheet(
             values=rows_to_append,
             value_input_option="USER_ENTERED",
         )
+        add_game_to_usage_counter(
+            game_id,
+            now.timestamp(),
+            [
+                (draft_results[name].nation, draft_results[name].executive)
+                for name in player_list
+            ],
+        )
+        add_draft_to_recency_index(
+            game_id,
+            board,
+            [
+                (name, draft_results[name].nation, draft_results[name].executive)
+                for name in player_list
+            ],
+        )
         return game_id
     except Exception as e:
         st.error(f"スプレッドシートへの書き込み中にエラーが発生しました: {e}")
         return None
 
 
-@st.cache_data(ttl=60)  # 1分キャッシュ
-def load_latest_game_from_sheet():
-    """スコアが未入力の最新のゲームデータをシートから読み込む"""
+def save_setup_events_to_sheet(game_id, events):
+    """ドラフト・オークションのイベント列をドラフトログシートに1回の書き込みで保存する"""
+    import gspread
+
+    if not events:
+        return True
     try:
-        worksheet = get_score_sheet()
-        # get_all_records()はヘッダーに重複（空文字含む）があるとエラーになるため、get_all_values()を使用する
-        all_values = worksheet.get_all_values()
-        if not all_values or len(all_values) < 2:
-            return None
+        sh = get_gspread_client().open_by_key(SPREADSHEET_KEY)
+        try:
+            ws = sh.worksheet(DRAFT_LOG_SHEET)
+        except gspread.WorksheetNotFound:
+            ws = sh.add_worksheet(title=DRAFT_LOG_SHEET, rows=1000, cols=len(DRAFT_LOG_HEADERS))
+            ws.append_row(DRAFT_LOG_HEADERS)
+
+        rows = []
+        for seq, event in enumerate(events):
+            data = {k: v for k, v in event.items() if k not in ("type", "player")}
+            rows.append([
+                # GameIDは桁数が多く指数表記にされないよう文字列として書き込む
+                f"'{game_id}",
+                seq,
+                event["type"],
+                event.get("player", ""),
+                json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+            ])
+        ws.append_rows(rows, value_input_option="USER_ENTERED")
+        return True
+    except Exception as e:
+        st.error(f"ドラフトログの保存中にエラーが発生しました: {e}")
+        return False
 
-        headers = all_values[0]
-        rows = all_values[1:]
-        df = pd.DataFrame(rows, columns=headers)
 
-        if "FinalScore" not in df.columns:
+@st.cache_data(ttl=60)
+def load_draft_log_from_sheet():
+    """ドラフトログシートの全行を読み込む（GameID・Seq順。バージョン付き）"""
+    import gspread
+
+    try:
+        sh = get_gspread_client().open_by_key(SPREADSHEET_KEY)
+        try:
+            ws = sh.worksheet(DRAFT_LOG_SHEET)
+        except gspread.WorksheetNotFound:
+            return None
+        all_values = ws.get_all_values()
+        if len(all_values) < 2:
             return None
 
-        # GameIDを数値型に変換（エラー回避）
-        if "GameID" in df.columns:
-            df["GameID"] = pd.to_numeric(df["GameID"], errors="coerce")
-            df = df.dropna(subset=["GameID"])
+        df = pd.DataFrame(all_values[1:], columns=all_values[0])
+        df["GameID"] = pd.to_numeric(df["GameID"], errors="coerce")
+        df["Seq"] = pd.to_numeric(df["Seq"], errors="coerce")
+        df = df.dropna(subset=["GameID", "Seq"]).sort_values(["GameID", "Seq"])
+        df.attrs["snapshot_version"] = compute_snapshot_version(df)
+        return df
+    except Exception:
+        return None
+
 
-        unscored_games = df[df["FinalScore"].astype(str).str.strip() == ""]
-        if unscored_games.empty:
-            return None
+def parse_setup_events(log_df):
+    """ドラフトログの行をゲームごとのイベント列にする（{GameID: 古い順のイベント}）"""
+    events = {}
+    if log_df is None or log_df.empty:
+        return events
+    for game_id, kind, player, data in zip(
+        log_df["GameID"].astype("int64"), log_df["Event"], log_df["Player"], log_df["Data"]
+    ):
+        event = {"type": kind, **json.loads(data or "{}")}
+        if player:
+            event["player"] = player
+        events.setdefault(int(game_id), []).append(event)
+    return events
 
-        latest_game_id = unscored_games["GameID"].max()
-        latest_game_df = unscored_games[
-            unscored_games["GameID"] == latest_game_id
-        ].copy()
 
-        return latest_game_df.to_dict("records")
+def load_setup_events_from_sheet():
+    """ドラフトログシートから全ゲームのイベント列を読み込む（{GameID: 古い順のイベント}）"""
+    try:
+        return parse_setup_events(load_draft_log_from_sheet())
+    except Exception:
+        return {}
+
+
+def load_latest_game_from_sheet():
+    """スコアが未入力の最新のゲームデータをシートから読み込む"""
+    note_cache_request("latest_game")
+    try:
+        return fetch_latest_game_from_sheet(cache_epoch(SHEET_CACHE_TTL))
     except Exception as e:
         st.error(f"ゲームデータの読み込み中にエラーが発生しました: {e}")
         return None
 
 
+@st.cache_data(ttl=2 * SHEET_CACHE_TTL)
+def fetch_latest_game_from_sheet(epoch):
+    """世代 epoch のスコア入力待ちゲームを読み込む（失敗は例外で返し、キャッシュしない）"""
+    note_cache_miss("latest_game")
+    worksheet = get_score_sheet()
+    # get_all_records()はヘッダーに重複（空文字含む）があるとエラーになるため、get_all_values()を使用する
+    all_values = worksheet.get_all_values()
+    if not all_values or len(all_values) < 2:
+        return None
+
+    headers = all_values[0]
+    rows = all_values[1:]
+    df = pd.DataFrame(rows, columns=headers)
+
+    if "FinalScore" not in df.columns:
+        return None
+
+    # GameIDを数値型に変換（エラー回避）
+    if "GameID" in df.columns:
+        df["GameID"] = pd.to_numeric(df["GameID"], errors="coerce")
+        df = df.dropna(subset=["GameID"])
+
+    unscored_games = df[df["FinalScore"].astype(str).str.strip() == ""]
+    if unscored_games.empty:
+        return None
+
+    latest_game_id = unscored_games["GameID"].max()
+    latest_game_df = unscored_games[
+        unscored_games["GameID"] == latest_game_id
+    ].copy()
+
+    return latest_game_df.to_dict("records")
+
+
 def delete_game_from_sheet(game_id):
     """指定されたGameIDのデータをシートから削除する"""
     try:
@@ -170,11 +761,7 @@ def delete_game_from_sheet(game_id):
             return False
 
         rows_to_delete = []
-        # GameIDの比較用文字列を作成（floatの.0対策）
-        try:
-            target_id_str = str(int(float(game_id)))
-        except (ValueError, TypeError):
-            target_id_str = str(game_id)
+        target_id_str = normalize_game_id(game_id)
 
         # Row 1 in sheet is all_values[0].
         # We need 1-based index for delete_rows.
@@ -182,14 +769,8 @@ def delete_game_from_sheet(game_id):
             if i == 0:
                 continue
             if len(row) > game_id_col_idx:
-                cell_val = str(row[game_id_col_idx]).strip()
-                # セル側も同様に処理（念のため）
-                try:
-                    cell_val_norm = str(int(float(cell_val)))
-                except (ValueError, TypeError):
-                    cell_val_norm = cell_val
-
-                if cell_val_norm == target_id_str:
+                # セル側も同様に正規化して比較
+                if normalize_game_id(row[game_id_col_idx]) == target_id_str:
                     rows_to_delete.append(i + 1)
 
         if not rows_to_delete:
@@ -200,6 +781,13 @@ def delete_game_from_sheet(game_id):
         for row_num in rows_to_delete:
             worksheet.delete_rows(row_num)
 
+        remove_game_from_usage_counter(game_id)
+        remove_pending_game_from_incremental_index(get_recency_index_store(), game_id)
+        # 削除したゲームの指名・入札がドラフト傾向の集計に残らないよう、ログも消す
+        try:
+            delete_draft_log_rows(game_id)
+        except Exception as e:
+            st.warning(f"ドラフトログの削除中にエラーが発生しました: {e}")
         st.cache_data.clear()
         return True
     except Exception as e:
@@ -207,37 +795,267 @@ def delete_game_from_sheet(game_id):
         return False
 
 
-@st.cache_data(ttl=60)
-def get_recent_usage_counts(limit=10):
-    """直近のゲーム（指定数）で使用された国家・重役の出現回数を取得する"""
+def delete_draft_log_rows(game_id):
+    """ドラフトログシートから指定されたGameIDの行を削除する（シートがなければ何もしない）"""
+    import gspread
+
     try:
-        worksheet = get_score_sheet()
-        all_values = worksheet.get_all_values()
-        if not all_values or len(all_values) < 2:
-            return {}, {}
+        ws = get_gspread_client().open_by_key(SPREADSHEET_KEY).worksheet(DRAFT_LOG_SHEET)
+    except gspread.WorksheetNotFound:
+        return
+    target_id_str = normalize_game_id(game_id)
+    rows_to_delete = [
+        i + 1
+        for i, row in enumerate(ws.get_all_values())
+        if i > 0 and row and normalize_game_id(row[0]) == target_id_str
+    ]
 
-        headers = all_values[0]
-        df = pd.DataFrame(all_values[1:], columns=headers)
+    # 1ゲームのイベントは続けて書き込むので、連続する行をまとめて下から削除する
+    ranges = []
+    for row_num in rows_to_delete:
+        if ranges and ranges[-1][1] == row_num - 1:
+            ranges[-1][1] = row_num
+        else:
+            ranges.append([row_num, row_num])
+    for start, end in reversed(ranges):
+        ws.delete_rows(start, end)
+
+
+class UsageWindowCounter:
+    """直近 N ゲーム / 直近 D 日の国家・重役の出現回数を増分で保持する
+
+    ゲームを GameID 順（日数の期間は時刻順）に並べて持ち、期間ごとに
+    出現回数の辞書を保つ。追加・削除のたびに期間へ出入りするゲームは
+    高々1つなので、更新は O(プレイヤー数) の加減算で済む。日数の期間は
+    問い合わせ時に、期限切れになったゲームを古い順に差し引く。
+    """
+
+    def __init__(self, windows=USAGE_COUNTER_WINDOWS, games=None, now=None):
+        # GameID -> (時刻(UNIX秒 or None), [(国家, 重役), ...])
+        self.games = dict(games or {})
+        self.order = sorted(self.games)  # GameID 昇順
+        # (時刻, GameID) 昇順（時刻のあるゲームのみ）
+        self.time_order = sorted(
+            (timestamp, game_id)
+            for game_id, (timestamp, _) in self.games.items()
+            if timestamp is not None
+        )
+        self.windows = {}
+        for window in windows:
+            self.ensure_window(window, now)
 
-        if (
-            "GameID" not in df.columns
-            or "Nation" not in df.columns
-            or "Executive" not in df.columns
+    def ensure_window(self, window, now=None):
+        """期間を追加する（既存のゲームから一度だけ数え直す）"""
+        if window in self.windows:
+            return
+        kind, size = window
+        state = {"nations": {}, "executives": {}}
+        self.windows[window] = state
+        if kind == "games":
+            for game_id in self.order[-size:]:
+                self._apply(state, game_id, 1)
+        else:
+            state["cutoff"] = (time.time() if now is None else now) - size * 86400
+            state["start"] = bisect_left(self.time_order, (state["cutoff"],))
+            for _, game_id in self.time_order[state["start"]:]:
+                self._apply(state, game_id, 1)
+
+    def _apply(self, state, game_id, sign):
+        for nation, executive in self.games[game_id][1]:
+            for counts, item in ((state["nations"], nation), (state["executives"], executive)):
+                count = counts.get(item, 0) + sign
+                if count:
+                    counts[item] = count
+                else:
+                    counts.pop(item, None)
+
+    def add_game(self, game_id, timestamp, picks):
+        """ゲームを追加する（同じGameIDがあれば置き換える）"""
+        if game_id in self.games:
+            self.remove_game(game_id)
+        self.games[game_id] = (timestamp, list(picks))
+
+        pos = bisect_left(self.order, game_id)
+        self.order.insert(pos, game_id)
+        n = len(self.order)
+        time_pos = None
+        if timestamp is not None:
+            time_pos = bisect_left(self.time_order, (timestamp, game_id))
+            self.time_order.insert(time_pos, (timestamp, game_id))
+
+        for (kind, size), state in self.windows.items():
+            if kind == "games":
+                if pos >= n - size:
+                    self._apply(state, game_id, 1)
+                    # 期間から押し出されるゲーム
+                    if n > size:
+                        self._apply(state, self.order[n - size - 1], -1)
+            elif time_pos is not None:
+                if timestamp >= state["cutoff"]:
+                    self._apply(state, game_id, 1)
+                else:
+                    state["start"] += 1
+
+    def remove_game(self, game_id):
+        """ゲームを削除する"""
+        if game_id not in self.games:
+            return
+        timestamp = self.games[game_id][0]
+        pos = bisect_left(self.order, game_id)
+        n = len(self.order)
+        time_pos = (
+            bisect_left(self.time_order, (timestamp, game_id)) if timestamp is not None else None
+        )
+
+        for (kind, size), state in self.windows.items():
+            if kind == "games":
+                if pos >= n - size:
+                    self._apply(state, game_id, -1)
+                    # 期間に入ってくるゲーム
+                    if n > size:
+                        self._apply(state, self.order[n - size - 1], 1)
+            elif time_pos is not None:
+                if time_pos >= state["start"]:
+                    self._apply(state, game_id, -1)
+                else:
+                    state["start"] -= 1
+
+        del self.order[pos]
+        if time_pos is not None:
+            del self.time_order[time_pos]
+        del self.games[game_id]
+
+    def counts(self, window, now=None):
+        """期間内の (国家の出現回数, 重役の出現回数) を返す"""
+        self.ensure_window(window, now)
+        kind, size = window
+        state = self.windows[window]
+        if kind == "days":
+            cutoff = (time.time() if now is None else now) - size * 86400
+            if cutoff > state["cutoff"]:
+                state["cutoff"] = cutoff
+                while (
+                    state["start"] < len(self.time_order)
+                    and self.time_order[state["start"]][0] < cutoff
+                ):
+                    self._apply(state, self.time_order[state["start"]][1], -1)
+                    state["start"] += 1
+        return dict(state["nations"]), dict(state["executives"])
+
+
+def build_usage_counter(all_values, windows=USAGE_COUNTER_WINDOWS, now=None):
+    """スコア記録シートの全行（スコア未入力のゲームも含む）から出現回数を作る"""
+    if not all_values or len(all_values) < 2:
+        return UsageWindowCounter(windows)
+
+    df = pd.DataFrame(all_values[1:], columns=all_values[0])
+    if not {"GameID", "Nation", "Executive"}.issubset(df.columns):
+        return UsageWindowCounter(windows)
+
+    df["GameID"] = pd.to_numeric(df["GameID"], errors="coerce")
+    df = df.dropna(subset=["GameID"])
+    # シートの時刻はJSTの文字列なので、UNIX秒にそろえる（読めなければ None）
+    if "Timestamp" in df.columns:
+        timestamps = pd.to_datetime(df["Timestamp"], errors="coerce").dt.tz_localize("Asia/Tokyo")
+        df["Seconds"] = (timestamps - pd.Timestamp(0, tz="UTC")).dt.total_seconds()
+    else:
+        df["Seconds"] = np.nan
+
+    games = {}
+    for game_id, seconds, nation, executive in zip(
+        df["GameID"].astype("int64").tolist(), df["Seconds"].tolist(),
+        df["Nation"].tolist(), df["Executive"].tolist(),
+    ):
+        if game_id not in games:
+            games[game_id] = (None if seconds != seconds else seconds, [])
+        games[game_id][1].append((nation, executive))
+    return UsageWindowCounter(windows, games, now)
+
+
+@st.cache_resource
+def get_usage_counter_store():
+    """国家・重役の出現回数の保持領域（保存・削除のたびに増分更新する）"""
+    # pending: 作り直しの最中に届いた追加・削除（作り直した出現回数に後から適用する）
+    return {
+        "lock": threading.Lock(),
+        "counter": None,
+        "built_at": None,
+        "rebuilding": False,
+        "pending": [],
+    }
+
+
+def get_usage_counter():
+    """出現回数を返す（未構築か古くなっていればシートから作り直す）
+
+    シートの読み込みはロックの外で行い、でき上がった出現回数に
+    その間の追加・削除を適用してから差し替える。
+    作り直しの最中は、他のセッションには古い出現回数を返す。
+    """
+    store = get_usage_counter_store()
+    with store["lock"]:
+        counter = store["counter"]
+        if counter is not None and (
+            store["rebuilding"]
+            or time.time() - store["built_at"] <= USAGE_COUNTER_REFRESH_SECONDS
         ):
-            return {}, {}
+            return counter
+        store["rebuilding"] = True
+        store["pending"] = []
 
-        # GameIDのユニーク値を出現順に取得
-        # (スプレッドシートは追記型なので、下の行ほど新しいと仮定)
-        unique_games = df["GameID"].unique()
-        recent_games = unique_games[-limit:]
+    try:
+        worksheet = get_score_sheet()
+        rebuilt = build_usage_counter(worksheet.get_all_values())
+    except Exception:
+        with store["lock"]:
+            store["rebuilding"] = False
+            store["pending"] = []
+        raise
+
+    with store["lock"]:
+        for op, args in store["pending"]:
+            getattr(rebuilt, op)(*args)
+        store["counter"] = rebuilt
+        store["built_at"] = time.time()
+        store["rebuilding"] = False
+        store["pending"] = []
+        return rebuilt
+
+
+def add_game_to_usage_counter(game_id, timestamp, picks):
+    """シートに書き込んだゲームを出現回数に加える（O(プレイヤー数)）"""
+    store = get_usage_counter_store()
+    with store["lock"]:
+        args = (int(game_id), timestamp, list(picks))
+        if store["rebuilding"]:
+            store["pending"].append(("add_game", args))
+        # 未構築なら次回の参照時にシートから作る
+        if store["counter"] is not None:
+            store["counter"].add_game(*args)
+
+
+def remove_game_from_usage_counter(game_id):
+    """シートから削除したゲームを出現回数から除く（O(プレイヤー数)）"""
+    store = get_usage_counter_store()
+    with store["lock"]:
+        args = (int(float(game_id)),)
+        if store["rebuilding"]:
+            store["pending"].append(("remove_game", args))
+        if store["counter"] is not None:
+            store["counter"].remove_game(*args)
 
-        recent_df = df[df["GameID"].isin(recent_games)]
 
-        nation_counts = recent_df["Nation"].value_counts().to_dict()
-        exec_counts = recent_df["Executive"].value_counts().to_dict()
+def get_recent_usage_counts(limit=10):
+    """直近のゲーム（指定数）で使用された国家・重役の出現回数を取得する
 
-        return nation_counts, exec_counts
-    except Exception as e:
+    シートは読まず、保存・削除のたびに更新している出現回数から返す。
+    """
+    try:
+        counter = get_usage_counter()
+        store = get_usage_counter_store()
+        with store["lock"]:
+            return counter.counts(("games", limit))
+    except Exception:
         # エラー時は空の辞書を返して、重み付けなし（通常のランダム）として動作させる
         return {}, {}
 
@@ -273,50 +1091,61 @@ def get_last_game_players():
         return []
 
 
-@st.cache_data(ttl=60)
 def get_preset_data():
     """プリセットシートからデータを読み込む"""
+    note_cache_request("presets")
     try:
-        sh = get_gspread_client().open_by_key(SPREADSHEET_KEY)
-        try:
-            ws = sh.worksheet(PRESET_SHEET)
-        except gspread.WorksheetNotFound:
-            return {}
-
-        data = ws.get_all_records()
-        presets = {}
-        for row in data:
-            name = str(row.get("PresetName", "")).strip()
-            if name:
-                # PlayerCountが空や不正な場合はデフォルト4
-                try:
-                    p_count = int(row.get("PlayerCount", 4))
-                except:
-                    p_count = 4
-
-                presets[name] = {
-                    "nations": [
-                        x.strip()
-                        for x in str(row.get("Nations", "")).split(",")
-                        if x.strip()
-                    ],
-                    "executives": [
-                        x.strip()
-                        for x in str(row.get("Executives", "")).split(",")
-                        if x.strip()
-                    ],
-                    "count": p_count,
-                    "board": str(row.get("Board", "通常")),
-                    "is_default": str(row.get("IsDefault", "")).upper()
-                    in ["TRUE", "1", "YES"],
-                }
-        return presets
-    except Exception as e:
+        return fetch_preset_data(cache_epoch(SHEET_CACHE_TTL))
+    except Exception:
+        return {}
+
+
+@st.cache_data(ttl=2 * SHEET_CACHE_TTL)
+def fetch_preset_data(epoch):
+    """世代 epoch のプリセットを読み込む（失敗は例外で返し、キャッシュしない）"""
+    import gspread
+
+    note_cache_miss("presets")
+    sh = get_gspread_client().open_by_key(SPREADSHEET_KEY)
+    try:
+        ws = sh.worksheet(PRESET_SHEET)
+    except gspread.WorksheetNotFound:
         return {}
 
+    data = ws.get_all_records()
+    presets = {}
+    for row in data:
+        name = str(row.get("PresetName", "")).strip()
+        if name:
+            # PlayerCountが空や不正な場合はデフォルト4
+            try:
+                p_count = int(row.get("PlayerCount", 4))
+            except:
+                p_count = 4
+
+            presets[name] = {
+                "nations": [
+                    x.strip()
+                    for x in str(row.get("Nations", "")).split(",")
+                    if x.strip()
+                ],
+                "executives": [
+                    x.strip()
+                    for x in str(row.get("Executives", "")).split(",")
+                    if x.strip()
+                ],
+                "count": p_count,
+                "board": str(row.get("Board", "通常")),
+                "is_default": str(row.get("IsDefault", "")).upper()
+                in ["TRUE", "1", "YES"],
+            }
+    return presets
+
 
 def set_default_preset(target_name):
     """指定したプリセットをデフォルトに設定する"""
+    import gspread
+
     try:
         sh = get_gspread_client().open_by_key(SPREADSHEET_KEY)
         ws = sh.worksheet(PRESET_SHEET)
@@ -362,6 +1191,8 @@ def set_default_preset(target_name):
 
 def save_preset_data(name, nations, execs, count, board):
     """現在の選択状態をプリセットとして保存する"""
+    import gspread
+
     try:
         sh = get_gspread_client().open_by_key(SPREADSHEET_KEY)
         try:
@@ -397,6 +1228,8 @@ def save_preset_data(name, nations, execs, count, board):
 @st.cache_data(ttl=60)
 def get_balance_log():
     """バランス調整履歴を取得する"""
+    import gspread
+
     try:
         sh = get_gspread_client().open_by_key(SPREADSHEET_KEY)
         try:
@@ -412,6 +1245,8 @@ def get_balance_log():
 
 def add_balance_log(date_str, note, version=None):
     """バランス調整履歴を追加する（同日なら追記、バージョン名は自動生成）"""
+    import gspread
+
     try:
         sh = get_gspread_client().open_by_key(SPREADSHEET_KEY)
         try:
@@ -495,7 +1330,7 @@ def update_scores_in_sheet(game_id, player_scores):
         player_name_col = header.index("PlayerName") + 1
         final_score_col = header.index("FinalScore") + 1
 
-        cell_list = worksheet.findall(str(game_id), in_column=game_id_col)
+        cell_list = worksheet.findall(normalize_game_id(game_id), in_column=game_id_col)
 
         for cell in cell_list:
             row_num = cell.row
@@ -511,39 +1346,48 @@ def update_scores_in_sheet(game_id, player_scores):
 
 
 # --- データ読み込みとキャッシュ ---
-@st.cache_data(ttl=1800)
 def get_master_data(worksheet_name):
     """指定されたワークシートからデータを読み込み、DataFrameとして返す"""
+    note_cache_request("masters")
     try:
-        gc = get_gspread_client()
-        sh = gc.open_by_key(SPREADSHEET_KEY)
-        worksheet = sh.worksheet(worksheet_name)
-        data = worksheet.get_all_values()
-        if len(data) < 2:
-            return None
-        headers = data[0]
-        df_data = data[1:]
-        df = pd.DataFrame(df_data, columns=headers)
-
-        # バージョン管理（EffectiveDateがある場合、最新のみを返す）
-        if "EffectiveDate" in df.columns:
-            # 日付型に変換
-            df["EffectiveDate"] = pd.to_datetime(df["EffectiveDate"], errors="coerce")
-            # 今日以前のデータのみ対象
-            today = datetime.now()
-            df = df[
-                (df["EffectiveDate"] <= today) | (pd.isna(df["EffectiveDate"]))
-            ]
-            # 日付昇順ソートして、同じ名前なら最後の行（最新）を採用
-            df = df.sort_values("EffectiveDate")
-            df = df.drop_duplicates(subset=["Name"], keep="last")
-
-        return df
+        return fetch_master_data(worksheet_name, cache_epoch(MASTER_CACHE_TTL))
     except Exception as e:
         st.error(f"データ読み込み中にエラーが発生しました: {e}")
         return None
 
 
+@st.cache_data(ttl=2 * MASTER_CACHE_TTL)
+def fetch_master_data(worksheet_name, epoch):
+    """世代 epoch のマスタを読み込む（失敗は例外で返し、キャッシュしない）"""
+    note_cache_miss("masters")
+    started = time.perf_counter()
+    gc = get_gspread_client()
+    sh = gc.open_by_key(SPREADSHEET_KEY)
+    worksheet = sh.worksheet(worksheet_name)
+    data = worksheet.get_all_values()
+    if len(data) < 2:
+        return None
+    headers = data[0]
+    df_data = data[1:]
+    df = pd.DataFrame(df_data, columns=headers)
+
+    # バージョン管理（EffectiveDateがある場合、最新のみを返す）
+    if "EffectiveDate" in df.columns:
+        # 日付型に変換
+        df["EffectiveDate"] = pd.to_datetime(df["EffectiveDate"], errors="coerce")
+        # 今日以前のデータのみ対象
+        today = datetime.now()
+        df = df[
+            (df["EffectiveDate"] <= today) | (pd.isna(df["EffectiveDate"]))
+        ]
+        # 日付昇順ソートして、同じ名前なら最後の行（最新）を採用
+        df = df.sort_values("EffectiveDate")
+        df = df.drop_duplicates(subset=["Name"], keep="last")
+
+    record_startup_phase("master_fetch", time.perf_counter() - started)
+    return df
+
+
 def image_to_data_url(filepath: str) -> str:
     """画像ファイルを読み込み、Base64エンコードされたデータURLに変換する。"""
     try:
@@ -563,6 +1407,198 @@ def image_to_data_url(filepath: str) -> str:
         return ""
 
 
+# --- セットアップの状態 ---
+# 多くのセッションが状態と操作履歴を同時に持つため、game_setup とその中身は辞書ではなく
+# __slots__ のレコードで持つ（キーごとのハッシュ表を持たないぶん小さい）。
+# 初期契約はマスタのIDと名前だけを持ち、説明文などの行は表示のたびにマスタから引く。
+UNSET_FIELD = object()
+
+
+class SetupRecord:
+    """__slots__ のフィールドだけを持つレコードの基底クラス（未設定のフィールドは持たない）"""
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def _asdict(self):
+        """設定済みのフィールドを辞書で返す"""
+        return {name: getattr(self, name) for name in self.__slots__ if hasattr(self, name)}
+
+    def _replace(self, **changes):
+        """フィールドの一部を変えた新しいレコードを返す（元のレコードは書き換えない）"""
+        record = object.__new__(type(self))
+        for name in self.__slots__:
+            if name not in changes:
+                value = getattr(self, name, UNSET_FIELD)
+                if value is not UNSET_FIELD:
+                    setattr(record, name, value)
+        for name, value in changes.items():
+            setattr(record, name, value)
+        return record
+
+    def __eq__(self, other):
+        # Streamlit は再実行のたびにクラスを作り直すので、型ではなくフィールドで比べる
+        if getattr(other, "__slots__", None) != self.__slots__:
+            return NotImplemented
+        return self._asdict() == other._asdict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={value!r}" for name, value in self._asdict().items())
+        return f"{type(self).__name__}({fields})"
+
+
+class AuctionBid(SetupRecord):
+    """入札ボードの1マス（誰が何VPで入札しているか）"""
+
+    __slots__ = ("player", "bid")
+
+
+class BidderStatus(SetupRecord):
+    """オークション中のプレイヤーの状態（bidding / placed / displaced）"""
+
+    __slots__ = ("status", "turn_order", "bid")
+
+
+class DraftPick(SetupRecord):
+    """ドラフトで確定した国家・重役・初期契約（オークションでは入札額も）"""
+
+    __slots__ = ("nation", "executive", "contract", "bid")
+
+
+class SetupState(SetupRecord):
+    """進行中のセットアップ（game_setup）。辞書と同じ書き方で読み書きできる"""
+
+    __slots__ = (
+        "player_count",
+        "player_names",
+        "draft_candidate_count_option",
+        "balanced_pairing",
+        "pairing_spread",
+        "banned_pairs",
+        "require_patched_executive",
+        "avoid_recent_nations",
+        "selected_nations",
+        "selected_executives",
+        "draft_order",
+        "nation_exec_candidates",
+        "contract_candidates",
+        "contract_names",
+        "draft_results",
+        "draft_method",
+        "draft_turn_index",
+        "current_selection_ne",
+        "current_selection_contract",
+        "board",
+        "auction_board",
+        "auction_player_status",
+        "auction_log",
+        "setup_events",
+        "auction_phase",
+        "final_turn_order",
+        "auction_draft_order",
+        "saved_game_id",
+    )
+    _fields = frozenset(__slots__)
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._fields and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        return [name for name in self.__slots__ if hasattr(self, name)]
+
+    def items(self):
+        return self._asdict().items()
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self._fields else default
+
+    def update(self, changes=(), **kwargs):
+        for key, value in dict(changes, **kwargs).items():
+            self[key] = value
+
+
+SETUP_RECORD_TYPES = {
+    record_type.__name__: record_type
+    for record_type in (SetupState, AuctionBid, BidderStatus, DraftPick)
+}
+
+
+# チェックポイントではレコードを (SETUP_RECORD_TAG, 型名, フィールドの辞書) の平たい形にする。
+# Streamlit は再実行のたびに __main__ とクラスを作り直すので、クラスへの参照は保存せず、
+# 読み込むときに今回の実行のクラスで組み立て直す。
+SETUP_RECORD_TAG = "__setup_record__"
+
+
+def encode_setup_value(value):
+    """game_setup の値を marshal できる形（レコードは型名のタグ付きタプル）にする"""
+    type_name = type(value).__name__
+    if type_name in SETUP_RECORD_TYPES and hasattr(value, "_asdict"):
+        return (
+            SETUP_RECORD_TAG,
+            type_name,
+            {name: encode_setup_value(item) for name, item in value._asdict().items()},
+        )
+    if isinstance(value, dict):
+        return {encode_setup_value(key): encode_setup_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(encode_setup_value(item) for item in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode_setup_value(value):
+    """encode_setup_value の逆（レコードは今回の実行のクラスで作る）"""
+    if isinstance(value, tuple):
+        if len(value) == 3 and value[0] == SETUP_RECORD_TAG:
+            fields = {name: decode_setup_value(item) for name, item in value[2].items()}
+            return SETUP_RECORD_TYPES[value[1]](**fields)
+        return tuple(decode_setup_value(item) for item in value)
+    if isinstance(value, list):
+        return [decode_setup_value(item) for item in value]
+    if isinstance(value, dict):
+        return {decode_setup_value(key): decode_setup_value(item) for key, item in value.items()}
+    return value
+
+
+def get_contract_rows(contract_df, contract_ids, contract_names):
+    """初期契約のIDをマスタの行（辞書）にする。マスタから消えた契約は名前だけ返す"""
+    rows = {}
+    if contract_df is not None:
+        rows = {
+            row["ID"]: row
+            for row in contract_df[contract_df["ID"].isin(contract_ids)].to_dict("records")
+        }
+    return [
+        rows.get(contract_id, {"ID": contract_id, "Name": contract_names.get(contract_id, "N/A")})
+        for contract_id in contract_ids
+    ]
+
+
 # --- セッション管理 ---
 def initialize_session_state():
     """セッション変数を初期化する"""
@@ -570,7 +1606,7 @@ def initialize_session_state():
         st.session_state.screen = "landing"
 
     if "game_setup" not in st.session_state:
-        st.session_state.game_setup = {}
+        st.session_state.game_setup = SetupState()
 
     if "active_game" not in st.session_state:
         st.session_state.active_game = None
@@ -578,27 +1614,38 @@ def initialize_session_state():
 
 def reset_game_setup():
     """進行中のゲームセットアップ情報をリセットする"""
-    st.session_state.game_setup = {
-        "player_count": 4,
-        "player_names": [],
-        "draft_candidate_count_option": "人数と同じ",
-        "selected_nations": [],
-        "selected_executives": [],
-        "draft_order": [],
-        "nation_exec_candidates": [],
-        "contract_candidates": [],
-        "draft_results": {},
-        "draft_method": "",
-        "draft_turn_index": 0,
-        "current_selection_ne": None,
-        "current_selection_contract": None,
-        "board": "通常",
+    st.session_state.game_setup = SetupState(
+        player_count=4,
+        player_names=[],
+        draft_candidate_count_option="人数と同じ",
+        balanced_pairing=False,
+        pairing_spread=None,
+        banned_pairs=[],
+        require_patched_executive=False,
+        avoid_recent_nations=0,
+        selected_nations=[],
+        selected_executives=[],
+        draft_order=[],
+        nation_exec_candidates=[],
+        contract_candidates=[],  # 初期契約マスタのID
+        contract_names={},  # {ID: 契約名}
+        draft_results={},  # {プレイヤー: DraftPick}
+        draft_method="",
+        draft_turn_index=0,
+        current_selection_ne=None,
+        current_selection_contract=None,  # 初期契約マスタのID
+        board="通常",
         # --- Auction State ---
-        "auction_board": {},  # {1: {'player': 'A', 'bid': 2}, 2: ...}
-        "auction_player_status": {},  # {'A': 'placed', 'B': 'displaced'}
-        "auction_log": [],
-        "auction_phase": "bidding",  # bidding or drafting
-    }
+        auction_board={},  # {手番: AuctionBid}
+        auction_player_status={},  # {プレイヤー: BidderStatus}
+        auction_log=None,  # 新しい順の連結リスト (メッセージ, 残り)
+        setup_events=None,  # 確定した操作のイベント（新しい順の連結リスト）
+        auction_phase="bidding",  # bidding or drafting
+    )
+    clear_setup_history()
+    # 新しいセットアップには新しい再開コードを振る
+    st.session_state.pop("resume_code", None)
+    st.session_state.pop("checkpointed", None)
     # プレイヤー名の入力欄をリセット
     for key in list(st.session_state.keys()):
         if key.startswith("player_"):
@@ -645,47 +1692,433 @@ def reset_game_setup():
             st.session_state[f"player_{idx}"] = name
 
 
-# --- 画面描画関数 ---
+# --- セットアップのチェックポイント ---
+# 接続が切れたりサーバーが再起動したりしても進行中のセットアップを失わないよう、
+# 遷移のたびに (画面, game_setup) を marshal + zlib で圧縮してローカルのSQLiteに保存する。
+# 保存するのはこのアプリ自身が作った状態だけで、再開コードで読み戻す。
+@st.cache_resource
+def get_checkpoint_store():
+    """チェックポイント用SQLite接続（プロセス内で共有）"""
+    conn = sqlite3.connect(SESSION_CHECKPOINT_DB, check_same_thread=False)
+    # WAL + synchronous=NORMAL なら1回の保存は fsync を待たずに済む
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS setup_checkpoints ("
+        "code TEXT PRIMARY KEY, updated_at REAL NOT NULL, screen TEXT NOT NULL, state BLOB NOT NULL)"
+    )
+    conn.execute(
+        "DELETE FROM setup_checkpoints WHERE updated_at < ?",
+        (time.time() - SESSION_CHECKPOINT_RETENTION_DAYS * 86400,),
+    )
+    conn.commit()
+    return {"conn": conn, "lock": threading.Lock()}
 
 
-def check_and_handle_auction_end(setup_data):
-    """オークションの終了条件をチェックし、終了していれば状態を更新する"""
-    # Check if any player is still bidding or displaced
-    for player_status in setup_data["auction_player_status"].values():
-        if player_status["status"] != "placed":
-            return  # Auction is not over
+def generate_resume_code():
+    """再開コードを作る"""
+    return "".join(secrets.choice(RESUME_CODE_ALPHABET) for _ in range(RESUME_CODE_LENGTH))
 
-    # --- If we reach here, the auction is over ---
-    setup_data["auction_phase"] = "drafting"
-    setup_data["draft_turn_index"] = 0  # Reset for drafting phase
 
-    # Create final turn order list
-    final_order = [None] * setup_data["player_count"]
-    for i in range(1, setup_data["player_count"] + 1):
-        # Handle cases where a turn order spot might not be filled (unlikely in normal flow)
-        if i in setup_data["auction_board"]:
-            player_name = setup_data["auction_board"][i]["player"]
-            final_order[i - 1] = player_name
+def normalize_resume_code(code):
+    """入力された再開コードを大文字・記号なしにそろえる"""
+    return "".join(ch for ch in (code or "").upper() if ch.isalnum())
 
-    setup_data["final_turn_order"] = final_order
-    setup_data["auction_draft_order"] = list(reversed(final_order))
 
-    log_message = "全員の入札が確定しました。オークション終了！ドラフトを開始します。"
-    setup_data["auction_log"].insert(0, log_message)
+def save_setup_checkpoint(code, screen, game_setup):
+    """進行中のセットアップを保存する"""
+    state = zlib.compress(
+        marshal.dumps((SESSION_CHECKPOINT_FORMAT, encode_setup_value(game_setup))), 1
+    )
+    store = get_checkpoint_store()
+    with store["lock"]:
+        store["conn"].execute(
+            "INSERT OR REPLACE INTO setup_checkpoints (code, updated_at, screen, state) VALUES (?, ?, ?, ?)",
+            (code, time.time(), screen, state),
+        )
+        store["conn"].commit()
 
 
-def show_landing_screen():
-    """アプリ起動時の初期画面"""
-    st.title("バラージ セットアップ & スコア管理")
+def load_setup_checkpoint(code):
+    """再開コードのセットアップを (画面, game_setup) で返す（無ければ None）"""
+    store = get_checkpoint_store()
+    with store["lock"]:
+        row = store["conn"].execute(
+            "SELECT screen, state FROM setup_checkpoints WHERE code = ?", (code,)
+        ).fetchone()
+    if row is None:
+        return None
+    screen, state = row
+    try:
+        payload = marshal.loads(zlib.decompress(state))
+    except (EOFError, ValueError, TypeError):
+        # 形式が変わる前（pickle）に保存されたものは読めない
+        return None
+    if not isinstance(payload, tuple) or payload[0] != SESSION_CHECKPOINT_FORMAT:
+        return None
+    return screen, decode_setup_value(payload[1])
 
-    col1, col2 = st.columns([0.7, 0.3])
-    with col2:
-        if st.button("最新の情報に更新", use_container_width=True):
-            st.cache_data.clear()
-            st.session_state.active_game = None
-            st.rerun()
 
-    latest_game = st.session_state.active_game
+def delete_setup_checkpoint(code):
+    """保存済みのセットアップを消す（ゲーム開始後は不要）"""
+    if not code:
+        return
+    store = get_checkpoint_store()
+    with store["lock"]:
+        store["conn"].execute("DELETE FROM setup_checkpoints WHERE code = ?", (code,))
+        store["conn"].commit()
+
+
+def checkpoint_setup_session():
+    """セットアップ中の画面なら、前回の保存から状態が変わっていれば保存する
+
+    遷移は game_setup を新しいレコードに置き換えるので、同一性の比較だけで変化を判定できる。
+    """
+    screen = st.session_state.screen
+    if screen not in SESSION_CHECKPOINT_SCREENS:
+        return
+    game_setup = st.session_state.game_setup
+    last = st.session_state.get("checkpointed")
+    if last is not None and last[0] == screen and last[1] is game_setup:
+        return
+    if "resume_code" not in st.session_state:
+        st.session_state.resume_code = generate_resume_code()
+    try:
+        save_setup_checkpoint(st.session_state.resume_code, screen, game_setup)
+        st.session_state.checkpointed = (screen, game_setup)
+    except (sqlite3.Error, ValueError, OSError):
+        # 保存できなくてもセットアップは続けられる
+        pass
+
+
+def resume_setup_session(code):
+    """再開コードのセットアップをこのセッションに読み込む（見つからなければ False）"""
+    code = normalize_resume_code(code)
+    try:
+        checkpoint = load_setup_checkpoint(code)
+    except (sqlite3.Error, KeyError, TypeError, zlib.error):
+        return False
+    if checkpoint is None:
+        return False
+    screen, game_setup = checkpoint
+    st.session_state.game_setup = game_setup
+    st.session_state.screen = screen
+    st.session_state.resume_code = code
+    st.session_state.checkpointed = (screen, game_setup)
+    clear_setup_history()
+    return True
+
+
+# --- 操作履歴（元に戻す・やり直す） ---
+# game_setup は遷移のたびに直前の状態._replace(**変更) で新しいレコードを作り、
+# 変更しないキーの値は直前の状態と共有する。履歴は (game_setup, 画面) を
+# 連結リスト (先頭, 残り) で積むだけなので、1手あたりの増分はキーの参照分で済み、
+# 元に戻す・やり直すは O(1)。遷移関数は元の状態を書き換えてはいけない。
+def clear_setup_history():
+    """元に戻す・やり直すの履歴を空にする"""
+    st.session_state.setup_undo = None
+    st.session_state.setup_redo = None
+
+
+def select_setup_tile(**changes):
+    """タイルの選択を変える（操作履歴には積まない）
+
+    game_setup をその場で書き換えず新しいレコードにするので、
+    checkpoint_setup_session が変化に気づいて選択中の状態も保存する。
+    """
+    st.session_state.game_setup = st.session_state.game_setup._replace(**changes)
+
+
+def commit_setup_move(changes, event=None):
+    """遷移の変更を game_setup に適用し、直前の状態を履歴に積む
+
+    event を渡すと操作のイベント列にも積む（元に戻すとイベントも一緒に戻る）。
+    """
+    game_setup = st.session_state.game_setup
+    st.session_state.setup_undo = (
+        (game_setup, st.session_state.screen),
+        st.session_state.get("setup_undo"),
+    )
+    st.session_state.setup_redo = None
+    if event is not None:
+        changes = {**changes, "setup_events": (event, game_setup.get("setup_events"))}
+    st.session_state.game_setup = game_setup._replace(**changes)
+
+
+def undo_setup_move():
+    """直前の操作を取り消す"""
+    history = st.session_state.get("setup_undo")
+    if history is None:
+        return
+    (game_setup, screen), st.session_state.setup_undo = history
+    st.session_state.setup_redo = (
+        (st.session_state.game_setup, st.session_state.screen),
+        st.session_state.get("setup_redo"),
+    )
+    st.session_state.game_setup = game_setup
+    st.session_state.screen = screen
+
+
+def redo_setup_move():
+    """取り消した操作をやり直す"""
+    history = st.session_state.get("setup_redo")
+    if history is None:
+        return
+    (game_setup, screen), st.session_state.setup_redo = history
+    st.session_state.setup_undo = (
+        (st.session_state.game_setup, st.session_state.screen),
+        st.session_state.get("setup_undo"),
+    )
+    st.session_state.game_setup = game_setup
+    st.session_state.screen = screen
+
+
+def show_undo_redo_controls(key):
+    """元に戻す・やり直すボタン"""
+    col_undo, col_redo = st.columns(2)
+    if col_undo.button(
+        "↩️ 元に戻す",
+        key=f"{key}_undo",
+        disabled=st.session_state.get("setup_undo") is None,
+        use_container_width=True,
+    ):
+        undo_setup_move()
+        st.rerun()
+    if col_redo.button(
+        "↪️ やり直す",
+        key=f"{key}_redo",
+        disabled=st.session_state.get("setup_redo") is None,
+        use_container_width=True,
+    ):
+        redo_setup_move()
+        st.rerun()
+
+
+def push_log(log, message):
+    """ログ（新しい順の連結リスト）の先頭にメッセージを足す（元のログは共有する）"""
+    return (message, log)
+
+
+def iter_log(log):
+    """ログを新しい順に返す"""
+    while log is not None:
+        if isinstance(log, list):
+            # 連結リストにする前のセッションで作られたログ
+            yield from log
+            return
+        message, log = log
+        yield message
+
+
+# --- ドラフト・オークションの遷移 ---
+# いずれも元の状態は書き換えず、変更するキーだけを辞書で返す。
+def confirm_draft_pick(setup_data, player_name):
+    """選択中の国家・重役と初期契約でドラフトを確定する"""
+    picked_nation, picked_executive = setup_data["current_selection_ne"]
+    selected_contract = setup_data["current_selection_contract"]
+    return {
+        "draft_results": {
+            **setup_data["draft_results"],
+            player_name: DraftPick(
+                nation=picked_nation,
+                executive=picked_executive,
+                contract=setup_data["contract_names"][selected_contract],
+                bid=None,
+            ),
+        },
+        "nation_exec_candidates": [
+            (n, e)
+            for n, e in setup_data["nation_exec_candidates"]
+            if n != picked_nation and e != picked_executive
+        ],
+        "contract_candidates": [
+            c for c in setup_data["contract_candidates"] if c != selected_contract
+        ],
+        "current_selection_ne": None,
+        "current_selection_contract": None,
+        "draft_turn_index": setup_data.get("draft_turn_index", 0) + 1,
+    }
+
+
+def skip_auction_turn(setup_data):
+    """最高位の入札を持つプレイヤーの手番を飛ばす"""
+    return {
+        "draft_turn_index": (setup_data.get("draft_turn_index", 0) + 1)
+        % setup_data["player_count"]
+    }
+
+
+def place_auction_bid(setup_data, player, turn_order, bid_vp):
+    """入札ボードの (手番, VP) に入札する（入札の妥当性は呼び出し側で確認済みとする）"""
+    auction_board = dict(setup_data["auction_board"])
+    player_status = dict(setup_data["auction_player_status"])
+    log = setup_data["auction_log"]
+
+    current_bid_on_spot = auction_board.get(turn_order)
+    if current_bid_on_spot and current_bid_on_spot.player != player:
+        displaced_player = current_bid_on_spot.player
+        player_status[displaced_player] = BidderStatus(status="displaced", turn_order=None, bid=None)
+        log = push_log(
+            log,
+            f"-> {player}が{displaced_player}の入札を上回りました！ {displaced_player}は再度入札が必要です。",
+        )
+
+    # 自分の以前の入札は取り下げる
+    for old_turn_order, spot in list(auction_board.items()):
+        if spot.player == player:
+            del auction_board[old_turn_order]
+
+    log = push_log(log, f'-> {player}が"{turn_order}番手"に"{bid_vp}VP"で入札しました。')
+    auction_board[turn_order] = AuctionBid(player=player, bid=bid_vp)
+    player_status[player] = BidderStatus(status="placed", turn_order=turn_order, bid=bid_vp)
+
+    changes = {
+        "auction_board": auction_board,
+        "auction_player_status": player_status,
+        "auction_log": log,
+        "draft_turn_index": (setup_data.get("draft_turn_index", 0) + 1) % setup_data["player_count"],
+    }
+    changes.update(get_auction_end_changes({**setup_data, **changes}))
+    return changes
+
+
+def start_auction(setup_data):
+    """オークションを始める（全員を入札前の状態にする）"""
+    return {
+        "auction_board": {},
+        "auction_player_status": {
+            p: BidderStatus(status="bidding", turn_order=None, bid=None)
+            for p in setup_data["draft_order"]
+        },
+        "auction_log": push_log(None, "オークションを開始します。"),
+        "auction_phase": "bidding",
+        "draft_turn_index": 0,
+    }
+
+
+def get_auction_end_changes(setup_data):
+    """オークションの終了条件をチェックし、終了していればドラフトへ移る変更を返す"""
+    # Check if any player is still bidding or displaced
+    for player_status in setup_data["auction_player_status"].values():
+        if player_status.status != "placed":
+            return {}  # Auction is not over
+
+    # Create final turn order list
+    final_order = [None] * setup_data["player_count"]
+    for i in range(1, setup_data["player_count"] + 1):
+        # Handle cases where a turn order spot might not be filled (unlikely in normal flow)
+        if i in setup_data["auction_board"]:
+            player_name = setup_data["auction_board"][i].player
+            final_order[i - 1] = player_name
+
+    log_message = "全員の入札が確定しました。オークション終了！ドラフトを開始します。"
+    return {
+        "auction_phase": "drafting",
+        "draft_turn_index": 0,  # Reset for drafting phase
+        "final_turn_order": final_order,
+        "auction_draft_order": list(reversed(final_order)),
+        "auction_log": push_log(setup_data["auction_log"], log_message),
+    }
+
+
+# --- ドラフト・オークションのイベント ---
+# 確定した操作を小さな辞書のイベントとして記録し、ゲーム開始時にまとめて保存する。
+# イベント列を apply_setup_event で順に適用すれば、途中のどの状態も再現できる。
+def make_start_event(setup_data):
+    """ドラフト開始時点の状態（候補・順番・方式）を表すイベント"""
+    return {
+        "type": "start",
+        "draft_method": setup_data["draft_method"],
+        "board": setup_data["board"],
+        "player_count": setup_data["player_count"],
+        "draft_order": list(setup_data["draft_order"]),
+        "candidates": [list(pair) for pair in setup_data["nation_exec_candidates"]],
+        "contracts": [
+            {"ID": c, "Name": setup_data["contract_names"][c]}
+            for c in setup_data["contract_candidates"]
+        ],
+    }
+
+
+def make_pick_event(setup_data, player_name):
+    """選択中の国家・重役と初期契約でドラフトを確定するイベント"""
+    nation, executive = setup_data["current_selection_ne"]
+    return {
+        "type": "pick",
+        "player": player_name,
+        "nation": nation,
+        "executive": executive,
+        "contract_id": setup_data["current_selection_contract"],
+    }
+
+
+def apply_setup_event(setup_data, event):
+    """イベントを1つ適用した新しい状態を返す（元の状態は書き換えない）"""
+    kind = event["type"]
+    if kind == "start":
+        state = SetupState(
+            player_count=event["player_count"],
+            draft_order=list(event["draft_order"]),
+            nation_exec_candidates=[
+                (sys.intern(n), sys.intern(e)) for n, e in event["candidates"]
+            ],
+            contract_candidates=[c["ID"] for c in event["contracts"]],
+            contract_names={c["ID"]: c["Name"] for c in event["contracts"]},
+            draft_results={},
+            draft_method=event["draft_method"],
+            draft_turn_index=0,
+            current_selection_ne=None,
+            current_selection_contract=None,
+            board=event["board"],
+        )
+        if event["draft_method"] == "auction":
+            state.update(start_auction(state))
+        return state
+    if kind == "bid":
+        return setup_data._replace(
+            **place_auction_bid(setup_data, event["player"], event["turn_order"], event["bid"])
+        )
+    if kind == "skip":
+        return setup_data._replace(**skip_auction_turn(setup_data))
+    if kind == "pick":
+        if event["contract_id"] not in setup_data["contract_candidates"]:
+            raise ValueError(f"候補にない初期契約: {event['contract_id']}")
+        selected = setup_data._replace(
+            current_selection_ne=(event["nation"], event["executive"]),
+            current_selection_contract=event["contract_id"],
+        )
+        return setup_data._replace(**confirm_draft_pick(selected, event["player"]))
+    raise ValueError(f"不明なイベント: {kind}")
+
+
+def replay_setup_events(events, upto=None):
+    """イベント列（古い順）を先頭から upto 個まで適用した状態を返す"""
+    state = None
+    for event in events[:upto]:
+        state = apply_setup_event(state, event)
+    return state
+
+
+def get_setup_events(setup_data):
+    """game_setup に積んだイベントを古い順のリストで返す"""
+    return list(reversed(list(iter_log(setup_data.get("setup_events")))))
+
+
+# --- 画面描画関数 ---
+
+
+def load_active_game():
+    """スコア入力待ちのゲームを（未取得なら）シートから読み込む"""
+    if st.session_state.active_game is None:
+        started = time.perf_counter()
+        st.session_state.active_game = load_latest_game_from_sheet()
+        record_startup_phase("active_game_fetch", time.perf_counter() - started)
+    return st.session_state.active_game
+
+
+def show_active_game_panel():
+    """スコア入力待ちのゲームがあれば表示する"""
+    latest_game = load_active_game()
     if latest_game:
         with st.container(border=True):
             st.subheader("スコア入力待ちのゲームがあります")
@@ -720,6 +2153,22 @@ def show_landing_screen():
                     st.rerun()
         st.divider()
 
+
+def show_landing_screen():
+    """アプリ起動時の初期画面"""
+    st.title("バラージ セットアップ & スコア管理")
+
+    col1, col2 = st.columns([0.7, 0.3])
+    with col2:
+        if st.button("最新の情報に更新", use_container_width=True):
+            st.cache_data.clear()
+            st.session_state.active_game = None
+            st.rerun()
+
+    # スコア入力待ちのゲームはシートの読み込みが要るので、枠だけ確保して
+    # 先にボタン類を表示し、最後に中身を埋める
+    active_game_area = st.container()
+
     if st.button("新規セットアップ", use_container_width=True):
         reset_game_setup()
         st.session_state.screen = "setup_form"
@@ -729,6 +2178,19 @@ def show_landing_screen():
         st.session_state.screen = "stats"
         st.rerun()
 
+    with st.expander("⏯️ 中断したセットアップを再開"):
+        with st.form("resume_form"):
+            st.caption(
+                "セットアップ中の画面に表示されている再開コードを入力してください。"
+                "再開コードを知っていれば誰でもそのセットアップを開いて操作できます。"
+            )
+            resume_code = st.text_input("再開コード", max_chars=RESUME_CODE_LENGTH + 2)
+            if st.form_submit_button("再開する"):
+                if resume_setup_session(resume_code):
+                    st.rerun()
+                else:
+                    st.error("この再開コードのセットアップは見つかりませんでした。")
+
     with st.expander("🔧 管理者メニュー"):
         col_admin1, col_admin2 = st.columns(2)
         with col_admin1:
@@ -749,6 +2211,18 @@ def show_landing_screen():
                 else:
                     st.error("保存に失敗しました")
 
+        st.divider()
+        st.write("▼ 起動時間の内訳")
+        show_startup_profile()
+
+        st.divider()
+        st.write("▼ キャッシュのウォームアップ")
+        show_cache_warmer_stats()
+
+    record_startup_phase("first_render", time.perf_counter() - SCRIPT_STARTED_AT)
+    with active_game_area:
+        show_active_game_panel()
+
 
 def show_setup_form_screen(nation_df, exec_df):
     """セットアップ情報を入力する画面"""
@@ -866,6 +2340,11 @@ def show_setup_form_screen(nation_df, exec_df):
                 draft_options,
                 index=draft_options.index(default_draft_option),
             )
+            balanced_pairing = st.checkbox(
+                "バランス重視のペアリング",
+                value=st.session_state.game_setup.get("balanced_pairing", False),
+                help="過去の組み合わせ別勝率がなるべく揃うように国家と重役を組み合わせます",
+            )
         player_names = []
         st.subheader("プレイヤー名")
 
@@ -881,6 +2360,30 @@ def show_setup_form_screen(nation_df, exec_df):
                 st.text_input(f"プレイヤー {i+1}", key=f"player_{i}")
             )
 
+        with st.expander("候補の制約"):
+            pair_options = [f"{n} × {e}" for n in all_nations for e in all_executives]
+            banned_pair_labels = st.multiselect(
+                "組み合わせない国家 × 重役",
+                pair_options,
+                default=[
+                    f"{n} × {e}"
+                    for n, e in st.session_state.game_setup.get("banned_pairs", [])
+                    if f"{n} × {e}" in pair_options
+                ],
+            )
+            require_patched_executive = st.checkbox(
+                "変更のあった重役を1つ以上含める",
+                value=st.session_state.game_setup.get("require_patched_executive", False),
+            )
+            avoid_recent_nations = st.number_input(
+                "直近のゲームで使った国家を避ける（ゲーム数、0で無効）",
+                min_value=0,
+                # 直近の使用履歴の索引が持つゲーム数まで
+                max_value=RECENCY_WINDOW_GAMES,
+                value=st.session_state.game_setup.get("avoid_recent_nations", 0),
+                help="各プレイヤーに、直近このゲーム数で使っていない国家の候補が残るようにします",
+            )
+
         st.markdown("---")
         # --- Preset Save (Inside Form to capture current state) ---
         with st.expander("現在の設定をプリセット保存"):
@@ -915,15 +2418,19 @@ def show_setup_form_screen(nation_df, exec_df):
             if not all(name.strip() for name in player_names):
                 st.warning("すべてのプレイヤー名を入力してください。")
             else:
-                st.session_state.game_setup.update(
-                    {
-                        "player_count": player_count,
-                        "player_names": [name.strip() for name in player_names],
-                        "draft_candidate_count_option": draft_candidate_count_option,
-                        "selected_nations": selected_nations,
-                        "selected_executives": selected_executives,
-                        "board": board_type,
-                    }
+                st.session_state.game_setup = st.session_state.game_setup._replace(
+                    player_count=player_count,
+                    player_names=[name.strip() for name in player_names],
+                    draft_candidate_count_option=draft_candidate_count_option,
+                    balanced_pairing=balanced_pairing,
+                    banned_pairs=[
+                        tuple(label.split(" × ", 1)) for label in banned_pair_labels
+                    ],
+                    require_patched_executive=require_patched_executive,
+                    avoid_recent_nations=avoid_recent_nations,
+                    selected_nations=[sys.intern(n) for n in selected_nations],
+                    selected_executives=[sys.intern(e) for e in selected_executives],
+                    board=board_type,
                 )
                 st.session_state.screen = "setup"
                 st.rerun()
@@ -931,11 +2438,12 @@ def show_setup_form_screen(nation_df, exec_df):
 
 def show_setup_screen(contract_df, nation_df, exec_df):
     st.title("セットアップ")
+    # game_setup はその場で書き換えず、新しいレコードに置き換える（チェックポイントが変化に気づくように）
     setup_data = st.session_state.game_setup
     if not setup_data["draft_order"]:
         draft_order = setup_data["player_names"].copy()
         random.shuffle(draft_order)
-        setup_data["draft_order"] = draft_order
+        setup_data = st.session_state.game_setup = setup_data._replace(draft_order=draft_order)
     st.header("ドラフト順")
     for i, name in enumerate(setup_data["draft_order"]):
         st.write(f"**{i+1}番手:** {name}")
@@ -949,43 +2457,68 @@ def show_setup_screen(contract_df, nation_df, exec_df):
             + count_map[setup_data["draft_candidate_count_option"]]
         )
 
-        if len(nation_pool) < num_candidates or len(exec_pool) < num_candidates:
-            st.error("選択された国家または重役の数が、必要な候補数より少ないです。")
-            if st.button("初期画面に戻る"):
-                st.session_state.screen = "setup_form"
-                st.rerun()
-            return
-
         # 直近の出現数を取得して重み付け
+        # 重み = 1 / (出現回数 + 1)
+        # 出現回数0 -> 1.0, 1 -> 0.5, 2 -> 0.33...
+        # さらに、着席プレイヤーがこのボードで最近使ったものを同じ形で割り引く
         nation_counts, exec_counts = get_recent_usage_counts(10)
-
-        def get_weighted_sample(items, counts, n):
-            if not items:
-                return []
-            df_pool = pd.DataFrame({"Name": items})
-            # 重み = 1 / (出現回数 + 1)
-            # 出現回数0 -> 1.0, 1 -> 0.5, 2 -> 0.33...
-            df_pool["Weight"] = df_pool["Name"].apply(
-                lambda x: 1.0 / (counts.get(x, 0) + 1)
-            )
-
-            # 重みに基づいてサンプリング (非復元抽出)
-            sampled = df_pool.sample(n=n, weights="Weight", replace=False)
-            return sampled["Name"].tolist()
-
-        selected_nations = get_weighted_sample(
-            nation_pool, nation_counts, num_candidates
+        seated_nation_counts, seated_exec_counts = get_seated_recency_counts(
+            setup_data["player_names"], setup_data["board"]
         )
-        selected_execs = get_weighted_sample(exec_pool, exec_counts, num_candidates)
+        nation_weights = {
+            x: 1.0 / (nation_counts.get(x, 0) + 1) / (seated_nation_counts.get(x, 0) + 1)
+            for x in nation_pool
+        }
+        exec_weights = {
+            x: 1.0 / (exec_counts.get(x, 0) + 1) / (seated_exec_counts.get(x, 0) + 1)
+            for x in exec_pool
+        }
 
-        # ペアリング（それぞれ重み付け抽選されたリストを結合）
-        candidates = list(zip(selected_nations, selected_execs))
-        setup_data["nation_exec_candidates"] = candidates
+        # 制約（組み合わせ禁止・変更のあった重役・直近に使った国家）を満たすように抽選
+        required_execs = (
+            get_patched_names(exec_df) if setup_data.get("require_patched_executive") else set()
+        )
+        player_banned_nations = get_recent_player_nations(
+            setup_data["player_names"], setup_data.get("avoid_recent_nations", 0)
+        )
+        candidates, spread, error = sample_constrained_candidates(
+            nation_pool,
+            exec_pool,
+            num_candidates,
+            nation_weights=nation_weights,
+            exec_weights=exec_weights,
+            banned_pairs=setup_data.get("banned_pairs", []),
+            required_executives=required_execs,
+            player_banned_nations={
+                name: player_banned_nations.get(name, set())
+                for name in setup_data["player_names"]
+            } if player_banned_nations else None,
+            balanced=setup_data.get("balanced_pairing", False),
+        )
+        if error:
+            st.error(error)
+            if st.button("初期画面に戻る"):
+                st.session_state.screen = "setup_form"
+                st.rerun()
+            return
         num_contracts = setup_data["player_count"]
-        setup_data["contract_candidates"] = contract_df.sample(n=num_contracts).to_dict(
-            "records"
+        contracts = contract_df.sample(n=num_contracts)
+        setup_data = st.session_state.game_setup = setup_data._replace(
+            pairing_spread=spread,
+            # 名前は intern しておき、セッション間で同じ文字列を共有する
+            nation_exec_candidates=[(sys.intern(n), sys.intern(e)) for n, e in candidates],
+            contract_candidates=contracts["ID"].tolist(),
+            contract_names=dict(zip(contracts["ID"], contracts["Name"])),
         )
     st.header("国家・重役 候補")
+    if setup_data.get("balanced_pairing"):
+        if setup_data.get("pairing_spread") is None:
+            st.caption("過去の記録がないため、抽選順に組み合わせました。")
+        else:
+            st.caption(
+                "過去の勝率が揃うように組み合わせました"
+                f"（推定勝率の差: 最大 {setup_data['pairing_spread'] * 100:.1f} ポイント）"
+            )
     candidates = setup_data["nation_exec_candidates"]
     num_cols = min(len(candidates), 4)
     cols = st.columns(num_cols)
@@ -1016,7 +2549,9 @@ def show_setup_screen(contract_df, nation_df, exec_df):
             )
 
     st.header("初期契約 候補")
-    contract_candidates = setup_data["contract_candidates"]
+    contract_candidates = get_contract_rows(
+        contract_df, setup_data["contract_candidates"], setup_data["contract_names"]
+    )
     num_cols = min(len(contract_candidates), 4)
     cols = st.columns(num_cols)
     for i, contract in enumerate(contract_candidates):
@@ -1031,11 +2566,20 @@ def show_setup_screen(contract_df, nation_df, exec_df):
     st.header("ドラフト方式を選択")
     cols = st.columns(2)
     if cols[0].button("通常ドラフト", use_container_width=True):
-        setup_data["draft_method"] = "normal"
+        setup_data = setup_data._replace(draft_method="normal")
+        st.session_state.game_setup = setup_data._replace(
+            setup_events=push_log(None, make_start_event(setup_data))
+        )
+        clear_setup_history()
         st.session_state.screen = "draft"
         st.rerun()
     if cols[1].button("BGAオークション方式", use_container_width=True):
-        setup_data["draft_method"] = "auction"
+        setup_data = setup_data._replace(draft_method="auction")
+        setup_data = setup_data._replace(**start_auction(setup_data))
+        st.session_state.game_setup = setup_data._replace(
+            setup_events=push_log(None, make_start_event(setup_data))
+        )
+        clear_setup_history()
         st.session_state.screen = "auction"
         st.rerun()
 
@@ -1058,6 +2602,10 @@ def display_draft_tile(
                 else:
                     st.image(image_to_data_url(full_path))
         st.markdown(f"**{item_data['name']}**")
+
+        # 過去データから予測した勝率
+        if item_data.get("win_probability") is not None:
+            st.markdown(f"📈 **予測勝率:** {item_data['win_probability']:.1%}")
         
         # 変更点の表示 (国家)
         if item_data.get("patch_notes"):
@@ -1092,7 +2640,7 @@ def display_draft_tile(
                 on_click()
 
 
-def show_draft_screen(nation_df, exec_df):
+def show_draft_screen(contract_df, nation_df, exec_df):
     setup_data = st.session_state.game_setup
     if setup_data["draft_turn_index"] >= setup_data["player_count"]:
         st.session_state.screen = "draft_result"
@@ -1101,6 +2649,7 @@ def show_draft_screen(nation_df, exec_df):
         st.session_state.game_setup["draft_turn_index"]
     ]
     st.title(f"ドラフト: {player_name}さんの番です")
+    show_undo_redo_controls("draft")
 
     # --- ドラフト順の表示と現在のプレイヤーのハイライト ---
     st.header("ドラフト順")
@@ -1133,9 +2682,8 @@ def show_draft_screen(nation_df, exec_df):
         with sel_col2:
             st.markdown("##### 初期契約")
             if setup_data["current_selection_contract"]:
-                st.success(
-                    f"**選択中:** {setup_data['current_selection_contract']['Name']}"
-                )
+                contract_name = setup_data["contract_names"][setup_data["current_selection_contract"]]
+                st.success(f"**選択中:** {contract_name}")
             else:
                 st.info("未選択")
 
@@ -1146,6 +2694,10 @@ def show_draft_screen(nation_df, exec_df):
     st.subheader("国家・重役")
     ne_candidates = setup_data["nation_exec_candidates"]
     if ne_candidates:
+        # 1ラウンド目の手番はドラフト順の逆
+        win_probabilities = get_candidate_win_probabilities(
+            ne_candidates, setup_data["player_count"] - setup_data["draft_turn_index"]
+        )
         num_cols = min(len(ne_candidates), 4)
         cols = st.columns(num_cols)
         for i, (nation_name, exec_name) in enumerate(ne_candidates):
@@ -1161,13 +2713,12 @@ def show_draft_screen(nation_df, exec_df):
                 "sub_description": exec_row.get("Description"),
                 "sub_image_url": exec_row.get("IconURL"),
                 "sub_patch_notes": exec_row.get("PatchNotes"),
+                "win_probability": win_probabilities.get((nation_name, exec_name)),
             }
             is_selected = (nation_name, exec_name) == setup_data["current_selection_ne"]
 
             def on_click_ne(sel=(nation_name, exec_name), is_sel=is_selected):
-                st.session_state.game_setup["current_selection_ne"] = (
-                    None if is_sel else sel
-                )
+                select_setup_tile(current_selection_ne=None if is_sel else sel)
                 st.rerun()
 
             display_draft_tile(
@@ -1184,7 +2735,9 @@ def show_draft_screen(nation_df, exec_df):
 
     # --- 初期契約の選択肢 ---
     st.subheader("初期契約")
-    contract_candidates = setup_data["contract_candidates"]
+    contract_candidates = get_contract_rows(
+        contract_df, setup_data["contract_candidates"], setup_data["contract_names"]
+    )
     if contract_candidates:
         num_cols = min(len(contract_candidates), 4)
         cols = st.columns(num_cols)
@@ -1194,15 +2747,10 @@ def show_draft_screen(nation_df, exec_df):
                 "description": candidate.get("Description"),
                 "image_url": candidate.get("ImageURL"),
             }
-            is_selected = (
-                setup_data["current_selection_contract"] is not None
-                and candidate["ID"] == setup_data["current_selection_contract"]["ID"]
-            )
+            is_selected = candidate["ID"] == setup_data["current_selection_contract"]
 
-            def on_click_contract(sel=candidate, is_sel=is_selected):
-                st.session_state.game_setup["current_selection_contract"] = (
-                    None if is_sel else sel
-                )
+            def on_click_contract(sel=candidate["ID"], is_sel=is_selected):
+                select_setup_tile(current_selection_contract=None if is_sel else sel)
                 st.rerun()
 
             display_draft_tile(
@@ -1227,27 +2775,10 @@ def show_draft_screen(nation_df, exec_df):
         use_container_width=True,
         key="confirm_draft_selection",
     ):
-        selected_ne = setup_data["current_selection_ne"]
-        selected_contract = setup_data["current_selection_contract"]
-        setup_data["draft_results"][player_name] = {
-            "nation": selected_ne[0],
-            "executive": selected_ne[1],
-            "contract": selected_contract["Name"],
-        }
-        picked_nation, picked_executive = selected_ne
-        setup_data["nation_exec_candidates"] = [
-            (n, e)
-            for n, e in setup_data["nation_exec_candidates"]
-            if n != picked_nation and e != picked_executive
-        ]
-        setup_data["contract_candidates"] = [
-            c
-            for c in setup_data["contract_candidates"]
-            if c["ID"] != selected_contract["ID"]
-        ]
-        setup_data["current_selection_ne"] = None
-        setup_data["current_selection_contract"] = None
-        st.session_state.game_setup["draft_turn_index"] += 1
+        commit_setup_move(
+            confirm_draft_pick(setup_data, player_name),
+            make_pick_event(setup_data, player_name),
+        )
         st.rerun()
 
 
@@ -1264,24 +2795,77 @@ def get_icon_data_url(df, name, column_name="IconURL"):
     return ""
 
 
+def start_game_from_setup(draft_order, draft_results, turn_order):
+    """ドラフト結果とイベント列をシートに保存し、ゲームを開始する
+
+    イベント列の保存だけが失敗したときは、セットアップを残して保存済みの GameID を
+    覚えておき、次に押されたらイベント列だけを保存し直す（ドラフト結果は二重に書かない）。
+    """
+    setup_data = st.session_state.game_setup
+    game_id = setup_data.get("saved_game_id")
+    if not game_id:
+        game_id = save_draft_to_sheet(
+            setup_data["player_count"],
+            draft_order,
+            draft_results,
+            turn_order,
+            setup_data["draft_method"],
+            setup_data["board"],
+        )
+        if not game_id:
+            return
+        setup_data = st.session_state.game_setup = setup_data._replace(saved_game_id=game_id)
+        # シートに書いた後に元に戻すと、同じドラフトをもう一度保存できてしまう
+        clear_setup_history()
+
+    if not save_setup_events_to_sheet(game_id, get_setup_events(setup_data)):
+        # セットアップは残し、show_draft_log_retry で再試行・スキップを選ばせる
+        return
+    st.success("ドラフト結果を保存しました！")
+    st.balloons()
+    finish_game_setup()
+
+
+def show_draft_log_retry():
+    """ドラフト結果だけ保存済みのとき、ドラフトログの再試行かスキップを選ばせる"""
+    if not st.session_state.game_setup.get("saved_game_id"):
+        return
+    st.warning(
+        "ドラフト結果は保存しましたが、ドラフトログを保存できませんでした。"
+        "もう一度「ゲーム開始」を押すと、ドラフトログだけを保存し直します。"
+    )
+    if st.button("ドラフトログを保存せずに進む", use_container_width=True):
+        finish_game_setup()
+
+
+def finish_game_setup():
+    """セットアップを片付けてトップ画面へ戻る"""
+    delete_setup_checkpoint(st.session_state.get("resume_code"))
+    reset_game_setup()
+    st.session_state.screen = "landing"
+    st.session_state.active_game = load_latest_game_from_sheet()
+    st.rerun()
+
+
 def show_draft_result_screen(nation_df, exec_df):
     st.title("ドラフト結果")
+    show_undo_redo_controls("draft_result")
     setup_data = st.session_state.game_setup
     draft_order = setup_data["draft_order"]
     draft_results = setup_data["draft_results"]
     first_round_order = list(reversed(draft_order))
     player_data_list = []
     for player_name in draft_order:
-        player_result = draft_results.get(player_name, {})
-        nation_name = player_result.get("nation", "N/A")
-        exec_name = player_result.get("executive", "N/A")
+        player_result = draft_results.get(player_name)
+        nation_name = player_result.nation if player_result else "N/A"
+        exec_name = player_result.executive if player_result else "N/A"
         player_data_list.append(
             {
                 "1R手番": first_round_order.index(player_name) + 1,
                 "プレイヤー名": player_name,
                 "国家": nation_name,
                 "重役": exec_name,
-                "初期契約": player_result.get("contract", "N/A"),
+                "初期契約": player_result.contract if player_result else "N/A",
                 "国家アイコン": get_icon_data_url(nation_df, nation_name),
                 "重役アイコン": get_icon_data_url(exec_df, exec_name),
             }
@@ -1306,24 +2890,11 @@ def show_draft_result_screen(nation_df, exec_df):
             st.write(f"**初期契約:** {player_data['初期契約']}")
 
     if st.button("ゲーム開始 (結果を保存)", type="primary", use_container_width=True):
-        game_id = save_draft_to_sheet(
-            setup_data["player_count"],
-            setup_data["draft_order"],
-            setup_data["draft_results"],
-            first_round_order,
-            setup_data["draft_method"],
-            setup_data["board"],
-        )
-        if game_id:
-            st.success("ドラフト結果を保存しました！")
-            st.balloons()
-            reset_game_setup()
-            st.session_state.screen = "landing"
-            st.session_state.active_game = load_latest_game_from_sheet()
-            st.rerun()
+        start_game_from_setup(draft_order, draft_results, first_round_order)
+    show_draft_log_retry()
 
 
-def show_auction_screen(nation_df, exec_df):
+def show_auction_screen(contract_df, nation_df, exec_df):
     """BGAオークション方式 (グリッドUI・新ロジック・UI改善版)"""
     setup_data = st.session_state.game_setup
 
@@ -1332,13 +2903,10 @@ def show_auction_screen(nation_df, exec_df):
         player_count = setup_data["player_count"]
         players = setup_data["draft_order"]
 
-        if not setup_data.get("auction_board"):
-            setup_data["auction_board"] = {}
-            setup_data["auction_player_status"] = {
-                p: {"status": "bidding", "turn_order": None, "bid": None}
-                for p in players
-            }
-            setup_data["auction_log"] = ["オークションを開始します。"]
+        if not setup_data.get("auction_board") and not setup_data.get("auction_player_status"):
+            setup_data = st.session_state.game_setup = setup_data._replace(
+                **start_auction(setup_data)
+            )
 
         turn_index = setup_data.get("draft_turn_index", 0)
         current_player = players[turn_index]
@@ -1359,18 +2927,17 @@ def show_auction_screen(nation_df, exec_df):
                     )
 
         st.header(f"ターン: {current_player}さん")
+        show_undo_redo_controls("auction_bidding")
 
-        player_current_status = setup_data["auction_player_status"].get(
-            current_player, {}
-        )
-        if player_current_status.get("status") == "displaced":
+        player_current_status = setup_data["auction_player_status"].get(current_player)
+        if player_current_status is not None and player_current_status.status == "displaced":
             st.warning(
                 "あなたは他のプレイヤーに入札を上回られました。再度入札してください。"
             )
 
         # --- 新ロジック: ターン開始時のチェック ---
         player_locations = {
-            v["player"]: k for k, v in setup_data["auction_board"].items()
+            v.player: k for k, v in setup_data["auction_board"].items()
         }
         current_player_order = player_locations.get(current_player)
         should_skip_turn = False
@@ -1385,7 +2952,10 @@ def show_auction_screen(nation_df, exec_df):
                 if st.button(
                     "OK、次のプレイヤーへ", key="skip_turn", use_container_width=True
                 ):
-                    setup_data["draft_turn_index"] = (turn_index + 1) % player_count
+                    commit_setup_move(
+                        skip_auction_turn(setup_data),
+                        {"type": "skip", "player": current_player},
+                    )
                     st.rerun()
 
         st.divider()
@@ -1425,11 +2995,6 @@ def show_auction_screen(nation_df, exec_df):
             st.divider()
             st.header("入札ボード")
 
-            player_locations_for_grid = {
-                v["player"]: {"turn_order": k, "bid": v["bid"]}
-                for k, v in setup_data["auction_board"].items()
-            }
-
             vp_cols = st.columns(MAX_VP + 1)
             vp_cols[0].write("**手番**")
             for vp in range(MAX_VP):
@@ -1445,9 +3010,9 @@ def show_auction_screen(nation_df, exec_df):
                     is_occupied = False
                     occupying_player = ""
 
-                    if current_bid_on_spot and current_bid_on_spot["bid"] == bid_vp:
+                    if current_bid_on_spot and current_bid_on_spot.bid == bid_vp:
                         is_occupied = True
-                        occupying_player = current_bid_on_spot["player"]
+                        occupying_player = current_bid_on_spot.player
 
                     button_label = occupying_player if is_occupied else " "
 
@@ -1458,63 +3023,30 @@ def show_auction_screen(nation_df, exec_df):
                         if is_occupied and occupying_player != current_player:
                             st.warning("この場所は他のプレイヤーに確保されています。")
                             is_valid_bid = False
-                        if current_bid_on_spot and bid_vp < current_bid_on_spot["bid"]:
+                        if current_bid_on_spot and bid_vp < current_bid_on_spot.bid:
                             st.warning(
-                                f"この手番には既により高い入札({current_bid_on_spot['bid']}VP)があります。"
+                                f"この手番には既により高い入札({current_bid_on_spot.bid}VP)があります。"
                             )
                             is_valid_bid = False
 
                         if is_valid_bid:
-                            if (
-                                current_bid_on_spot
-                                and current_bid_on_spot["player"] != current_player
-                            ):
-                                displaced_player = current_bid_on_spot["player"]
-                                setup_data["auction_player_status"][
-                                    displaced_player
-                                ] = {
-                                    "status": "displaced",
-                                    "turn_order": None,
-                                    "bid": None,
-                                }
-                                log_message = f"-> {current_player}が{displaced_player}の入札を上回りました！ {displaced_player}は再度入札が必要です。"
-                                setup_data["auction_log"].insert(0, log_message)
-
-                            if current_player in player_locations_for_grid:
-                                old_location = player_locations_for_grid[current_player]
-                                old_turn_order = old_location["turn_order"]
-                                if (
-                                    old_turn_order in setup_data["auction_board"]
-                                    and setup_data["auction_board"][old_turn_order][
-                                        "player"
-                                    ]
-                                    == current_player
-                                ):
-                                    del setup_data["auction_board"][old_turn_order]
-
-                            log_message = f'-> {current_player}が"{turn_order}番手"に"{bid_vp}VP"で入札しました。'
-                            setup_data["auction_log"].insert(0, log_message)
-
-                            setup_data["auction_board"][turn_order] = {
-                                "player": current_player,
-                                "bid": bid_vp,
-                            }
-                            setup_data["auction_player_status"][current_player] = {
-                                "status": "placed",
-                                "turn_order": turn_order,
-                                "bid": bid_vp,
-                            }
-
-                            check_and_handle_auction_end(setup_data)
-                            setup_data["draft_turn_index"] = (
-                                turn_index + 1
-                            ) % player_count
+                            commit_setup_move(
+                                place_auction_bid(
+                                    setup_data, current_player, turn_order, bid_vp
+                                ),
+                                {
+                                    "type": "bid",
+                                    "player": current_player,
+                                    "turn_order": turn_order,
+                                    "bid": bid_vp,
+                                },
+                            )
                             st.rerun()
 
         st.divider()
         st.subheader("ログ")
         with st.container(height=200):
-            for log_entry in setup_data["auction_log"]:
+            for log_entry in iter_log(setup_data["auction_log"]):
                 st.text(log_entry)
 
         if st.button("セットアップに戻る"):
@@ -1523,13 +3055,14 @@ def show_auction_screen(nation_df, exec_df):
 
     # --- Phase 2: Drafting (remains the same) ---
     else:
+        show_undo_redo_controls("auction_drafting")
         st.header("オークション結果")
         final_order_df = pd.DataFrame(
             [
                 {
                     "手番": order_num,
-                    "プレイヤー": setup_data["auction_board"][order_num]["player"],
-                    "入札額": setup_data["auction_board"][order_num]["bid"],
+                    "プレイヤー": setup_data["auction_board"][order_num].player,
+                    "入札額": setup_data["auction_board"][order_num].bid,
                 }
                 for order_num in sorted(setup_data["auction_board"].keys())
             ]
@@ -1546,26 +3079,14 @@ def show_auction_screen(nation_df, exec_df):
                 "ゲーム開始（結果を保存）", type="primary", use_container_width=True
             ):
                 final_turn_order = setup_data["final_turn_order"]
-                for p_name, p_status in setup_data["auction_player_status"].items():
-                    if p_name not in setup_data["draft_results"]:
-                        setup_data["draft_results"][p_name] = {}
-                    setup_data["draft_results"][p_name]["bid"] = p_status["bid"]
-
-                game_id = save_draft_to_sheet(
-                    setup_data["player_count"],
-                    draft_order,
-                    setup_data["draft_results"],
-                    final_turn_order,
-                    setup_data["draft_method"],
-                    setup_data["board"],
-                )
-                if game_id:
-                    st.success("ドラフト結果を保存しました！")
-                    st.balloons()
-                    reset_game_setup()
-                    st.session_state.screen = "landing"
-                    st.session_state.active_game = load_latest_game_from_sheet()
-                    st.rerun()
+                # 履歴の状態と共有しているため、入札額を加えた結果は新しく作る
+                draft_results = {
+                    p_name: setup_data["draft_results"][p_name]._replace(bid=p_status.bid)
+                    for p_name, p_status in setup_data["auction_player_status"].items()
+                }
+
+                start_game_from_setup(draft_order, draft_results, final_turn_order)
+            show_draft_log_retry()
         else:
             draft_player = draft_order[draft_turn_index]
             st.subheader(f"ドラフト: {draft_player}さんの番です")
@@ -1583,9 +3104,10 @@ def show_auction_screen(nation_df, exec_df):
                 with sel_col2:
                     st.markdown("##### 初期契約")
                     if setup_data.get("current_selection_contract"):
-                        st.success(
-                            f"**選択中:** {setup_data['current_selection_contract']['Name']}"
-                        )
+                        contract_name = setup_data["contract_names"][
+                            setup_data["current_selection_contract"]
+                        ]
+                        st.success(f"**選択中:** {contract_name}")
                     else:
                         st.info("未選択")
                 st.markdown("---")
@@ -1599,27 +3121,10 @@ def show_auction_screen(nation_df, exec_df):
                     disabled=not both_selected,
                     use_container_width=True,
                 ):
-                    selected_ne = setup_data["current_selection_ne"]
-                    selected_contract = setup_data["current_selection_contract"]
-                    setup_data["draft_results"][draft_player] = {
-                        "nation": selected_ne[0],
-                        "executive": selected_ne[1],
-                        "contract": selected_contract["Name"],
-                    }
-                    picked_nation, picked_executive = selected_ne
-                    setup_data["nation_exec_candidates"] = [
-                        (n, e)
-                        for n, e in setup_data["nation_exec_candidates"]
-                        if n != picked_nation and e != picked_executive
-                    ]
-                    setup_data["contract_candidates"] = [
-                        c
-                        for c in setup_data["contract_candidates"]
-                        if c["ID"] != selected_contract["ID"]
-                    ]
-                    setup_data["current_selection_ne"] = None
-                    setup_data["current_selection_contract"] = None
-                    setup_data["draft_turn_index"] += 1
+                    commit_setup_move(
+                        confirm_draft_pick(setup_data, draft_player),
+                        make_pick_event(setup_data, draft_player),
+                    )
                     st.rerun()
 
             st.divider()
@@ -1627,6 +3132,13 @@ def show_auction_screen(nation_df, exec_df):
             st.subheader("国家・重役")
             ne_candidates = setup_data["nation_exec_candidates"]
             if ne_candidates:
+                final_turn_order = setup_data.get("final_turn_order", [])
+                win_probabilities = get_candidate_win_probabilities(
+                    ne_candidates,
+                    final_turn_order.index(draft_player) + 1
+                    if draft_player in final_turn_order
+                    else None,
+                )
                 num_cols = min(len(ne_candidates), 4)
                 cols = st.columns(num_cols)
                 for i, (nation_name, exec_name) in enumerate(ne_candidates):
@@ -1642,15 +3154,14 @@ def show_auction_screen(nation_df, exec_df):
                         "sub_description": exec_row.get("Description"),
                         "sub_image_url": exec_row.get("IconURL"),
                         "sub_patch_notes": exec_row.get("PatchNotes"),
+                        "win_probability": win_probabilities.get((nation_name, exec_name)),
                     }
                     is_selected = (nation_name, exec_name) == setup_data.get(
                         "current_selection_ne"
                     )
 
                     def on_click_ne(sel=(nation_name, exec_name), is_sel=is_selected):
-                        st.session_state.game_setup["current_selection_ne"] = (
-                            None if is_sel else sel
-                        )
+                        select_setup_tile(current_selection_ne=None if is_sel else sel)
                         st.rerun()
 
                     display_draft_tile(
@@ -1665,7 +3176,9 @@ def show_auction_screen(nation_df, exec_df):
 
             st.divider()
             st.subheader("初期契約")
-            contract_candidates = setup_data["contract_candidates"]
+            contract_candidates = get_contract_rows(
+                contract_df, setup_data["contract_candidates"], setup_data["contract_names"]
+            )
             if contract_candidates:
                 num_cols = min(len(contract_candidates), 4)
                 cols = st.columns(num_cols)
@@ -1675,16 +3188,10 @@ def show_auction_screen(nation_df, exec_df):
                         "description": candidate.get("Description"),
                         "image_url": candidate.get("ImageURL"),
                     }
-                    is_selected = (
-                        setup_data["current_selection_contract"] is not None
-                        and candidate["ID"]
-                        == setup_data["current_selection_contract"]["ID"]
-                    )
+                    is_selected = candidate["ID"] == setup_data["current_selection_contract"]
 
-                    def on_click_contract(sel=candidate, is_sel=is_selected):
-                        st.session_state.game_setup["current_selection_contract"] = (
-                            None if is_sel else sel
-                        )
+                    def on_click_contract(sel=candidate["ID"], is_sel=is_selected):
+                        select_setup_tile(current_selection_contract=None if is_sel else sel)
                         st.rerun()
 
                     display_draft_tile(
@@ -1699,7 +3206,7 @@ def show_auction_screen(nation_df, exec_df):
 def show_score_input_screen():
     st.title("スコア入力")
 
-    active_game_data = st.session_state.active_game
+    active_game_data = load_active_game()
     if not active_game_data:
         st.error("スコア入力対象のゲームが見つかりません。")
         if st.button("初期画面に戻る"):
@@ -1722,6 +3229,8 @@ def show_score_input_screen():
         submitted = st.form_submit_button("スコアを保存", type="primary")
         if submitted:
             if update_scores_in_sheet(game_id, player_scores):
+                register_scored_game(active_game_data, player_scores)
+                refresh_scored_win_model()
                 st.success("スコアを保存しました！")
                 st.balloons()
                 st.session_state.active_game = None
@@ -1729,6 +3238,32 @@ def show_score_input_screen():
                 st.rerun()
 
 
+def refresh_scored_win_model():
+    """保存したスコアを含めて勝率予測モデルを学習し直す（次のドラフト画面で学習しないように）"""
+    try:
+        refresh_win_probability_model(load_all_scores_from_sheet())
+    except Exception:
+        # スコアは保存済みなので画面は進める。次のウォームアップで学習し直す
+        logger.exception("スコア保存後の勝率予測モデルの学習に失敗しました")
+
+
+def register_scored_game(game_rows, player_scores):
+    """スコアが確定したゲームを統計用の増分インデックスに反映する"""
+    try:
+        rows = [{**row, "FinalScore": player_scores.get(row["PlayerName"])} for row in game_rows]
+        game_df = coerce_score_columns(pd.DataFrame(rows))
+        game_df = add_score_derived_columns(game_df.dropna(subset=["GameID", "FinalScore"]))
+        if game_df.empty:
+            return
+        add_game_to_stats_cube(game_df)
+        add_game_to_ratings(game_df)
+        add_game_to_rivalry(game_df)
+        add_game_to_recency_index(game_df)
+    except Exception:
+        # インデックスは次回の統計表示時にスナップショットから同期されるため、記録だけ残して進める
+        logger.exception("スコア保存後の統計インデックスの更新に失敗しました")
+
+
 def show_master_editor_screen():
     """マスタデータ編集画面"""
     st.title("🔧 マスタデータ編集")
@@ -1804,57 +3339,183 @@ def show_master_editor_screen():
 
 
 # --- 統計機能 ---
-@st.cache_data(ttl=60)
 def load_all_scores_from_sheet():
     """スコア記録シートから全データを読み込む（FinalScoreが入力済みのもののみ）"""
+    note_cache_request("scores")
     try:
-        worksheet = get_score_sheet()
-        all_values = worksheet.get_all_values()
-        if not all_values or len(all_values) < 2:
+        return fetch_all_scores_from_sheet(cache_epoch(SHEET_CACHE_TTL))
+    except Exception as e:
+        st.error(f"統計データの読み込み中にエラーが発生しました: {e}")
+        return None
+
+
+@st.cache_data(ttl=2 * SHEET_CACHE_TTL)
+def fetch_all_scores_from_sheet(epoch):
+    """世代 epoch のスコア記録を読み込む（失敗は例外で返し、キャッシュしない）"""
+    note_cache_miss("scores")
+    worksheet = get_score_sheet()
+    all_values = worksheet.get_all_values()
+    if not all_values or len(all_values) < 2:
+        return None
+
+    headers = all_values[0]
+    rows = all_values[1:]
+    df = pd.DataFrame(rows, columns=headers)
+
+    # 必須カラムの確認
+    required_cols = ["GameID", "PlayerName", "FinalScore", "Nation", "Executive"]
+    for col in required_cols:
+        if col not in df.columns:
             return None
 
-        headers = all_values[0]
-        rows = all_values[1:]
-        df = pd.DataFrame(rows, columns=headers)
+    # FinalScoreが入力されているレコードのみ抽出
+    df = df[df["FinalScore"].astype(str).str.strip() != ""]
 
-        # 必須カラムの確認
-        required_cols = ["GameID", "PlayerName", "FinalScore", "Nation", "Executive"]
-        for col in required_cols:
-            if col not in df.columns:
-                return None
+    df = coerce_score_columns(df)
+    df = df.dropna(subset=["GameID", "FinalScore"])
+    df = add_score_derived_columns(df)
+    df.attrs["snapshot_version"] = compute_snapshot_version(df)
+    return df
 
-        # FinalScoreが入力されているレコードのみ抽出
-        df = df[df["FinalScore"].astype(str).str.strip() != ""]
 
-        # 数値型に変換
-        df["GameID"] = pd.to_numeric(df["GameID"], errors="coerce")
-        df["FinalScore"] = pd.to_numeric(df["FinalScore"], errors="coerce")
-        df["InitialScore"] = pd.to_numeric(df["InitialScore"], errors="coerce")
-        df["TurnOrder1R"] = pd.to_numeric(df["TurnOrder1R"], errors="coerce")
-        df["PlayerCount"] = pd.to_numeric(df["PlayerCount"], errors="coerce")
+def coerce_score_columns(df):
+    """スコア記録の文字列データを数値・日時型に変換する"""
+    df = df.copy()
+    for col in ["GameID", "FinalScore", "InitialScore", "TurnOrder1R", "PlayerCount"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
 
-        # Timestampをdatetime型に変換
-        if "Timestamp" in df.columns:
-            df["Timestamp"] = pd.to_datetime(df["Timestamp"], errors="coerce")
+    # Timestampをdatetime型に変換
+    if "Timestamp" in df.columns:
+        df["Timestamp"] = pd.to_datetime(df["Timestamp"], errors="coerce")
+    return df
 
-        df = df.dropna(subset=["GameID", "FinalScore"])
-        return df
-    except Exception as e:
-        st.error(f"統計データの読み込み中にエラーが発生しました: {e}")
-        return None
 
+def add_score_derived_columns(df):
+    """ゲーム単位の派生列（順位・勝者フラグ・トップとの差・正規化スコア）を追加する
 
-def filter_df_by_period(df, period_option, start_date=None, end_date=None):
-    """期間でDataFrameをフィルタリングする"""
-    if df is None or df.empty or "Timestamp" not in df.columns:
-        return df
+    スナップショット作成時に1回だけ計算し、各統計関数はこの列を読むだけにする。
+    """
+    df = df.copy()
+    game_scores = df.groupby("GameID")["FinalScore"]
+    winner_score = game_scores.transform("max")
+    df["Rank"] = game_scores.rank(ascending=False, method="min")
+    df["IsWinner"] = df["Rank"] == 1
+    df["MarginToWinner"] = winner_score - df["FinalScore"]
+    # トップのスコアを1.0とした比率（トップが0点のゲームは欠損値）
+    df["NormalizedScore"] = df["FinalScore"] / winner_score.where(winner_score > 0)
+    # 集計キューブ用の月バケット（月初の日時）
+    if "Timestamp" in df.columns:
+        df["Month"] = df["Timestamp"].dt.to_period("M").dt.to_timestamp()
+    return df
 
-    now = datetime.now()
-    cutoff_start = None
-    cutoff_end = None
 
-    if period_option == "直近30日":
-        cutoff_start = now - timedelta(days=30)
+def compute_snapshot_version(df):
+    """スコアスナップショットの内容から決まるバージョン（ハッシュ値）を計算する"""
+    if df is None or df.empty:
+        return 0
+    row_hashes = pd.util.hash_pandas_object(df, index=False)
+    return int(row_hashes.sum()) ^ len(df)
+
+
+def get_snapshot_version(df):
+    """スナップショットのバージョンを取得する（読み込み時に計算済みならそれを使う）"""
+    version = df.attrs.get("snapshot_version") if df is not None else None
+    if version is None:
+        version = compute_snapshot_version(df)
+    return version
+
+
+def with_score_derived_columns(df):
+    """派生列がなければ追加する（スナップショット由来のDataFrameならそのまま返す）"""
+    if "Rank" in df.columns and "IsWinner" in df.columns:
+        return df
+    return add_score_derived_columns(df)
+
+
+def estimate_result_size(value):
+    """キャッシュする計算結果のおおよそのメモリ量（バイト）を見積もる"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_result_size(k) + estimate_result_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_result_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class StatsResultCache:
+    """統計画面の計算結果を保持するLRUキャッシュ（件数とメモリ量の上限付き）
+
+    キャッシュした値はセッション間で共有されるため、呼び出し側で変更しないこと。
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        """キーに対応する結果を返す。なければ計算して格納する"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        # 計算はロックの外で行い、他セッションの参照を止めない
+        value = compute()
+        size = estimate_result_size(value)
+        if size > self.max_bytes:
+            return value
+
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.entries and (
+                len(self.entries) > self.max_entries
+                or self.total_bytes > self.max_bytes
+            ):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+        return value
+
+
+@st.cache_resource
+def get_stats_result_cache():
+    """統計結果キャッシュを取得する（全セッションで共有）"""
+    return StatsResultCache(STATS_CACHE_MAX_ENTRIES, STATS_CACHE_MAX_BYTES)
+
+
+def normalize_period_filter(period_option, start_date=None, end_date=None):
+    """期間フィルターをキャッシュキー用のタプルに正規化する"""
+    if period_option == "日付指定":
+        return (period_option, start_date, end_date)
+    if period_option == "全期間":
+        return (period_option,)
+    # 「直近N日」は基準日が変わると結果も変わるため今日の日付を含める
+    return (period_option, datetime.now().date())
+
+
+def get_period_bounds(period_option, start_date=None, end_date=None):
+    """期間の選択肢から (開始日時, 終了日時) を求める（制限なしはNone）"""
+    now = datetime.now()
+    cutoff_start = None
+    cutoff_end = None
+
+    if period_option == "直近30日":
+        cutoff_start = now - timedelta(days=30)
     elif period_option == "直近90日":
         cutoff_start = now - timedelta(days=90)
     elif period_option == "直近1年":
@@ -1864,204 +3525,2166 @@ def filter_df_by_period(df, period_option, start_date=None, end_date=None):
             cutoff_start = datetime.combine(start_date, datetime.min.time())
         if end_date:
             cutoff_end = datetime.combine(end_date, datetime.max.time())
-    else:  # 全期間
+
+    return cutoff_start, cutoff_end
+
+
+def filter_df_by_period(df, period_option, start_date=None, end_date=None):
+    """期間でDataFrameをフィルタリングする"""
+    if df is None or df.empty or "Timestamp" not in df.columns:
+        return df
+
+    cutoff_start, cutoff_end = get_period_bounds(period_option, start_date, end_date)
+    if cutoff_start is None and cutoff_end is None:  # 全期間
         return df
 
-    if cutoff_start:
-        df = df[df["Timestamp"] >= cutoff_start]
-    if cutoff_end:
-        df = df[df["Timestamp"] <= cutoff_end]
+    if cutoff_start:
+        df = df[df["Timestamp"] >= cutoff_start]
+    if cutoff_end:
+        df = df[df["Timestamp"] <= cutoff_end]
+
+    return df
+
+
+def build_balance_versions(balance_log):
+    """バランス調整履歴を適用開始日時の昇順に並べたバージョン表にする
+
+    返り値の列: VersionStart（適用開始日時）, BalanceVersion（「日付 : バージョン名」）
+    """
+    versions = pd.DataFrame(
+        [(r["Date"], f"{r['Date']} : {r.get('Version', '')}") for r in balance_log if r.get("Date")],
+        columns=["VersionStart", "BalanceVersion"],
+    )
+    versions["VersionStart"] = pd.to_datetime(versions["VersionStart"], errors="coerce")
+    return (
+        versions.dropna(subset=["VersionStart"])
+        .sort_values("VersionStart")
+        .drop_duplicates("VersionStart", keep="last")
+        .reset_index(drop=True)
+    )
+
+
+def tag_balance_versions(df, versions):
+    """各行にプレイ時点のバランス調整バージョン（BalanceVersion列）を付ける
+
+    Timestamp とバージョンの適用開始日時を as-of 結合1回で対応付ける。
+    列はバージョン順の順序付きカテゴリで、最初の調整より前は BALANCE_BASE_VERSION になる。
+    """
+    categories = [BALANCE_BASE_VERSION] + (
+        versions["BalanceVersion"].tolist() if versions is not None else []
+    )
+    codes = np.zeros(len(df), dtype=np.int64)
+    if versions is not None and not versions.empty and "Timestamp" in df.columns:
+        timestamps = df["Timestamp"].to_numpy()
+        positions = np.flatnonzero(~pd.isna(timestamps))
+        order = positions[np.argsort(timestamps[positions], kind="stable")]
+        matched = pd.merge_asof(
+            pd.DataFrame({"Timestamp": timestamps[order]}),
+            versions.assign(Code=np.arange(1, len(versions) + 1)),
+            left_on="Timestamp",
+            right_on="VersionStart",
+            direction="backward",
+        )
+        codes[order] = matched["Code"].fillna(0).to_numpy(dtype=np.int64)
+
+    return df.assign(
+        BalanceVersion=pd.Categorical.from_codes(codes, categories=categories, ordered=True)
+    )
+
+
+def calculate_balance_version_summary(tagged):
+    """バランス調整バージョンごとのゲーム数とプレイ期間"""
+    if tagged is None or tagged.empty:
+        return None
+    summary = tagged.groupby("BalanceVersion", observed=True).agg(
+        Games=("GameID", "nunique"),
+        First=("Timestamp", "min"),
+        Last=("Timestamp", "max"),
+    )
+    return pd.DataFrame({
+        "バージョン": summary.index.astype(str),
+        "ゲーム数": summary["Games"].to_numpy(),
+        "最初のゲーム": summary["First"].dt.strftime("%Y-%m-%d").to_numpy(),
+        "最後のゲーム": summary["Last"].dt.strftime("%Y-%m-%d").to_numpy(),
+    })
+
+
+def calculate_balance_comparison(version_stats, column, label, before, after):
+    """2つのバージョン間で、国家・重役ごとの使用回数・勝率・平均スコアを比較する
+
+    version_stats は aggregate_group_stats(tagged, ["BalanceVersion", column]) の結果。
+    """
+    if version_stats is None or version_stats.empty:
+        return None
+
+    def side(version):
+        return version_stats[version_stats["BalanceVersion"] == version].set_index(column)
+
+    prev, curr = side(before), side(after)
+    entities = prev.index.union(curr.index)
+    if entities.empty:
+        return None
+    prev, curr = prev.reindex(entities), curr.reindex(entities)
+
+    table = pd.DataFrame({
+        label: entities,
+        "使用回数(前)": prev["Count"].fillna(0).astype(int).to_numpy(),
+        "使用回数(後)": curr["Count"].fillna(0).astype(int).to_numpy(),
+        "勝率%(前)": prev["WinRate"].round(1).to_numpy(),
+        "勝率%(後)": curr["WinRate"].round(1).to_numpy(),
+        "勝率差(pt)": (curr["WinRate"] - prev["WinRate"]).round(1).to_numpy(),
+        "平均スコア(前)": prev["MeanScore"].round(1).to_numpy(),
+        "平均スコア(後)": curr["MeanScore"].round(1).to_numpy(),
+        "平均スコア差": (curr["MeanScore"] - prev["MeanScore"]).round(1).to_numpy(),
+    })
+    return table.sort_values("勝率差(pt)", ascending=False, na_position="last")
+
+
+# --- ドラフトログの集計 ---
+def build_draft_event_tables(events_by_game):
+    """イベント列をリプレイし、候補の提示と落札の縦持ちの表を作る
+
+    offers は pick のたびに提示されていた候補1つにつき1行（選ばれたかどうか付き）。
+    bids はオークションで確定した各手番の落札額。
+    """
+    offer_rows, bid_rows = [], []
+    for game_id, events in events_by_game.items():
+        state = None
+        pick_no = 0
+        try:
+            for event in events:
+                if event["type"] == "pick" and state is not None:
+                    picked = (event["nation"], event["executive"])
+                    for nation, executive in state["nation_exec_candidates"]:
+                        offer_rows.append((
+                            game_id, pick_no, event["player"], nation, executive,
+                            (nation, executive) == picked, state["board"], state["player_count"],
+                            state["draft_method"],
+                        ))
+                    pick_no += 1
+                state = apply_setup_event(state, event)
+        except (KeyError, ValueError):
+            # 壊れたログは途中までの分だけ使う
+            pass
+
+        if state is not None and state.get("auction_phase") == "drafting":
+            for turn_order, spot in state["auction_board"].items():
+                bid_rows.append((
+                    game_id, state["board"], state["player_count"], turn_order,
+                    spot.player, spot.bid,
+                ))
+
+    offers = pd.DataFrame(offer_rows, columns=[
+        "GameID", "PickNo", "PlayerName", "Nation", "Executive", "Picked", "Board",
+        "PlayerCount", "DraftMethod",
+    ])
+    bids = pd.DataFrame(bid_rows, columns=[
+        "GameID", "Board", "PlayerCount", "TurnOrder", "PlayerName", "Bid",
+    ])
+    return offers, bids
+
+
+def calculate_pick_rates(offers, keys, key_labels):
+    """候補の提示回数に対する選択率と、最初の指名で選ばれた割合を計算する"""
+    if offers is None or offers.empty:
+        return None
+
+    first = offers["PickNo"] == 0
+    stats = (
+        offers.assign(
+            FirstOffered=first,
+            FirstPicked=first & offers["Picked"],
+        )
+        .groupby(keys, sort=False)
+        .agg(
+            Offered=("Picked", "size"),
+            Picked=("Picked", "sum"),
+            FirstOffered=("FirstOffered", "sum"),
+            FirstPicked=("FirstPicked", "sum"),
+        )
+        .reset_index()
+    )
+    table = stats[keys].rename(columns=key_labels)
+    table["提示回数"] = stats["Offered"]
+    table["選択回数"] = stats["Picked"].astype(int)
+    table["選択率"] = (stats["Picked"] / stats["Offered"] * 100).round(1)
+    table["1番目の提示回数"] = stats["FirstOffered"].astype(int)
+    table["1番目の選択率"] = (
+        stats["FirstPicked"] / stats["FirstOffered"].where(stats["FirstOffered"] > 0) * 100
+    ).round(1)
+    return table.sort_values(["選択率", "提示回数"], ascending=False)
+
+
+def calculate_winning_bids(bids):
+    """ボード・人数・手番ごとの平均落札額を計算する"""
+    if bids is None or bids.empty:
+        return None
+
+    stats = (
+        bids.groupby(["Board", "PlayerCount", "TurnOrder"])
+        .agg(Games=("Bid", "size"), MeanBid=("Bid", "mean"), MaxBid=("Bid", "max"))
+        .reset_index()
+    )
+    return pd.DataFrame({
+        "ボード": stats["Board"],
+        "人数": stats["PlayerCount"],
+        "手番": stats["TurnOrder"],
+        "ゲーム数": stats["Games"],
+        "平均落札額(VP)": stats["MeanBid"].round(2),
+        "最高落札額(VP)": stats["MaxBid"],
+    })
+
+
+def calculate_draft_event_analytics(events_by_game):
+    """ドラフトログの集計表をまとめて作る（統計画面ではこの結果を表示するだけ）"""
+    offers, bids = build_draft_event_tables(events_by_game)
+    if offers.empty and bids.empty:
+        return None
+    combos = offers.assign(Combo=offers["Nation"] + " × " + offers["Executive"])
+    return {
+        "games": len(events_by_game),
+        "pick_rates": {
+            "組み合わせ": calculate_pick_rates(combos, ["Combo"], {"Combo": "組み合わせ"}),
+            "国家": calculate_pick_rates(offers, ["Nation"], {"Nation": "国家"}),
+            "重役": calculate_pick_rates(offers, ["Executive"], {"Executive": "重役"}),
+        },
+        "winning_bids": calculate_winning_bids(bids),
+    }
+
+
+def get_draft_event_analytics():
+    """ドラフトログの集計結果（ログのスナップショットごとに1回だけ集計する）"""
+    log_df = load_draft_log_from_sheet()
+    if log_df is None or log_df.empty:
+        return None
+    return get_stats_result_cache().get_or_compute(
+        (get_snapshot_version(log_df), "draft_event_analytics"),
+        lambda: calculate_draft_event_analytics(parse_setup_events(log_df)),
+    )
+
+
+def aggregate_group_stats(df, keys):
+    """任意のキーでグループ化した統計（数値列）を1回のgroupbyで計算する
+
+    返り値の列: キー列, Count(使用回数), Games(ゲーム数), Wins(勝利数),
+    WinRate(勝率%), MeanScore, MaxScore, MeanRank
+    """
+    if df is None or df.empty:
+        return None
+
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    df = with_score_derived_columns(df)
+    stats = (
+        df.groupby(keys, sort=False)
+        .agg(
+            Count=("FinalScore", "size"),
+            Games=("GameID", "nunique"),
+            Wins=("IsWinner", "sum"),
+            MeanScore=("FinalScore", "mean"),
+            MaxScore=("FinalScore", "max"),
+            MeanRank=("Rank", "mean"),
+        )
+        .reset_index()
+    )
+    stats["Wins"] = stats["Wins"].astype(int)
+    stats["WinRate"] = stats["Wins"] / stats["Count"] * 100
+    return stats
+
+
+def format_group_stats(stats, key_labels, count_label="使用回数", count_col="Count"):
+    """aggregate_group_statsの結果を表示用の列名・書式に整形する"""
+    table = stats[list(key_labels)].rename(columns=key_labels)
+    win_rate = stats["Wins"] / stats[count_col] * 100
+    table[count_label] = stats[count_col]
+    table["勝利数"] = stats["Wins"]
+    table["勝率"] = win_rate.map(lambda x: f"{x:.1f}%")
+    table["勝率数値"] = win_rate
+    table["平均スコア"] = stats["MeanScore"].round(1)
+    table["最高スコア"] = stats["MaxScore"].astype(int)
+    table["平均順位"] = stats["MeanRank"].round(2)
+    if "WinRateLow" in stats.columns:
+        table[WIN_RATE_CI_LABEL] = [
+            f"{low:.1f}–{high:.1f}%" for low, high in zip(stats["WinRateLow"], stats["WinRateHigh"])
+        ]
+        table[MEAN_SCORE_CI_LABEL] = [
+            f"{low:.1f}–{high:.1f}"
+            for low, high in zip(stats["MeanScoreLow"], stats["MeanScoreHigh"])
+        ]
+    return table
+
+
+def select_table_columns(table, columns):
+    """表示列を選ぶ（信頼区間の列があれば勝率・平均スコアの直後に挿入する）"""
+    selected = []
+    for col in columns:
+        selected.append(col)
+        if col == "勝率" and WIN_RATE_CI_LABEL in table.columns:
+            selected.append(WIN_RATE_CI_LABEL)
+        elif col == "平均スコア" and MEAN_SCORE_CI_LABEL in table.columns:
+            selected.append(MEAN_SCORE_CI_LABEL)
+    return table[selected]
+
+
+def merge_group_ci(stats, ci, keys):
+    """集計結果にブートストラップ信頼区間の列を結合する"""
+    if ci is None or stats is None:
+        return stats
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    return stats.merge(ci, on=keys, how="left")
+
+
+def get_bootstrap_workers():
+    """ブートストラップの並列ワーカー数（環境変数で指定。未指定・不正なら0）"""
+    try:
+        return max(0, int(os.environ.get(BOOTSTRAP_WORKERS_ENV, "0")))
+    except ValueError:
+        return 0
+
+
+# プロセスプールに関数を渡せないとき（spawn の子プロセスが Streamlit の __main__ を
+# import できない場合など）や、ワーカーが落ちたときに出る例外
+BOOTSTRAP_POOL_ERRORS = (
+    BrokenProcessPool, pickle.PicklingError, AttributeError, ImportError, OSError
+)
+
+
+@st.cache_resource
+def get_bootstrap_pool(workers):
+    """ブートストラップ用のプロセスプール（ワーカー数ごとに1つだけ作る）
+
+    作成時に空の計算を1回流して確かめ、使えなければ None を返す（同一プロセスで計算する）。
+    """
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        pool.submit(compute_bootstrap_ci_chunk, [], 0, []).result()
+    except BOOTSTRAP_POOL_ERRORS:
+        logger.warning(
+            "ブートストラップのプロセスプールを使えないため同一プロセスで計算します", exc_info=True
+        )
+        pool.shutdown(wait=False, cancel_futures=True)
+        return None
+    return pool
+
+
+def run_bootstrap_chunks(chunks, n_resamples, quantiles):
+    """チャンクをプロセスプールで並列に計算する（使えなければ同一プロセスで順に計算）"""
+    pool = get_bootstrap_pool(len(chunks))
+    if pool is not None:
+        try:
+            return list(pool.map(
+                compute_bootstrap_ci_chunk, chunks,
+                [n_resamples] * len(chunks), [quantiles] * len(chunks),
+            ))
+        except BOOTSTRAP_POOL_ERRORS:
+            # 壊れたプールは捨て、次回は作り直す
+            logger.warning("ブートストラップのプロセスプールで計算できませんでした", exc_info=True)
+            pool.shutdown(wait=False, cancel_futures=True)
+            get_bootstrap_pool.clear()
+    return [compute_bootstrap_ci_chunk(chunk, n_resamples, quantiles) for chunk in chunks]
+
+
+def exact_bootstrap_mean_quantiles(values, freqs, quantiles):
+    """整数値の標本を復元抽出したときの平均の分布（無限回リサンプルの極限）から分位点を求める
+
+    n 個の復元抽出の和の分布は経験分布の n 回畳み込みなので、FFTで n 乗して求める。
+    和の分布は期待値の周り ±12σ√n にほぼ全て収まるため、その幅の円環上で計算する。
+    """
+    count = int(freqs.sum())
+    probs = freqs / count
+    mean = float(probs @ values)
+    sigma = float(np.sqrt(probs @ (values - mean) ** 2))
+    spread = int(np.abs(values - mean).max()) + 1
+    half_width = min(count * spread, int(12 * sigma * np.sqrt(count)) + spread)
+    size = 1 << int(2 * half_width + 1).bit_length()
+
+    pmf = np.zeros(size)
+    np.add.at(pmf, values.astype(np.int64) % size, probs)
+    spectrum = np.fft.rfft(pmf)
+    # |φ|^n が無視できる周波数は0にし、残りだけn乗する（複素数のべき乗が最も重いため）
+    with np.errstate(divide="ignore"):
+        significant = count * np.log(np.abs(spectrum)) > -40
+    powered = np.zeros_like(spectrum)
+    powered[significant] = spectrum[significant] ** count
+    sum_pmf = np.clip(np.fft.irfft(powered, size), 0, None)
+
+    # 円環上の位置を「期待値 - size/2」から始まる和の値に並べ替える
+    start = int(round(count * mean)) - size // 2
+    sum_pmf = np.roll(sum_pmf, -start)
+    cdf = np.cumsum(sum_pmf)
+    positions = np.searchsorted(cdf / cdf[-1], quantiles)
+    return (start + positions) / count
+
+
+def compute_bootstrap_ci_chunk(tasks, n_resamples, quantiles):
+    """グループごとの勝率・平均スコアの信頼区間を計算する（プロセスプールからも呼ぶ）
+
+    tasks は (シード, 件数, 勝利数, スコアの値, 各値の出現回数) のリスト。
+    スコアが整数なら復元抽出の分布を厳密に求め、そうでなければ n_resamples 回の抽出で近似する。
+    """
+    results = []
+    for seed, count, wins, values, freqs in tasks:
+        win_rates = exact_bootstrap_mean_quantiles(
+            np.array([0.0, 1.0]), np.array([count - wins, wins]), quantiles
+        ) * 100
+        if np.all(values == np.round(values)):
+            means = exact_bootstrap_mean_quantiles(values, freqs, quantiles)
+        else:
+            # スコアの値ごとの抽出回数は多項分布に従う
+            rng = np.random.default_rng(seed)
+            draws = rng.multinomial(count, freqs / count, size=n_resamples)
+            means = np.quantile(draws @ values / count, quantiles)
+        results.append((*win_rates, *means))
+    return results
+
+
+def bootstrap_group_ci(df, keys, n_resamples=BOOTSTRAP_RESAMPLES,
+                       confidence=BOOTSTRAP_CONFIDENCE, seed=0, workers=None):
+    """グループごとの勝率・平均スコアのブートストラップ信頼区間を計算する
+
+    ゲームを単位に復元抽出する。統計表のキー（プレイヤー・国家・重役・組み合わせ・番手）は
+    1ゲームに1行しか現れないため、グループ内の行の復元抽出と同じになり、
+    抽出結果は勝者フラグ・スコアの値ごとの出現回数だけで決まる。
+    返り値の列: キー列, WinRateLow, WinRateHigh, MeanScoreLow, MeanScoreHigh
+    """
+    if df is None or df.empty:
+        return None
+
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    df = with_score_derived_columns(df).dropna(subset=keys)
+    if df.empty:
+        return None
+
+    totals = df.groupby(keys, sort=True)["IsWinner"].agg(["size", "sum"])
+    value_counts = df.groupby(keys + ["FinalScore"], sort=True).size()
+    # value_counts はキー順に並んでいるので、グループの境界で切り分ける
+    offsets = np.r_[0, np.cumsum(value_counts.groupby(level=keys, sort=True).size().to_numpy())]
+    values = value_counts.index.get_level_values("FinalScore").to_numpy(dtype=float)
+    freqs = value_counts.to_numpy(dtype=float)
+
+    seeds = np.random.SeedSequence(seed).spawn(len(totals))
+    tasks = [
+        (seeds[i], int(count), float(wins), values[offsets[i]:offsets[i + 1]],
+         freqs[offsets[i]:offsets[i + 1]])
+        for i, (count, wins) in enumerate(zip(totals["size"], totals["sum"]))
+    ]
+    alpha = (1 - confidence) / 2
+    quantiles = [alpha, 1 - alpha]
+
+    workers = get_bootstrap_workers() if workers is None else workers
+    if workers > 1 and len(tasks) >= workers:
+        chunks = [tasks[i::workers] for i in range(workers)]
+        chunk_results = run_bootstrap_chunks(chunks, n_resamples, quantiles)
+        results = [None] * len(tasks)
+        for i, chunk_result in enumerate(chunk_results):
+            results[i::workers] = chunk_result
+    else:
+        results = compute_bootstrap_ci_chunk(tasks, n_resamples, quantiles)
+
+    ci = pd.DataFrame(
+        results, columns=["WinRateLow", "WinRateHigh", "MeanScoreLow", "MeanScoreHigh"]
+    )
+    return pd.concat([totals.index.to_frame(index=False), ci], axis=1)
+
+
+# --- 保存時に増分更新する索引 ---
+# 対戦行列・直近の使用履歴などは、スナップショットから作った索引を cache_resource に保持し、
+# 保存したゲームと、スナップショットで新しく増えたゲームだけを加えていく。
+# 保持領域と同期の手順はここで共通にし、索引ごとに build（全体から作る）と
+# add（索引に行を加えて索引を返す）だけを用意する。
+def make_incremental_index_store():
+    """増分更新する索引の保持領域"""
+    return {
+        "lock": threading.Lock(),
+        "version": None,
+        "value": None,
+        "games": None,  # GameIDごとの (行数, スコア合計)。変更検知に使う
+        "pending": {},  # スナップショットにまだ載っていないゲーム（スコア未入力のドラフト）の行
+    }
+
+
+def get_game_signatures(df):
+    """ゲームごとの行数とスコア合計（キューブとスナップショットの差分検知用）"""
+    return df.groupby("GameID")["FinalScore"].agg(["size", "sum"])
+
+
+def diff_game_signatures(known, signatures):
+    """保持しているゲームとスナップショットの差分を調べる
+
+    返り値は (作り直しが必要か, 新しく増えたGameID)。既知のゲームが消えたり
+    スコアが変わったりしていれば作り直しが必要になる。
+    """
+    if known is None:
+        return True, signatures.index
+    if not known.index.isin(signatures.index).all():
+        return True, signatures.index
+    if not signatures.reindex(known.index).equals(known):
+        return True, signatures.index
+    return False, signatures.index.difference(known.index)
+
+
+def sync_incremental_index(store, df, build, add):
+    """スナップショットに合わせて索引を更新する（新しいゲームだけを add で加える）
+
+    ゲームの削除やスコアの修正があった場合は build で全体から作り直す。
+    作り直すときは、まだスナップショットに載っていない pending のゲームも含める。
+    """
+    version = get_snapshot_version(df)
+    with store["lock"]:
+        if store["version"] != version:
+            signatures = get_game_signatures(df)
+            rebuild, new_ids = diff_game_signatures(store["games"], signatures)
+            for game_id in [g for g in store["pending"] if g in signatures.index]:
+                del store["pending"][game_id]
+            if rebuild or store["value"] is None:
+                pending = list(store["pending"].values())
+                store["value"] = build(pd.concat([df, *pending]) if pending else df)
+            elif len(new_ids) > 0:
+                store["value"] = add(store["value"], df[df["GameID"].isin(new_ids)])
+            store["games"] = signatures
+            store["version"] = version
+        return store["value"]
+
+
+def add_game_to_incremental_index(store, game_df, add, pending=False):
+    """保存したゲームを索引に加える（未構築なら次回の同期で全体から作る）
+
+    pending=True はスコア未入力のドラフト。スナップショットに載るまで覚えておき、
+    作り直すときにも含める。
+    """
+    with store["lock"]:
+        if pending:
+            store["pending"][int(game_df["GameID"].iloc[0])] = game_df
+        if store["games"] is None or store["value"] is None:
+            return
+        signatures = get_game_signatures(game_df)
+        if signatures.index.isin(store["games"].index).any():
+            return
+        store["value"] = add(store["value"], game_df)
+        if not pending:
+            store["games"] = pd.concat([store["games"], signatures])
+
+
+def remove_pending_game_from_incremental_index(store, game_id):
+    """削除したドラフトを pending から外す（索引は次回の同期で作り直す）"""
+    with store["lock"]:
+        if store["pending"].pop(int(float(game_id)), None) is not None:
+            store["value"] = None
+            store["version"] = None
+
+
+# --- 集計キューブ ---
+# キューブはビュー（STATS_CUBE_VIEWS の集計キー）ごとに、次元の値の組をキーとする
+# セルの辞書を持つ。セル数は行数ではなく次元の組み合わせ数で頭打ちになり、
+# ゲームの追加は同じキーのセルに指標を加算するだけで済む。
+def get_stats_cube_dims(view):
+    """ビューのセルを区切る次元（絞り込み用の次元 + 集計キー）"""
+    return STATS_CUBE_FILTER_DIMS + list(view)
+
+
+def build_stats_cube_frame(df, dims):
+    """スコア行を次元の組み合わせごとの指標（DataFrame）に集約する"""
+    df = with_score_derived_columns(df)
+    return (
+        df.assign(
+            Count=1,
+            Wins=df["IsWinner"].astype(int),
+            ScoreSum=df["FinalScore"],
+            ScoreSqSum=df["FinalScore"] ** 2,
+            RankSum=df["Rank"],
+            ScoreMax=df["FinalScore"],
+        )
+        .groupby(dims, dropna=False, sort=False)
+        .agg(
+            Count=("Count", "sum"),
+            # 1ゲームは1つの (月, ボード, 人数, ドラフト方式) にしか属さないため、
+            # セルごとのゲーム数は期間やボードをまたいで合計できる
+            Games=("GameID", "nunique"),
+            Wins=("Wins", "sum"),
+            ScoreSum=("ScoreSum", "sum"),
+            ScoreSqSum=("ScoreSqSum", "sum"),
+            RankSum=("RankSum", "sum"),
+            ScoreMax=("ScoreMax", "max"),
+        )
+    )
+
+
+def build_stats_cube_cells(df, view):
+    """ビューのセル（次元の値の組 → 指標のリスト）を作る"""
+    frame = build_stats_cube_frame(df, get_stats_cube_dims(view))
+    return dict(zip(frame.index, frame[list(STATS_CUBE_MEASURES)].values.tolist()))
+
+
+def merge_stats_cube_cells(cells, new_cells):
+    """同じキーのセルに指標を加算する（最高スコアだけは大きい方を残す）"""
+    for key, values in new_cells.items():
+        current = cells.get(key)
+        if current is None:
+            cells[key] = values
+        else:
+            cells[key] = [a + b for a, b in zip(current[:-1], values[:-1])] + [
+                max(current[-1], values[-1])
+            ]
+
+
+def add_rows_to_stats_cube_cells(cells, view, records):
+    """行（辞書のリスト）を1行ずつビューのセルに加算する
+
+    追加するゲームはキューブにまだ含まれていないため、セルとゲームの組が
+    初めて現れたときだけゲーム数を1増やす。
+    """
+    dims = get_stats_cube_dims(view)
+    seen = set()
+    for row in records:
+        key = tuple(row[dim] for dim in dims)
+        is_new_game = (key, row["GameID"]) not in seen
+        seen.add((key, row["GameID"]))
+        score = row["FinalScore"]
+        merge_stats_cube_cells(
+            cells,
+            {key: [1, int(is_new_game), int(row["IsWinner"]), score, score**2, row["Rank"], score]},
+        )
+
+
+def build_stats_cube(df):
+    """スナップショット全体からキューブを作る"""
+    df = with_score_derived_columns(df)
+    return {
+        "cells": {view: build_stats_cube_cells(df, view) for view in STATS_CUBE_VIEWS},
+        "frames": {},  # 問い合わせ用に DataFrame にしたセル（追加のたびに捨てる）
+        "rows_by_time": df.dropna(subset=["Timestamp"]).sort_values("Timestamp"),
+        "recent_rows": [],  # rows_by_time にまだ入れていない、追加したゲームの行
+        "version": 0,
+    }
+
+
+def add_rows_to_stats_cube(cube, rows):
+    """ゲームの行をキューブに加える（O(行数)。セルの総数には比例しない）"""
+    rows = with_score_derived_columns(rows)
+    records = rows.to_dict("records")
+    for view, cells in cube["cells"].items():
+        add_rows_to_stats_cube_cells(cells, view, records)
+    cube["recent_rows"].append(rows.dropna(subset=["Timestamp"]))
+    if len(cube["recent_rows"]) >= STATS_CUBE_RECENT_ROWS_LIMIT:
+        cube["rows_by_time"] = pd.concat(
+            [cube["rows_by_time"], *cube["recent_rows"]]
+        ).sort_values("Timestamp")
+        cube["recent_rows"] = []
+    cube["frames"] = {}
+    cube["version"] += 1
+    return cube
+
+
+@st.cache_resource
+def get_stats_cube_store():
+    """集計キューブの保持領域（全セッションで共有し、保存時に増分更新する）"""
+    return make_incremental_index_store()
+
+
+def sync_stats_cube(df):
+    """スナップショットに合わせてキューブを更新する（新しいゲームだけを追加）"""
+    dims = set(STATS_CUBE_FILTER_DIMS).union(*STATS_CUBE_VIEWS)
+    if df is None or df.empty or not dims.issubset(df.columns):
+        return None
+    return sync_incremental_index(
+        get_stats_cube_store(), df, build_stats_cube, add_rows_to_stats_cube
+    )
+
+
+def add_game_to_stats_cube(game_df):
+    """スコアが確定したゲームをキューブに追加する（O(プレイヤー数)）"""
+    add_game_to_incremental_index(get_stats_cube_store(), game_df, add_rows_to_stats_cube)
+
+
+def select_stats_cube_view(keys, where_cols):
+    """集計キーと絞り込み列を持つビューのうち、いちばん細かくないものを選ぶ"""
+    needed = set(keys) | set(where_cols)
+    views = [
+        view
+        for view in STATS_CUBE_VIEWS
+        if needed.issubset(STATS_CUBE_FILTER_DIMS + list(view))
+    ]
+    return min(views, key=len) if views else None
+
+
+def get_stats_cube_view_frame(cube, view):
+    """ビューのセルを DataFrame にする（キューブの version が変わるまで使い回す）"""
+    with get_stats_cube_store()["lock"]:
+        frame = cube["frames"].get(view)
+        if frame is None:
+            cells = cube["cells"][view]
+            frame = pd.concat(
+                [
+                    pd.DataFrame(list(cells), columns=get_stats_cube_dims(view)),
+                    pd.DataFrame(list(cells.values()), columns=list(STATS_CUBE_MEASURES)),
+                ],
+                axis=1,
+            )
+            cube["frames"][view] = frame
+        return frame, cube["rows_by_time"], list(cube["recent_rows"])
+
+
+def get_full_month_range(start, end):
+    """期間に完全に含まれる月の範囲 [最初の月初, 最後の月の翌月初) を求める"""
+    first = None
+    if start is not None:
+        first = pd.Timestamp(start).to_period("M").to_timestamp()
+        if first < pd.Timestamp(start):
+            first += pd.offsets.MonthBegin(1)
+    last_end = None
+    if end is not None:
+        last_end = (
+            (pd.Timestamp(end) + timedelta(microseconds=1)).to_period("M").to_timestamp()
+        )
+    return first, last_end
+
+
+def query_stats_cube(cube, keys, period_bounds=(None, None), where=None):
+    """キューブのセルを合計し、aggregate_group_stats と同じ形式の統計を返す
+
+    period_bounds の範囲に完全に含まれる月はセルから、月の途中で切れる
+    端数の期間だけは時刻順の行から集計する。where は次元の値による絞り込み。
+    """
+    if cube is None:
+        return None
+
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    where = {col: value for col, value in (where or {}).items() if value is not None}
+    view = select_stats_cube_view(keys, where)
+    if view is None:
+        return None
+    cells, rows, recent_rows = get_stats_cube_view_frame(cube, view)
+    mask = pd.Series(True, index=cells.index)
+    for col, value in where.items():
+        mask &= cells[col] == value
+
+    start, end = period_bounds
+    parts = []
+    if start is None and end is None:
+        parts.append(cells[mask])
+    else:
+        first_full, last_full_end = get_full_month_range(start, end)
+        full_month = cells["Month"].notna()
+        if first_full is not None:
+            full_month &= cells["Month"] >= first_full
+        if last_full_end is not None:
+            full_month &= cells["Month"] < last_full_end
+        parts.append(cells[mask & full_month])
+
+        # 端数の期間（完全に含まれる月の前後）の行だけを二分探索で取り出す
+        if (
+            first_full is not None
+            and last_full_end is not None
+            and first_full >= last_full_end
+        ):
+            edge_ranges = [(start, end)]
+        else:
+            edge_ranges = []
+            if first_full is not None:
+                edge_ranges.append((start, first_full - timedelta(microseconds=1)))
+            if last_full_end is not None:
+                edge_ranges.append((last_full_end, end))
+        times = rows["Timestamp"]
+        edge_frames = [
+            rows.iloc[times.searchsorted(a, side="left") : times.searchsorted(b, side="right")]
+            for a, b in edge_ranges
+        ]
+        for recent in recent_rows:
+            in_edge = pd.Series(False, index=recent.index)
+            for a, b in edge_ranges:
+                in_edge |= recent["Timestamp"].between(a, b)
+            edge_frames.append(recent[in_edge])
+        edge_frames = [f for f in edge_frames if not f.empty]
+        if edge_frames:
+            edge_rows = pd.concat(edge_frames)
+            for col, value in where.items():
+                edge_rows = edge_rows[edge_rows[col] == value]
+            if not edge_rows.empty:
+                parts.append(build_stats_cube_frame(edge_rows, keys).reset_index())
+
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return None
+
+    grouped = (
+        pd.concat(parts, ignore_index=True)
+        .groupby(keys, sort=False)
+        .agg(STATS_CUBE_MEASURES)
+        .reset_index()
+    )
+    grouped = grouped[grouped["Count"] > 0]
+    if grouped.empty:
+        return None
+
+    stats = grouped[keys].copy()
+    count = grouped["Count"]
+    mean = grouped["ScoreSum"] / count
+    stats["Count"] = count.astype(int)
+    stats["Games"] = grouped["Games"].astype(int)
+    stats["Wins"] = grouped["Wins"].astype(int)
+    stats["MeanScore"] = mean
+    stats["MaxScore"] = grouped["ScoreMax"]
+    stats["MeanRank"] = grouped["RankSum"] / count
+    stats["ScoreStd"] = (grouped["ScoreSqSum"] / count - mean**2).clip(lower=0) ** 0.5
+    stats["WinRate"] = stats["Wins"] / stats["Count"] * 100
+    return stats.reset_index(drop=True)
+
+
+def calculate_player_stats(df, stats=None, ci=None):
+    """プレイヤー別統計を計算（stats に集計済みの結果を渡すとその整形だけ行う）
+
+    ci に bootstrap_group_ci の結果を渡すと信頼区間の列を加える。
+    """
+    if stats is None:
+        stats = aggregate_group_stats(df, "PlayerName")
+    if stats is None:
+        return None
+
+    table = format_group_stats(
+        merge_group_ci(stats, ci, "PlayerName"),
+        {"PlayerName": "プレイヤー"},
+        count_label="ゲーム数",
+        count_col="Games",
+    )
+    table = table.sort_values("勝率数値", ascending=False)
+    return select_table_columns(
+        table, ["プレイヤー", "ゲーム数", "勝利数", "勝率", "平均スコア", "最高スコア", "平均順位"]
+    )
+
+
+def calculate_nation_stats(df, stats=None, ci=None):
+    """国家別統計を計算"""
+    if stats is None:
+        stats = aggregate_group_stats(df, "Nation")
+    if stats is None:
+        return None
+
+    table = format_group_stats(merge_group_ci(stats, ci, "Nation"), {"Nation": "国家"})
+    table = table.sort_values("使用回数", ascending=False)
+    return select_table_columns(table, ["国家", "使用回数", "勝利数", "勝率", "平均スコア"])
+
+
+def calculate_executive_stats(df, stats=None, ci=None):
+    """重役別統計を計算"""
+    if stats is None:
+        stats = aggregate_group_stats(df, "Executive")
+    if stats is None:
+        return None
+
+    table = format_group_stats(merge_group_ci(stats, ci, "Executive"), {"Executive": "重役"})
+    table = table.sort_values("使用回数", ascending=False)
+    return select_table_columns(table, ["重役", "使用回数", "勝利数", "勝率", "平均スコア"])
+
+
+def calculate_combination_stats(df, stats=None, ci=None):
+    """国家・重役の組み合わせ別統計を計算"""
+    if stats is None:
+        stats = aggregate_group_stats(df, ["Nation", "Executive"])
+    if stats is None:
+        return None
+
+    table = format_group_stats(
+        merge_group_ci(stats, ci, ["Nation", "Executive"]),
+        {"Nation": "国家", "Executive": "重役"},
+    )
+    table["組み合わせ"] = table["国家"] + " × " + table["重役"]
+    table = table.sort_values("使用回数", ascending=False)
+    return select_table_columns(
+        table,
+        ["国家", "重役", "組み合わせ", "使用回数", "勝利数", "勝率", "勝率数値", "平均スコア"],
+    )
+
+
+def calculate_player_nation_exec_usage(
+    df, player_name, nation_stats=None, exec_stats=None, nation_ci=None, exec_ci=None,
+    player_index=None,
+):
+    """プレイヤー別の国家・重役使用履歴を計算
+
+    player_index（build_row_index(df, "PlayerName")）を渡すと、
+    全行を走査せずにそのプレイヤーの行だけを取り出して集計する。
+    """
+    if nation_stats is None or exec_stats is None:
+        if df is None or df.empty:
+            return None, None
+
+        # Rankはプレイヤーで絞り込む前の全体データで計算済みの列を使う
+        df = with_score_derived_columns(df)
+        if player_index is not None:
+            player_df = take_indexed_rows(df, player_index, player_name)
+        else:
+            player_df = df[df["PlayerName"] == player_name]
+
+        if player_df.empty:
+            return None, None
+
+        nation_stats = aggregate_group_stats(player_df, "Nation")
+        exec_stats = aggregate_group_stats(player_df, "Executive")
+
+    nation_df = select_table_columns(
+        format_group_stats(
+            merge_group_ci(nation_stats, nation_ci, "Nation"), {"Nation": "国家"}
+        ).sort_values("使用回数", ascending=False),
+        ["国家", "使用回数", "勝利数", "勝率", "平均スコア"],
+    )
+    exec_df = select_table_columns(
+        format_group_stats(
+            merge_group_ci(exec_stats, exec_ci, "Executive"), {"Executive": "重役"}
+        ).sort_values("使用回数", ascending=False),
+        ["重役", "使用回数", "勝利数", "勝率", "平均スコア"],
+    )
+
+    return nation_df, exec_df
+
+
+def build_row_index(df, column):
+    """列の値ごとの行位置（iloc 用）を作る。スナップショット（フィルター結果）ごとに1回だけ作る"""
+    return df.groupby(column, sort=False).indices
+
+
+def take_indexed_rows(df, index, value):
+    """build_row_index の結果から指定値の行を取り出す（その値の行数に比例する時間で済む）"""
+    positions = index.get(value)
+    if positions is None:
+        return df.iloc[0:0]
+    return df.iloc[positions]
+
+
+def calculate_player_head_to_head(df, player_name, player_index, game_index):
+    """指定プレイヤーと同じゲームに参加した各プレイヤーとの対戦成績を計算
+
+    プレイヤーとGameIDの行インデックスを使い、そのプレイヤーのゲームの行だけを読む。
+    """
+    if df is None or df.empty:
+        return None
+
+    player_rows = take_indexed_rows(df, player_index, player_name)
+    if player_rows.empty:
+        return None
+
+    positions = np.concatenate(
+        [game_index[game_id] for game_id in player_rows["GameID"].unique()]
+    )
+    game_rows = df.iloc[positions]
+    opponents = game_rows[game_rows["PlayerName"] != player_name]
+    pairs = opponents[["GameID", "PlayerName", "FinalScore"]].merge(
+        player_rows[["GameID", "FinalScore"]], on="GameID", suffixes=("", "Self")
+    )
+    if pairs.empty:
+        return None
+
+    score_diff = pairs["FinalScoreSelf"] - pairs["FinalScore"]
+    summary = (
+        pairs.assign(Win=score_diff > 0, Loss=score_diff < 0, ScoreDiff=score_diff)
+        .groupby("PlayerName")
+        .agg(
+            Games=("GameID", "size"),
+            Wins=("Win", "sum"),
+            Losses=("Loss", "sum"),
+            ScoreDiff=("ScoreDiff", "mean"),
+        )
+    )
+    win_rate = summary["Wins"] / summary["Games"] * 100
+    table = pd.DataFrame({
+        "対戦相手": summary.index,
+        "対戦回数": summary["Games"].to_numpy(),
+        "勝利": summary["Wins"].astype(int).to_numpy(),
+        "敗北": summary["Losses"].astype(int).to_numpy(),
+        "勝率": win_rate.map(lambda x: f"{x:.1f}%").to_numpy(),
+        "勝率数値": win_rate.round(1).to_numpy(),
+        "平均スコア差": summary["ScoreDiff"].round(1).to_numpy(),
+    })
+    return table.sort_values("対戦回数", ascending=False)
+
+
+def calculate_player_breakdown(df, column, value, stats=None, ci=None):
+    """指定した国家・重役のプレイヤー別使用内訳を計算"""
+    if stats is None:
+        if df is None or df.empty:
+            return None
+
+        # Rankは全体データで計算済みの列を使ってからフィルタリング
+        df = with_score_derived_columns(df)
+        stats = aggregate_group_stats(df[df[column] == value], "PlayerName")
+    if stats is None:
+        return None
+
+    table = format_group_stats(merge_group_ci(stats, ci, "PlayerName"), {"PlayerName": "プレイヤー"})
+    table = table.sort_values("使用回数", ascending=False)
+    return select_table_columns(table, ["プレイヤー", "使用回数", "勝利数", "勝率", "平均スコア"])
+
+
+def calculate_turn_order_stats(df, stats=None, ci=None):
+    """1ラウンド目番手別の統計を計算"""
+    if stats is None:
+        if df is None or df.empty:
+            return None
+
+        # Rankは全体データで計算済みの列を使い、TurnOrder1Rが有効なデータのみ集計する
+        df = with_score_derived_columns(df)
+        df = df[df["TurnOrder1R"].notna() & (df["TurnOrder1R"] > 0)]
+        stats = aggregate_group_stats(df, "TurnOrder1R")
+    else:
+        stats = stats[stats["TurnOrder1R"].notna() & (stats["TurnOrder1R"] > 0)]
+    if stats is None or stats.empty:
+        return None
+
+    table = format_group_stats(
+        merge_group_ci(stats, ci, "TurnOrder1R"), {"TurnOrder1R": "番手"}, count_label="ゲーム数"
+    )
+    table["番手"] = table["番手"].astype(int)
+    table = table.sort_values("番手")
+    return select_table_columns(
+        table, ["番手", "ゲーム数", "勝利数", "勝率", "勝率数値", "平均スコア", "平均順位"]
+    )
+
+
+def build_score_histogram(scores, max_bins=CHART_HISTOGRAM_MAX_BINS):
+    """スコア分布のビンと度数をサーバー側で計算する（ビン数分の行だけを返す）"""
+    scores = pd.Series(scores).dropna()
+    if scores.empty:
+        return None
+
+    low, high = float(scores.min()), float(scores.max())
+    # Vega-Liteと同様に 1, 2, 5 × 10^n の切りのよい幅にする（スコアは整数なので幅は1以上）
+    raw_step = max((high - low) / max_bins, 1)
+    magnitude = 10 ** np.floor(np.log10(raw_step))
+    step = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw_step)
+    start = np.floor(low / step) * step
+    edges = start + step * np.arange(int(np.ceil((high - start) / step)) + 2)
+    counts, edges = np.histogram(scores, bins=edges)
+    histogram = pd.DataFrame({"BinStart": edges[:-1], "BinEnd": edges[1:], "回数": counts})
+    # 末尾の空ビンは落とす
+    return histogram.iloc[: int(np.flatnonzero(counts).max()) + 1]
+
+
+def build_score_timeseries(df, max_points=CHART_TIMESERIES_MAX_POINTS):
+    """ゲームごとの平均スコア推移を、移動平均付きで上限点数まで間引いて返す"""
+    game_avg = (
+        df.dropna(subset=["Timestamp"])
+        .groupby(["GameID", "Timestamp"])
+        .agg(FinalScore=("FinalScore", "mean"))
+        .reset_index()
+        .sort_values("Timestamp")
+    )
+    if game_avg.empty:
+        return None, 0
+
+    game_avg["RollingScore"] = (
+        game_avg["FinalScore"].rolling(CHART_ROLLING_WINDOW, min_periods=1).mean()
+    )
+    game_avg["Games"] = 1
+    total_games = len(game_avg)
+    if total_games > max_points:
+        # 連続するゲームを同じ件数ずつまとめ、時刻・スコアはその平均を使う
+        bucket = np.arange(total_games) * max_points // total_games
+        game_avg = game_avg.groupby(bucket).agg(
+            Timestamp=("Timestamp", "mean"),
+            FinalScore=("FinalScore", "mean"),
+            RollingScore=("RollingScore", "last"),
+            Games=("Games", "sum"),
+        )
+    return game_avg[["Timestamp", "FinalScore", "RollingScore", "Games"]], total_games
+
+
+def build_matchup_matrix(df):
+    """組み合わせ同士の対戦成績（疎行列）をGameIDの自己結合1回で計算する
+
+    インデックスは (組み合わせ, 対戦相手の組み合わせ) の順序付きペアで、
+    Games（対戦回数）/ Wins（スコアで上回った回数）/ ScoreDiffSum（スコア差の合計）を持つ。
+    """
+    if df is None or df.empty:
+        return None
+
+    rows = df[["GameID", "PlayerName", "FinalScore"]].assign(
+        Combo=df["Nation"] + " × " + df["Executive"]
+    )
+    pairs = rows.merge(rows, on="GameID", suffixes=("", "Opp"))
+    pairs = pairs[pairs["PlayerName"] != pairs["PlayerNameOpp"]]
+    if pairs.empty:
+        return None
+
+    score_diff = pairs["FinalScore"] - pairs["FinalScoreOpp"]
+    return (
+        pairs.assign(Win=(score_diff > 0).astype(int), ScoreDiff=score_diff)
+        .groupby(["Combo", "ComboOpp"])
+        .agg(
+            Games=("Win", "size"),
+            Wins=("Win", "sum"),
+            ScoreDiffSum=("ScoreDiff", "sum"),
+        )
+    )
+
+
+def calculate_matchup_results(df, selected_combo, matrix=None):
+    """選択した組み合わせの、同じゲーム内の他の組み合わせに対する成績を計算"""
+    if matrix is None:
+        matrix = build_matchup_matrix(df)
+    if matrix is None or selected_combo not in matrix.index.get_level_values("Combo"):
+        return None
+
+    opp = matrix.xs(selected_combo, level="Combo")
+    win_rate = opp["Wins"] / opp["Games"] * 100
+    results = pd.DataFrame({
+        "対戦相手": opp.index,
+        "対戦回数": opp["Games"].to_numpy(),
+        "勝利": opp["Wins"].astype(int).to_numpy(),
+        "敗北": (opp["Games"] - opp["Wins"]).astype(int).to_numpy(),
+        "勝率": win_rate.map(lambda x: f"{x:.1f}%").to_numpy(),
+        "勝率数値": win_rate.to_numpy(),
+        "平均スコア差": (opp["ScoreDiffSum"] / opp["Games"]).round(1).to_numpy(),
+    })
+    return results.sort_values("対戦回数", ascending=False)
+
+
+def build_matchup_heatmap_data(matrix, combo_order):
+    """ヒートマップ用に、指定した組み合わせ同士のペアだけを縦持ちで取り出す"""
+    if matrix is None:
+        return None
+
+    pairs = matrix.reset_index()
+    pairs = pairs[pairs["Combo"].isin(combo_order) & pairs["ComboOpp"].isin(combo_order)]
+    if pairs.empty:
+        return None
+
+    return pd.DataFrame({
+        "組み合わせ": pairs["Combo"],
+        "対戦相手": pairs["ComboOpp"],
+        "対戦回数": pairs["Games"],
+        "勝率数値": (pairs["Wins"] / pairs["Games"] * 100).round(1),
+        "平均スコア差": (pairs["ScoreDiffSum"] / pairs["Games"]).round(1),
+    })
+
+
+def build_rivalry_matrix(df):
+    """プレイヤー同士の対戦成績（疎行列）をGameIDの自己結合1回で計算する
+
+    インデックスは (プレイヤー, 相手プレイヤー) の順序付きペアで、
+    Games（同卓回数）/ Above（相手より上位＝高スコアだった回数）/
+    Below（下位だった回数）/ ScoreDiffSum（スコア差の合計）を持つ。
+    """
+    if df is None or df.empty:
+        return None
+
+    rows = df[["GameID", "PlayerName", "FinalScore"]]
+    pairs = rows.merge(rows, on="GameID", suffixes=("", "Opp"))
+    pairs = pairs[pairs["PlayerName"] != pairs["PlayerNameOpp"]]
+    if pairs.empty:
+        return None
+
+    score_diff = pairs["FinalScore"] - pairs["FinalScoreOpp"]
+    return (
+        pairs.assign(Above=score_diff > 0, Below=score_diff < 0, ScoreDiff=score_diff)
+        .groupby(["PlayerName", "PlayerNameOpp"])
+        .agg(
+            Games=("GameID", "size"),
+            Above=("Above", "sum"),
+            Below=("Below", "sum"),
+            ScoreDiffSum=("ScoreDiff", "sum"),
+        )
+    )
+
+
+def merge_rivalry_matrices(*matrices):
+    """プレイヤー対戦行列同士を合算する"""
+    matrices = [m for m in matrices if m is not None]
+    if not matrices:
+        return None
+    return pd.concat(matrices).groupby(level=["PlayerName", "PlayerNameOpp"]).sum()
+
+
+def add_games_to_rivalry_matrix(matrix, game_df):
+    """ゲームの行をプレイヤー対戦行列に加える"""
+    return merge_rivalry_matrices(matrix, build_rivalry_matrix(game_df))
+
+
+@st.cache_resource
+def get_rivalry_store():
+    """プレイヤー対戦行列の保持領域（全期間・全条件分。保存時に増分更新する）"""
+    return make_incremental_index_store()
+
+
+def sync_rivalry_matrix(df):
+    """スナップショットに合わせてプレイヤー対戦行列を更新する（新しいゲームだけを追加）"""
+    if df is None or df.empty:
+        return None
+    return sync_incremental_index(
+        get_rivalry_store(), df, build_rivalry_matrix, add_games_to_rivalry_matrix
+    )
+
+
+def add_game_to_rivalry(game_df):
+    """スコアが確定したゲームをプレイヤー対戦行列に加える（O(プレイヤー数^2)）"""
+    add_game_to_incremental_index(get_rivalry_store(), game_df, add_games_to_rivalry_matrix)
+
+
+def build_rivalry_table(matrix, player_order=None):
+    """プレイヤー対戦行列を表示用の縦持ちの表にする（player_order で対象を絞れる）"""
+    if matrix is None or matrix.empty:
+        return None
+
+    pairs = matrix.reset_index()
+    if player_order is not None:
+        pairs = pairs[
+            pairs["PlayerName"].isin(player_order) & pairs["PlayerNameOpp"].isin(player_order)
+        ]
+    if pairs.empty:
+        return None
+
+    above_rate = pairs["Above"] / pairs["Games"] * 100
+    return pd.DataFrame({
+        "プレイヤー": pairs["PlayerName"],
+        "相手": pairs["PlayerNameOpp"],
+        "同卓回数": pairs["Games"].astype(int),
+        "上位": pairs["Above"].astype(int),
+        "下位": pairs["Below"].astype(int),
+        "上位率": above_rate.map(lambda x: f"{x:.1f}%"),
+        "上位率数値": above_rate.round(1),
+        "平均スコア差": (pairs["ScoreDiffSum"] / pairs["Games"]).round(1),
+    })
+
+
+def calculate_rivalry_breakdown(df, player_name, rival_name, player_index):
+    """2人のプレイヤーが同卓したゲームを、それぞれの国家×重役ごとに集計する
+
+    返り値は (プレイヤー側の組み合わせ別, 相手側の組み合わせ別)。
+    プレイヤーの行インデックスで2人の行だけを読む。
+    """
+    if df is None or df.empty:
+        return None, None
+
+    columns = ["GameID", "Nation", "Executive", "FinalScore"]
+    mine = take_indexed_rows(df, player_index, player_name)[columns]
+    theirs = take_indexed_rows(df, player_index, rival_name)[columns]
+    pairs = mine.merge(theirs, on="GameID", suffixes=("", "Rival"))
+    if pairs.empty:
+        return None, None
+
+    score_diff = pairs["FinalScore"] - pairs["FinalScoreRival"]
+    pairs = pairs.assign(
+        Above=score_diff > 0,
+        ScoreDiff=score_diff,
+        Combo=pairs["Nation"] + " × " + pairs["Executive"],
+        ComboRival=pairs["NationRival"] + " × " + pairs["ExecutiveRival"],
+    )
+
+    def by_combo(column, label, rate_label):
+        grouped = pairs.groupby(column).agg(
+            Games=("GameID", "size"), Above=("Above", "sum"), ScoreDiff=("ScoreDiff", "mean")
+        )
+        rate = grouped["Above"] / grouped["Games"] * 100
+        table = pd.DataFrame({
+            label: grouped.index,
+            "同卓回数": grouped["Games"].to_numpy(),
+            rate_label: rate.map(lambda x: f"{x:.1f}%").to_numpy(),
+            "平均スコア差": grouped["ScoreDiff"].round(1).to_numpy(),
+        })
+        return table.sort_values("同卓回数", ascending=False)
+
+    return (
+        by_combo("Combo", f"{player_name} の組み合わせ", f"{player_name} が上位"),
+        by_combo("ComboRival", f"{rival_name} の組み合わせ", f"{player_name} が上位"),
+    )
+
+
+def get_rating_entities(df, kind):
+    """レーティング対象（プレイヤー名 または 国家×重役）の列を返す"""
+    if kind == "combo":
+        return df["Nation"] + " × " + df["Executive"]
+    return df["PlayerName"]
+
+
+class RatingEngine:
+    """ゲームをGameID順に反映していく多人数Eloレーティング
+
+    1ゲームを参加者同士の総当たり（スコアが上なら勝ち、同点は引き分け）に分解し、
+    各ペアの期待勝率との差を K/(人数-1) 倍して加える。1ゲームの更新は参加者数分で済む。
+    RATING_CHECKPOINT_INTERVAL ゲームごとに全レーティングを保存しておき、
+    過去のゲームが修正・削除された場合はその直前のチェックポイントから再計算する。
+    """
+
+    def __init__(self, initial=RATING_INITIAL, k_factor=RATING_K_FACTOR,
+                 checkpoint_interval=RATING_CHECKPOINT_INTERVAL):
+        self.initial = initial
+        self.k_factor = k_factor
+        self.checkpoint_interval = checkpoint_interval
+        self.ratings = {}
+        self.game_ids = []  # 反映済みのGameID（昇順）
+        self.signatures = {}  # GameID -> (行数, スコア合計)
+        self.history = []  # (GameID, Timestamp, 対象, レーティング, 変動)
+        self.checkpoints = [(0, {}, 0)]  # (反映済みゲーム数, レーティング, 履歴の長さ)
+
+    @property
+    def last_game_id(self):
+        return self.game_ids[-1] if self.game_ids else None
+
+    def apply_game(self, game_id, timestamp, entities, scores):
+        """1ゲーム分の結果を反映する（game_id は反映済みのものより大きいこと）"""
+        n = len(entities)
+        if n >= 2:
+            before = [self.ratings.get(e, self.initial) for e in entities]
+            scale = self.k_factor / (n - 1)
+            for i, entity in enumerate(entities):
+                total = 0.0
+                for j in range(n):
+                    if i == j:
+                        continue
+                    expected = 1.0 / (1.0 + 10 ** ((before[j] - before[i]) / 400.0))
+                    actual = 1.0 if scores[i] > scores[j] else 0.5 if scores[i] == scores[j] else 0.0
+                    total += actual - expected
+                delta = scale * total
+                self.ratings[entity] = before[i] + delta
+                self.history.append((game_id, timestamp, entity, before[i] + delta, delta))
+
+        self.game_ids.append(game_id)
+        self.signatures[game_id] = (n, float(sum(scores)))
+        if len(self.game_ids) % self.checkpoint_interval == 0:
+            self.checkpoints.append((len(self.game_ids), dict(self.ratings), len(self.history)))
+
+    def rewind_before(self, game_id):
+        """game_id より前のチェックポイントまで状態を巻き戻す"""
+        position = int(np.searchsorted(self.game_ids, game_id, side="left"))
+        while self.checkpoints[-1][0] > position:
+            self.checkpoints.pop()
+        count, ratings, history_len = self.checkpoints[-1]
+        for dropped in self.game_ids[count:]:
+            self.signatures.pop(dropped, None)
+        del self.game_ids[count:]
+        del self.history[history_len:]
+        self.ratings = dict(ratings)
+
+    def replay(self, df, kind):
+        """スナップショットのうち未反映（最後に反映したGameIDより後）のゲームを順に反映する"""
+        last = self.last_game_id
+        rows = df if last is None else df[df["GameID"] > last]
+        if rows.empty:
+            return 0
+
+        rows = rows.assign(Entity=get_rating_entities(rows, kind)).sort_values(
+            "GameID", kind="stable"
+        )
+        game_ids = rows["GameID"].to_numpy()
+        entities = rows["Entity"].to_numpy()
+        scores = rows["FinalScore"].to_numpy()
+        timestamps = rows["Timestamp"].to_numpy() if "Timestamp" in rows.columns else None
+        starts = np.flatnonzero(np.r_[True, game_ids[1:] != game_ids[:-1]])
+        ends = np.r_[starts[1:], len(rows)]
+        for start, end in zip(starts, ends):
+            self.apply_game(
+                game_ids[start],
+                timestamps[start] if timestamps is not None else None,
+                list(entities[start:end]),
+                scores[start:end].tolist(),
+            )
+        return len(starts)
+
+    def find_divergence(self, signatures):
+        """スナップショットと食い違う最初のGameIDを返す（なければ None）
+
+        反映済みゲームの削除・修正と、最後のゲームより前への挿入を検出する。
+        """
+        known = pd.Series(self.signatures, dtype=object)
+        current = pd.Series(
+            list(zip(signatures["size"].astype(int), signatures["sum"].astype(float))),
+            index=signatures.index,
+            dtype=object,
+        )
+        candidates = []
+        if not known.empty:
+            missing = known.index.difference(current.index)
+            candidates.extend(missing)
+            shared = known.index.intersection(current.index)
+            changed = shared[known[shared].to_numpy() != current[shared].to_numpy()]
+            candidates.extend(changed)
+            inserted = current.index.difference(known.index)
+            candidates.extend(inserted[inserted < self.last_game_id])
+        return min(candidates) if candidates else None
+
+    def ratings_frame(self):
+        """現在のレーティング一覧（ゲーム数・最高値・直近の変動付き）"""
+        if not self.history:
+            return None
+        history = self.history_frame()
+        summary = history.groupby("Entity").agg(
+            Games=("Rating", "size"),
+            PeakRating=("Rating", "max"),
+            LastDelta=("Delta", "last"),
+        )
+        summary["Rating"] = pd.Series(self.ratings)
+        return summary.sort_values("Rating", ascending=False).reset_index()
+
+    def history_frame(self, entities=None):
+        """レーティングの推移（エンティティを指定するとその分だけ）"""
+        history = pd.DataFrame(
+            self.history, columns=["GameID", "Timestamp", "Entity", "Rating", "Delta"]
+        )
+        if entities is not None:
+            history = history[history["Entity"].isin(entities)]
+        return history
+
+
+@st.cache_resource
+def get_rating_store():
+    """レーティングエンジンの保持領域（全セッションで共有し、保存時に増分更新する）"""
+    return {
+        "lock": threading.Lock(),
+        "engines": {kind: RatingEngine() for kind in RATING_KINDS},
+        "versions": {kind: None for kind in RATING_KINDS},
+    }
+
+
+def sync_rating_engine(df, kind="player"):
+    """スナップショットに合わせてレーティングを更新し、エンジンを返す
+
+    新しいゲームだけを反映し、過去のゲームに変更があったときは
+    そのゲームより前のチェックポイントから再計算する。
+    """
+    if df is None or df.empty:
+        return None
+
+    store = get_rating_store()
+    version = get_snapshot_version(df)
+    with store["lock"]:
+        engine = store["engines"][kind]
+        if store["versions"][kind] != version:
+            divergence = engine.find_divergence(get_game_signatures(df))
+            if divergence is not None:
+                engine.rewind_before(divergence)
+            engine.replay(df, kind)
+            store["versions"][kind] = version
+        return engine
+
+
+def add_game_to_ratings(game_df):
+    """スコアが確定したゲームをレーティングに反映する（O(プレイヤー数)）"""
+    store = get_rating_store()
+    with store["lock"]:
+        for kind, engine in store["engines"].items():
+            # 未構築なら次回の同期で全体から作る。最新ゲームより前のIDは
+            # replay で無視され、次回の同期で食い違いとして巻き戻し・再計算される
+            if store["versions"][kind] is not None:
+                engine.replay(game_df, kind)
+
+
+def calculate_rating_table(df, kind="player"):
+    """現在のレーティング表（表示用の列名）を返す"""
+    engine = sync_rating_engine(df, kind)
+    if engine is None:
+        return None
+    with get_rating_store()["lock"]:
+        ratings = engine.ratings_frame()
+    if ratings is None:
+        return None
+
+    return pd.DataFrame({
+        "順位": range(1, len(ratings) + 1),
+        RATING_KINDS[kind]: ratings["Entity"],
+        "レーティング": ratings["Rating"].round().astype(int),
+        "最高": ratings["PeakRating"].round().astype(int),
+        "ゲーム数": ratings["Games"],
+        "直近の変動": ratings["LastDelta"].map(lambda x: f"{x:+.1f}"),
+    })
+
+
+def calculate_rating_history(df, kind, entities):
+    """指定したエンティティのレーティング推移（グラフ用に間引き済み）を返す"""
+    engine = sync_rating_engine(df, kind)
+    if engine is None or not entities:
+        return None
+    with get_rating_store()["lock"]:
+        history = engine.history_frame(entities)
+    return build_rating_history_chart_data(history)
+
+
+def build_rating_history_chart_data(history, max_points=CHART_TIMESERIES_MAX_POINTS):
+    """レーティング推移をエンティティごとに最大 max_points 点へ間引く（最新の点は必ず残す）"""
+    if history is None or history.empty:
+        return None
+
+    frames = []
+    for _, entity_history in history.groupby("Entity", sort=False):
+        if len(entity_history) > max_points:
+            positions = np.unique(
+                np.linspace(0, len(entity_history) - 1, max_points).round().astype(int)
+            )
+            entity_history = entity_history.iloc[positions]
+        frames.append(entity_history)
+    return pd.concat(frames, ignore_index=True)
+
+
+# --- 勝率予測モデル ---
+def build_win_model_features(df):
+    """勝率予測モデルの説明変数（すべてカテゴリとして文字列で扱う）"""
+    def as_label(series):
+        numeric = pd.to_numeric(series, errors="coerce")
+        return numeric.map(lambda x: "" if pd.isna(x) else str(int(x)))
+
+    return pd.DataFrame({
+        "Nation": df["Nation"].astype(str),
+        "Executive": df["Executive"].astype(str),
+        "Combo": df["Nation"].astype(str) + " × " + df["Executive"].astype(str),
+        "TurnOrder1R": as_label(df["TurnOrder1R"]),
+        "Board": df["Board"].fillna("").astype(str),
+        "PlayerCount": as_label(df["PlayerCount"]),
+    })[WIN_MODEL_FEATURES]
+
+
+def fit_win_probability_model(df, l2=WIN_MODEL_L2, max_iter=WIN_MODEL_MAX_ITER):
+    """過去のスコア記録から勝率予測モデル（L2正則化ロジスティック回帰）を学習する
+
+    説明変数はすべてワンホットで各行6つだけが1になるため、勾配とヘッセ行列は
+    その添字で bincount して作り、ニュートン法で解く（切片は正則化しない）。
+    返り値の weights は {(列名, 値): 係数}。
+    """
+    if df is None or df.empty:
+        return None
+
+    df = with_score_derived_columns(df).dropna(subset=["Nation", "Executive"])
+    if df.empty or df["IsWinner"].nunique() < 2:
+        return None
+
+    features = build_win_model_features(df)
+    columns, indices, offset = [], [], 0
+    for col in WIN_MODEL_FEATURES:
+        codes, uniques = pd.factorize(features[col])
+        indices.append(codes + offset)
+        columns.extend((col, value) for value in uniques)
+        offset += len(uniques)
+    indices = np.column_stack(indices)
+    n_rows, n_active = indices.shape
+    n_features = offset
+    pair_indices = (indices[:, :, None] * n_features + indices[:, None, :]).ravel()
+
+    y = df["IsWinner"].to_numpy(dtype=float)
+    weights = np.zeros(n_features)
+    intercept = np.log(y.mean() / (1 - y.mean()))
+    for iteration in range(1, max_iter + 1):
+        prob = 1 / (1 + np.exp(-(intercept + weights[indices].sum(axis=1))))
+        residual = prob - y
+        curvature = prob * (1 - prob)
+
+        gradient = np.empty(n_features + 1)
+        gradient[0] = residual.sum()
+        gradient[1:] = np.bincount(
+            indices.ravel(), weights=np.repeat(residual, n_active), minlength=n_features
+        ) + l2 * weights
+
+        hessian = np.empty((n_features + 1, n_features + 1))
+        hessian[0, 0] = curvature.sum()
+        hessian[0, 1:] = hessian[1:, 0] = np.bincount(
+            indices.ravel(), weights=np.repeat(curvature, n_active), minlength=n_features
+        )
+        hessian[1:, 1:] = np.bincount(
+            pair_indices, weights=np.repeat(curvature, n_active * n_active),
+            minlength=n_features * n_features,
+        ).reshape(n_features, n_features) + l2 * np.eye(n_features)
+
+        step = np.linalg.solve(hessian, gradient)
+        intercept -= step[0]
+        weights -= step[1:]
+        if np.abs(step).max() < 1e-6:
+            break
+
+    return {
+        "intercept": float(intercept),
+        "weights": dict(zip(columns, weights.tolist())),
+        "rows": n_rows,
+        "iterations": iteration,
+    }
 
-    return df
+
+def predict_win_probabilities(model, candidates, turn_order, board, player_count):
+    """(国家, 重役) の候補ごとの予測勝率を返す（係数を引いて足すだけなので学習済みなら軽い）"""
+    weights = model["weights"]
+    shared = (
+        model["intercept"]
+        + weights.get(("TurnOrder1R", str(int(turn_order))), 0.0)
+        + weights.get(("Board", str(board)), 0.0)
+        + weights.get(("PlayerCount", str(int(player_count))), 0.0)
+    )
+    probabilities = []
+    for nation, executive in candidates:
+        score = (
+            shared
+            + weights.get(("Nation", nation), 0.0)
+            + weights.get(("Executive", executive), 0.0)
+            + weights.get(("Combo", f"{nation} × {executive}"), 0.0)
+        )
+        probabilities.append(float(1 / (1 + np.exp(-score))))
+    return probabilities
+
+
+# 予測モデルの学習（約0.4秒）はドラフト画面の描画では行わない。ウォームアップのスレッドが
+# スコア記録を読み込んだときと、スコアを保存したときに学習し直し、ドラフト画面は
+# 最後に学習したモデルをそのまま使う。
+@st.cache_resource
+def get_win_model_store():
+    """最後に学習した勝率予測モデルと、その元になったスナップショットの版"""
+    return {"lock": threading.Lock(), "version": None, "model": None}
 
 
-def calculate_player_stats(df):
-    """プレイヤー別統計を計算"""
+def refresh_win_probability_model(df):
+    """スコア記録のスナップショットが変わっていれば予測モデルを学習し直す"""
     if df is None or df.empty:
         return None
+    version = get_snapshot_version(df)
+    store = get_win_model_store()
+    with store["lock"]:
+        if store["version"] == version:
+            return store["model"]
+    model = fit_win_probability_model(df)
+    with store["lock"]:
+        store["version"], store["model"] = version, model
+    return model
+
+
+def get_win_probability_model():
+    """ドラフト画面で使う勝率予測モデル
+
+    まだ一度も学習していなければ（ウォームアップが無効な起動直後など）ここで学習する。
+    スコア記録の読み込みに失敗したときは例外をそのまま返す。
+    """
+    store = get_win_model_store()
+    with store["lock"]:
+        model = store["model"]
+    if model is not None:
+        return model
+    note_cache_request("scores")
+    return refresh_win_probability_model(fetch_all_scores_from_sheet(cache_epoch(SHEET_CACHE_TTL)))
+
+
+def get_candidate_win_probabilities(candidates, turn_order):
+    """ドラフト中のプレイヤーから見た候補ごとの予測勝率（モデルがなければ空）"""
+    import gspread
 
-    # ゲームごとの順位を計算
-    df = df.copy()
-    df["Rank"] = df.groupby("GameID")["FinalScore"].rank(ascending=False, method="min")
-
-    stats = []
-    for player_name in df["PlayerName"].unique():
-        player_df = df[df["PlayerName"] == player_name]
-        game_count = player_df["GameID"].nunique()
-        win_count = len(player_df[player_df["Rank"] == 1])
-
-        stats.append({
-            "プレイヤー": player_name,
-            "ゲーム数": game_count,
-            "勝利数": win_count,
-            "勝率": f"{(win_count / game_count * 100):.1f}%" if game_count > 0 else "0%",
-            "平均スコア": round(player_df["FinalScore"].mean(), 1),
-            "最高スコア": int(player_df["FinalScore"].max()),
-            "平均順位": round(player_df["Rank"].mean(), 2),
-        })
+    setup_data = st.session_state.game_setup
+    if not candidates or turn_order is None:
+        return {}
+    try:
+        model = get_win_probability_model()
+    except (gspread.exceptions.GSpreadException, OSError):
+        # 予測は補助情報なので、スコア記録を読めなくてもドラフトは続けられるようにする
+        logger.warning("予測勝率のためのスコア記録を読み込めませんでした", exc_info=True)
+        return {}
+    if model is None:
+        return {}
+    probabilities = predict_win_probabilities(
+        model, candidates, turn_order, setup_data["board"], setup_data["player_count"]
+    )
+    return dict(zip(candidates, probabilities))
 
-    return pd.DataFrame(stats).sort_values("勝率", ascending=False)
 
+# --- 直近の使用履歴の索引 ---
+def normalize_board(board):
+    """ボード名を索引のキーにそろえる（未記入の古い記録は通常ボードとみなす）"""
+    if board is None or pd.isna(board) or str(board).strip() == "":
+        return DEFAULT_BOARD
+    return str(board).strip()
 
-def calculate_nation_stats(df):
-    """国家別統計を計算"""
+
+def add_recency_entry(index, player_name, board, game_id, nation, executive,
+                      window=RECENCY_WINDOW_GAMES):
+    """(プレイヤー, ボード) の直近 window ゲームに1ゲーム分を加える（古いものは押し出す）"""
+    entry = index.setdefault(
+        (player_name, board), {"games": [], "nations": {}, "executives": {}}
+    )
+    games = entry["games"]
+    if len(games) >= window and game_id <= games[0][0]:
+        return
+    if any(known_id == game_id for known_id, _, _ in games):
+        return
+
+    games.append((game_id, nation, executive))
+    games.sort(key=lambda game: game[0])
+    for counts, item in ((entry["nations"], nation), (entry["executives"], executive)):
+        counts[item] = counts.get(item, 0) + 1
+    if len(games) > window:
+        _, old_nation, old_executive = games.pop(0)
+        for counts, item in ((entry["nations"], old_nation), (entry["executives"], old_executive)):
+            counts[item] -= 1
+            if counts[item] == 0:
+                del counts[item]
+
+
+def build_recency_index(df, window=RECENCY_WINDOW_GAMES):
+    """(プレイヤー, ボード) ごとの直近 window ゲームで使った国家・重役の出現回数の索引"""
+    index = {}
     if df is None or df.empty:
-        return None
+        return index
 
-    df = df.copy()
-    df["Rank"] = df.groupby("GameID")["FinalScore"].rank(ascending=False, method="min")
-
-    stats = []
-    for nation in df["Nation"].unique():
-        nation_df = df[df["Nation"] == nation]
-        use_count = len(nation_df)
-        win_count = len(nation_df[nation_df["Rank"] == 1])
-
-        stats.append({
-            "国家": nation,
-            "使用回数": use_count,
-            "勝利数": win_count,
-            "勝率": f"{(win_count / use_count * 100):.1f}%" if use_count > 0 else "0%",
-            "平均スコア": round(nation_df["FinalScore"].mean(), 1),
-        })
+    rows = df.dropna(subset=["Nation", "Executive"]).assign(
+        Board=lambda x: x["Board"].map(normalize_board) if "Board" in x.columns else DEFAULT_BOARD
+    )
+    # 各キーの直近 window ゲームだけを取り出してから1行ずつ積む
+    rows = rows.sort_values("GameID").groupby(["PlayerName", "Board"], sort=False).tail(window)
+    for player_name, board, game_id, nation, executive in zip(
+        rows["PlayerName"], rows["Board"], rows["GameID"], rows["Nation"], rows["Executive"]
+    ):
+        add_recency_entry(index, player_name, board, game_id, nation, executive, window)
+    return index
 
-    return pd.DataFrame(stats).sort_values("使用回数", ascending=False)
 
+@st.cache_resource
+def get_recency_index_store():
+    """(プレイヤー, ボード) ごとの直近の使用履歴の保持領域（保存時に増分更新する）"""
+    return make_incremental_index_store()
 
-def calculate_executive_stats(df):
-    """重役別統計を計算"""
+
+def sync_recency_index(df):
+    """スナップショットに合わせて直近の使用履歴の索引を更新する（新しいゲームだけを追加）"""
     if df is None or df.empty:
         return None
+    return sync_incremental_index(
+        get_recency_index_store(), df, build_recency_index, add_games_to_recency_index
+    )
 
-    df = df.copy()
-    df["Rank"] = df.groupby("GameID")["FinalScore"].rank(ascending=False, method="min")
-
-    stats = []
-    for exec_name in df["Executive"].unique():
-        exec_df = df[df["Executive"] == exec_name]
-        use_count = len(exec_df)
-        win_count = len(exec_df[exec_df["Rank"] == 1])
-
-        stats.append({
-            "重役": exec_name,
-            "使用回数": use_count,
-            "勝利数": win_count,
-            "勝率": f"{(win_count / use_count * 100):.1f}%" if use_count > 0 else "0%",
-            "平均スコア": round(exec_df["FinalScore"].mean(), 1),
-        })
 
-    return pd.DataFrame(stats).sort_values("使用回数", ascending=False)
+def add_games_to_recency_index(index, game_df):
+    """ゲームの行を GameID 順に索引へ積む（同じGameIDは二重に数えない）"""
+    rows = game_df.dropna(subset=["Nation", "Executive"]).sort_values("GameID")
+    boards = rows["Board"] if "Board" in rows.columns else [None] * len(rows)
+    for player_name, board, game_id, nation, executive in zip(
+        rows["PlayerName"], boards, rows["GameID"], rows["Nation"], rows["Executive"]
+    ):
+        add_recency_entry(index, player_name, normalize_board(board), game_id, nation, executive)
+    return index
 
 
-def calculate_combination_stats(df):
-    """国家・重役の組み合わせ別統計を計算"""
-    if df is None or df.empty:
-        return None
+def add_game_to_recency_index(game_df):
+    """スコアが確定したゲームを直近の使用履歴に加える（O(プレイヤー数)）"""
+    add_game_to_incremental_index(get_recency_index_store(), game_df, add_games_to_recency_index)
 
-    df = df.copy()
-    df["Rank"] = df.groupby("GameID")["FinalScore"].rank(ascending=False, method="min")
-    df["組み合わせ"] = df["Nation"] + " × " + df["Executive"]
-
-    stats = []
-    for combo in df["組み合わせ"].unique():
-        combo_df = df[df["組み合わせ"] == combo]
-        use_count = len(combo_df)
-        win_count = len(combo_df[combo_df["Rank"] == 1])
-
-        # 国家と重役を分離
-        nation = combo_df["Nation"].iloc[0]
-        executive = combo_df["Executive"].iloc[0]
-
-        stats.append({
-            "国家": nation,
-            "重役": executive,
-            "組み合わせ": combo,
-            "使用回数": use_count,
-            "勝利数": win_count,
-            "勝率": f"{(win_count / use_count * 100):.1f}%" if use_count > 0 else "0%",
-            "勝率数値": (win_count / use_count * 100) if use_count > 0 else 0,
-            "平均スコア": round(combo_df["FinalScore"].mean(), 1),
-        })
 
-    return pd.DataFrame(stats).sort_values("使用回数", ascending=False)
+def add_draft_to_recency_index(game_id, board, picks):
+    """保存したドラフト（スコア未入力）を直近の使用履歴に加える
 
+    picks は [(プレイヤー, 国家, 重役), ...]。スコアが入るまで統計のスナップショットには
+    載らないので、pending として覚えておき、次のセットアップの抽選から割り引く。
+    """
+    game_df = pd.DataFrame(
+        [
+            {"GameID": int(game_id), "PlayerName": player_name, "Board": board,
+             "Nation": nation, "Executive": executive, "FinalScore": np.nan}
+            for player_name, nation, executive in picks
+        ]
+    )
+    add_game_to_incremental_index(
+        get_recency_index_store(), game_df, add_games_to_recency_index, pending=True
+    )
 
-def calculate_player_nation_exec_usage(df, player_name):
-    """プレイヤー別の国家・重役使用履歴を計算"""
-    if df is None or df.empty:
-        return None, None
 
-    df = df.copy()
-    df["Rank"] = df.groupby("GameID")["FinalScore"].rank(ascending=False, method="min")
-    player_df = df[df["PlayerName"] == player_name]
+def get_seated_recency_counts(player_names, board):
+    """着席プレイヤーがこのボードの直近のゲームで使った国家・重役の出現回数（合計）"""
+    df = load_all_scores_from_sheet()
+    index = sync_recency_index(df)
+    nation_counts, exec_counts = {}, {}
+    if not index:
+        return nation_counts, exec_counts
 
-    if player_df.empty:
-        return None, None
+    board = normalize_board(board)
+    for player_name in player_names:
+        entry = index.get((player_name, board))
+        if entry is None:
+            continue
+        for counts, recent in ((nation_counts, entry["nations"]), (exec_counts, entry["executives"])):
+            for item, count in recent.items():
+                counts[item] = counts.get(item, 0) + count
+    return nation_counts, exec_counts
+
+
+# --- 候補の制約付き抽選 ---
+def get_recent_player_nations(player_names, limit):
+    """プレイヤーごとに、直近 limit ゲームで使った国家の集合を返す
+
+    保存したがスコア未入力のドラフトも含めるため、直近の使用履歴の索引から求める。
+    索引は (プレイヤー, ボード) ごとに直近 RECENCY_WINDOW_GAMES ゲームを持つので、
+    limit がそれ以下なら、全ボードの分を GameID 順に並べ直せば直近 limit ゲームになる。
+    """
+    if limit <= 0:
+        return {}
+    index = sync_recency_index(load_all_scores_from_sheet())
+    if not index:
+        return {}
 
-    # 国家使用統計
-    nation_stats = []
-    for nation in player_df["Nation"].unique():
-        nation_filtered = player_df[player_df["Nation"] == nation]
-        use_count = len(nation_filtered)
-        win_count = len(nation_filtered[nation_filtered["Rank"] == 1])
-        nation_stats.append({
-            "国家": nation,
-            "使用回数": use_count,
-            "勝利数": win_count,
-            "勝率": f"{(win_count / use_count * 100):.1f}%" if use_count > 0 else "0%",
-            "平均スコア": round(nation_filtered["FinalScore"].mean(), 1),
-        })
+    limit = min(limit, RECENCY_WINDOW_GAMES)
+    players = set(player_names)
+    games_by_player = {}
+    for (player_name, _), entry in list(index.items()):
+        if player_name in players:
+            games_by_player.setdefault(player_name, []).extend(entry["games"])
+    return {
+        player_name: {nation for _, nation, _ in sorted(games, reverse=True)[:limit]}
+        for player_name, games in games_by_player.items()
+    }
 
-    # 重役使用統計
-    exec_stats = []
-    for exec_name in player_df["Executive"].unique():
-        exec_filtered = player_df[player_df["Executive"] == exec_name]
-        use_count = len(exec_filtered)
-        win_count = len(exec_filtered[exec_filtered["Rank"] == 1])
-        exec_stats.append({
-            "重役": exec_name,
-            "使用回数": use_count,
-            "勝利数": win_count,
-            "勝率": f"{(win_count / use_count * 100):.1f}%" if use_count > 0 else "0%",
-            "平均スコア": round(exec_filtered["FinalScore"].mean(), 1),
-        })
 
-    nation_df = pd.DataFrame(nation_stats).sort_values("使用回数", ascending=False) if nation_stats else None
-    exec_df = pd.DataFrame(exec_stats).sort_values("使用回数", ascending=False) if exec_stats else None
+def get_patched_names(master_df):
+    """現在のバージョンで変更点（PatchNotes）が記載されている名前の集合"""
+    if master_df is None or "PatchNotes" not in master_df.columns:
+        return set()
+    patch_notes = master_df["PatchNotes"].fillna("").astype(str).str.strip()
+    return set(master_df.loc[patch_notes != "", "Name"])
 
-    return nation_df, exec_df
 
+def count_bipartite_matching(lefts, neighbors, excluded=()):
+    """二部グラフの最大マッチングの大きさ（増加路法。候補数が少ないので十分速い）"""
+    matched = {}
 
-def calculate_turn_order_stats(df):
-    """1ラウンド目番手別の統計を計算"""
-    if df is None or df.empty:
+    def augment(left, visited):
+        for right in neighbors(left):
+            if right in visited or right in excluded:
+                continue
+            visited.add(right)
+            if right not in matched or augment(matched[right], visited):
+                matched[right] = left
+                return True
+        return False
+
+    return sum(augment(left, set()) for left in lefts)
+
+
+def build_candidate_constraints(nations, executives, num_candidates, banned_pairs=(),
+                                required_executives=(), player_banned_nations=None):
+    """候補の制約を、抽選中に「まだ条件を満たす候補を作れるか」を判定する関数にまとめる
+
+    - banned_pairs: 組み合わせてはいけない (国家, 重役)
+    - required_executives: このうち少なくとも1つを候補の重役に含める
+    - player_banned_nations: {プレイヤー: 避ける国家の集合}。各プレイヤーに
+      避ける国家以外の候補を1つずつ（重複なく）割り当てられるようにする
+    """
+    banned = set(map(tuple, banned_pairs))
+    required = set(required_executives) & set(executives)
+    player_banned = player_banned_nations or {}
+    players = list(player_banned)
+
+    exec_neighbors = {
+        nation: [e for e in executives if (nation, e) not in banned] for nation in nations
+    }
+    allowed_execs = exec_neighbors.__getitem__
+
+    def fresh_nations(player, pool):
+        return [n for n in pool if n not in player_banned[player]]
+
+    def required_matchable(chosen, remaining):
+        """必須の重役のどれかを、chosen の国家か後から足す国家に割り当てられるか"""
+        for executive in required:
+            if count_bipartite_matching(chosen, allowed_execs, excluded={executive}) == len(chosen):
+                # chosen を必須の重役なしで割り当てられるなら、後から足す国家に回せばよい
+                if remaining > 0 and any(
+                    (nation, executive) not in banned for nation in nations if nation not in chosen
+                ):
+                    return True
+            for nation in chosen:
+                if (nation, executive) in banned:
+                    continue
+                rest = [n for n in chosen if n != nation]
+                if count_bipartite_matching(rest, allowed_execs, excluded={executive}) == len(rest):
+                    return True
+        return False
+
+    def nations_valid(chosen):
+        """国家の組 chosen を含み、条件を満たす候補の組が残っているか（必要条件）"""
+        remaining = num_candidates - len(chosen)
+        if count_bipartite_matching(chosen, allowed_execs) < len(chosen):
+            return False
+        if required and not required_matchable(chosen, remaining):
+            return False
+        # 全プレイヤーに割り当てるのに、chosen の外から足す国家が remaining 以内で済むか
+        # （割り当て可能な国家の組はマトロイドになるので、最大で chosen から
+        # count_bipartite_matching(players, chosen) 人分を賄える）
+        if players:
+            missing = len(players) - count_bipartite_matching(
+                players, lambda p: fresh_nations(p, chosen)
+            )
+            if missing > remaining:
+                return False
+        return True
+
+    memo = {}
+
+    def nations_feasible(chosen):
+        """chosen を含む国家の組で、最後まで条件を満たせるものがあるか"""
+        key = frozenset(chosen)
+        if key in memo:
+            return memo[key]
+        if not nations_valid(chosen):
+            result = False
+        elif len(chosen) == num_candidates:
+            # 揃った時点では、必須の重役の判定も含めて nations_valid が正確な条件になる
+            result = True
+        else:
+            result = any(
+                nations_feasible(chosen + [nation])
+                for nation in nations
+                if nation not in key
+            )
+        memo[key] = result
+        return result
+
+    def execs_feasible(chosen_nations, chosen):
+        """国家が決まった後、重役の組 chosen を広げて全国家に割り当てられるか
+
+        割り当て可能な重役の組はマトロイドになるため、chosen が割り当て可能で
+        必須の重役を1つ足しても割り当て可能なら、必ず最後まで広げられる。
+        """
+        def allowed_nations(executive):
+            return [n for n in chosen_nations if (n, executive) not in banned]
+
+        if count_bipartite_matching(chosen, allowed_nations) < len(chosen):
+            return False
+        if not required or required & set(chosen):
+            return True
+        return any(
+            count_bipartite_matching(chosen + [e], allowed_nations) == len(chosen) + 1
+            for e in required
+        )
+
+    return {"nations": nations_feasible, "executives": execs_feasible, "banned": banned}
+
+
+def sample_feasible_sequence(items, weights, n, feasible, rng=random):
+    """重み付きで1つずつ非復元抽出する。選ぶたびに、条件を満たせなくなる候補は除く
+
+    すべての選択肢を事前に判定してから引くため、引き直しは発生しない。
+    """
+    chosen = []
+    for _ in range(n):
+        options = [item for item in items if item not in chosen and feasible(chosen + [item])]
+        if not options:
+            return None
+        chosen.append(
+            rng.choices(options, weights=[weights.get(item, 1.0) for item in options])[0]
+        )
+    return chosen
+
+
+def diagnose_candidate_constraints(nations, executives, num_candidates, banned_pairs,
+                                   required_executives, player_banned_nations):
+    """条件を満たす候補を作れないとき、どの制約が原因かを説明する文を返す"""
+    rules = {
+        "組み合わせ禁止": {"banned_pairs": banned_pairs},
+        "変更のあった重役を含める": {"required_executives": required_executives},
+        "直近に使った国家を避ける": {"player_banned_nations": player_banned_nations},
+    }
+    culprits = [
+        label for label, kwargs in rules.items()
+        if any(kwargs.values())
+        and not build_candidate_constraints(nations, executives, num_candidates, **kwargs)["nations"]([])
+    ]
+    if culprits:
+        return f"次の制約だけで候補を作れません: {', '.join(culprits)}"
+    return "制約の組み合わせを同時に満たす候補を作れません。"
+
+
+def sample_constrained_candidates(nations, executives, num_candidates, nation_weights=None,
+                                  exec_weights=None, banned_pairs=(), required_executives=(),
+                                  player_banned_nations=None, balanced=False, rng=random):
+    """制約を満たす国家・重役の候補を重み付きで抽選する
+
+    返り値は (候補のリスト, ペアリングの強さのばらつき, エラーメッセージ)。
+    制約を満たせない場合は抽選を始める前に判定し、候補は None になる。
+    """
+    nation_weights = nation_weights or {}
+    exec_weights = exec_weights or {}
+    if len(nations) < num_candidates or len(executives) < num_candidates:
+        return None, None, "選択された国家または重役の数が、必要な候補数より少ないです。"
+
+    constraints = build_candidate_constraints(
+        nations, executives, num_candidates, banned_pairs, required_executives,
+        player_banned_nations,
+    )
+    if not constraints["nations"]([]):
+        message = diagnose_candidate_constraints(
+            nations, executives, num_candidates, banned_pairs, required_executives,
+            player_banned_nations,
+        )
+        return None, None, message
+
+    selected_nations = sample_feasible_sequence(
+        nations, nation_weights, num_candidates, constraints["nations"], rng
+    )
+    selected_execs = sample_feasible_sequence(
+        executives, exec_weights, num_candidates,
+        lambda chosen: constraints["executives"](selected_nations, chosen), rng,
+    )
+
+    # 禁止された組み合わせを含まない割り当てだけを対象にする
+    banned = constraints["banned"]
+    perms = get_pairing_permutations(num_candidates)
+    allowed = np.array([
+        [(nation, executive) not in banned for executive in selected_execs]
+        for nation in selected_nations
+    ])
+    allowed_perms = perms[allowed[np.arange(num_candidates), perms].all(axis=1)]
+
+    if balanced:
+        candidates, spread = pair_candidates_balanced(
+            selected_nations, selected_execs, allowed_perms, rng
+        )
+    else:
+        perm = allowed_perms[rng.randrange(len(allowed_perms))]
+        candidates = [(nation, selected_execs[j]) for nation, j in zip(selected_nations, perm)]
+        spread = None
+    return candidates, spread, None
+
+
+# --- バランス重視ペアリング ---
+def build_combo_strength_table(combo_stats, prior=COMBO_SHRINKAGE_PRIOR):
+    """組み合わせ別統計から、国家・重役の勝率へ縮約した組み合わせの強さを作る
+
+    国家・重役それぞれの勝率を全体の勝率へ縮約し、組み合わせの事前値は
+    「国家 + 重役 - 全体」とする。組み合わせの勝率はこの事前値へ縮約する。
+    返り値は {"overall", "nations", "executives", "combos"}（値はすべて勝率0〜1）。
+    """
+    if combo_stats is None or combo_stats.empty:
         return None
 
-    df = df.copy()
-    # TurnOrder1Rが有効なデータのみ
-    df = df[df["TurnOrder1R"].notna() & (df["TurnOrder1R"] > 0)]
-    if df.empty:
+    counts = combo_stats["使用回数"].to_numpy(dtype=float)
+    wins = combo_stats["勝利数"].to_numpy(dtype=float)
+    overall = wins.sum() / counts.sum()
+
+    def shrunk_rates(column):
+        grouped = combo_stats.groupby(column, sort=False)[["使用回数", "勝利数"]].sum()
+        rates = (grouped["勝利数"] + prior * overall) / (grouped["使用回数"] + prior)
+        return rates.to_dict()
+
+    nations = shrunk_rates("国家")
+    executives = shrunk_rates("重役")
+    base = np.clip(
+        combo_stats["国家"].map(nations).to_numpy() + combo_stats["重役"].map(executives).to_numpy()
+        - overall,
+        0.0, 1.0,
+    )
+    combos = (wins + prior * base) / (counts + prior)
+    return {
+        "overall": overall,
+        "nations": nations,
+        "executives": executives,
+        "combos": dict(zip(zip(combo_stats["国家"], combo_stats["重役"]), combos.tolist())),
+    }
+
+
+def build_combo_strength_matrix(strength, nations, executives):
+    """候補の国家×重役の強さ行列（記録のない組み合わせは事前値で補う）"""
+    overall = strength["overall"]
+    matrix = np.empty((len(nations), len(executives)))
+    for i, nation in enumerate(nations):
+        nation_rate = strength["nations"].get(nation, overall)
+        for j, executive in enumerate(executives):
+            combo = strength["combos"].get((nation, executive))
+            if combo is None:
+                exec_rate = strength["executives"].get(executive, overall)
+                combo = min(max(nation_rate + exec_rate - overall, 0.0), 1.0)
+            matrix[i, j] = combo
+    return matrix
+
+
+@st.cache_resource
+def get_pairing_permutations(n):
+    """n個の割り当てをすべて並べた配列（候補数は最大7なので 7! = 5040 通り）"""
+    return np.array(list(permutations(range(n))), dtype=np.intp).reshape(-1, n)
+
+
+def find_balanced_pairing(matrix, perms=None, rng=random):
+    """強さのばらつき（最大 - 最小）が最小になる国家→重役の割り当てを返す
+
+    ばらつきは割り当ての和では表せないため、全割り当て（perms を渡した場合は
+    その中の割り当て）を行列演算で一度に評価する。ばらつきが同じなら分散の
+    小さい方を、それも同じならランダムに選ぶ。
+    返り値 perm は、国家 i に重役 perm[i] を割り当てることを表す。
+    """
+    n = matrix.shape[0]
+    if n == 0:
+        return []
+    if perms is None:
+        perms = get_pairing_permutations(n)
+    values = matrix[np.arange(n), perms]
+    score = values.max(axis=1) - values.min(axis=1) + 1e-3 * values.var(axis=1)
+    best = np.flatnonzero(score <= score.min() + 1e-12)
+    return perms[best[rng.randrange(len(best))]].tolist()
+
+
+def get_combo_strength():
+    """組み合わせの強さ（スナップショットごとに1回だけ計算する）"""
+    df = load_all_scores_from_sheet()
+    if df is None or df.empty:
         return None
 
-    df["Rank"] = df.groupby("GameID")["FinalScore"].rank(ascending=False, method="min")
-
-    stats = []
-    for turn_order in sorted(df["TurnOrder1R"].unique()):
-        order_df = df[df["TurnOrder1R"] == turn_order]
-        use_count = len(order_df)
-        win_count = len(order_df[order_df["Rank"] == 1])
-
-        stats.append({
-            "番手": int(turn_order),
-            "ゲーム数": use_count,
-            "勝利数": win_count,
-            "勝率": f"{(win_count / use_count * 100):.1f}%" if use_count > 0 else "0%",
-            "勝率数値": (win_count / use_count * 100) if use_count > 0 else 0,
-            "平均スコア": round(order_df["FinalScore"].mean(), 1),
-            "平均順位": round(order_df["Rank"].mean(), 2),
-        })
+    def compute():
+        cube = sync_stats_cube(df)
+        stats = query_stats_cube(cube, ["Nation", "Executive"]) if cube is not None else None
+        return build_combo_strength_table(calculate_combination_stats(df, stats=stats))
+
+    return get_stats_result_cache().get_or_compute(
+        (get_snapshot_version(df), "combo_strength"), compute
+    )
 
-    return pd.DataFrame(stats).sort_values("番手")
+
+def pair_candidates_balanced(nations, executives, perms=None, rng=random):
+    """抽選された国家と重役を、組み合わせの強さがなるべく揃うように組み合わせる
+
+    perms で割り当ての候補を絞れる。過去の記録がなければ候補の中から
+    ランダムに組み合わせる。
+    """
+    if perms is None:
+        perms = get_pairing_permutations(len(nations))
+    strength = get_combo_strength()
+    if strength is None:
+        perm = perms[rng.randrange(len(perms))]
+        return [(nation, executives[j]) for nation, j in zip(nations, perm)], None
+    matrix = build_combo_strength_matrix(strength, nations, executives)
+    perm = find_balanced_pairing(matrix, perms, rng)
+    values = matrix[np.arange(len(nations)), perm]
+    candidates = [(nation, executives[j]) for nation, j in zip(nations, perm)]
+    return candidates, float(values.max() - values.min()) if candidates else None
+
+
+def run_timed_section(label, render):
+    """セクションを描画し、所要時間(ms)をセッションに記録する"""
+    started = time.perf_counter()
+    render()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    timings = st.session_state.setdefault("stats_section_timings", {})
+    timings[label] = elapsed_ms
+    return elapsed_ms
+
+
+def render_stats_sections(sections, lazy=True, timing_placeholder=None):
+    """統計セクションを描画する
+
+    lazy=True のときは選択中のセクションだけを計算・描画し、他は開かれるまで実行しない。
+    lazy=False のときは従来どおり st.tabs で全セクションを描画する。
+    """
+    labels = [label for label, _ in sections]
+    rendered = []
+
+    if lazy:
+        selected = st.radio(
+            "表示するセクション",
+            labels,
+            horizontal=True,
+            key="stats_section",
+            label_visibility="collapsed",
+        )
+        render = dict(sections)[selected]
+        run_timed_section(selected, render)
+        rendered.append(selected)
+    else:
+        tabs = st.tabs(labels)
+        for tab, (label, render) in zip(tabs, sections):
+            with tab:
+                run_timed_section(label, render)
+            rendered.append(label)
+
+    if timing_placeholder is not None:
+        timings = st.session_state.get("stats_section_timings", {})
+        timing_df = pd.DataFrame({
+            "セクション": labels,
+            "時間(ms)": [round(timings[l], 1) if l in timings else None for l in labels],
+            "今回実行": ["✓" if l in rendered else "" for l in labels],
+        })
+        with timing_placeholder.container():
+            st.caption(f"セクション計算時間（今回合計 {sum(timings[l] for l in rendered):.0f} ms）")
+            st.dataframe(timing_df, use_container_width=True, hide_index=True)
 
 
 def show_stats_screen():
@@ -2125,7 +5748,19 @@ def show_stats_screen():
             with col_d2:
                 end_date = st.date_input("終了日", value=datetime.now())
 
-    df = filter_df_by_period(df, selected_period, start_date, end_date)
+    # フィルター結果と各タブの計算結果は「スナップショット版 + 正規化したフィルター」をキーにキャッシュする
+    snapshot_df = df
+    stats_cache = get_stats_result_cache()
+    snapshot_version = get_snapshot_version(df)
+    filter_key = normalize_period_filter(selected_period, start_date, end_date)
+
+    def cached_result(name, compute):
+        return stats_cache.get_or_compute((snapshot_version, filter_key, name), compute)
+
+    df = cached_result(
+        "filtered_df",
+        lambda: filter_df_by_period(df, selected_period, start_date, end_date),
+    )
 
     if df.empty:
         st.warning(f"選択した期間（{selected_period}）にはデータがありません。")
@@ -2133,42 +5768,104 @@ def show_stats_screen():
 
     # ボードフィルター
     st.sidebar.divider()
-    available_boards = ["すべて"] + sorted(df["Board"].dropna().unique().tolist())
+    available_boards = ["すべて"] + cached_result(
+        "board_options", lambda: sorted(df["Board"].dropna().unique().tolist())
+    )
     selected_board = st.sidebar.selectbox("ボード", available_boards)
+    filter_key += (selected_board,)
     if selected_board != "すべて":
-        df = df[df["Board"] == selected_board]
+        df = cached_result("filtered_df", lambda: df[df["Board"] == selected_board])
 
     # プレイヤー数フィルター
-    available_counts = ["すべて"] + sorted([int(x) for x in df["PlayerCount"].dropna().unique()])
+    available_counts = ["すべて"] + cached_result(
+        "count_options",
+        lambda: sorted([int(x) for x in df["PlayerCount"].dropna().unique()]),
+    )
     selected_count = st.sidebar.selectbox("プレイヤー数", available_counts)
+    filter_key += (selected_count,)
     if selected_count != "すべて":
-        df = df[df["PlayerCount"] == selected_count]
+        df = cached_result("filtered_df", lambda: df[df["PlayerCount"] == selected_count])
 
     # ドラフト方式フィルター
     draft_method_map = {"すべて": None, "通常ドラフト": "normal", "オークション": "auction"}
     selected_method_display = st.sidebar.selectbox("ドラフト方式", list(draft_method_map.keys()))
     selected_method = draft_method_map[selected_method_display]
+    filter_key += (selected_method,)
     if selected_method is not None:
-        df = df[df["DraftMethod"] == selected_method]
+        df = cached_result("filtered_df", lambda: df[df["DraftMethod"] == selected_method])
+
+    # 表示モード（st.tabs はクライアント側の切り替えだけなので、全タブの中身が毎回計算される）
+    st.sidebar.divider()
+    lazy_sections = st.sidebar.toggle(
+        "選択中のセクションだけ計算する",
+        value=True,
+        key="stats_lazy_sections",
+        help="オフにすると全セクションをタブで表示します（全タブ分を毎回計算）。",
+    )
+    timing_placeholder = st.sidebar.empty()
 
     if df.empty:
         st.warning("選択した条件に一致するデータがありません。")
         return
 
-    # タブで統計カテゴリを分ける
-    tab1, tab2, tab2b, tab3, tab4, tab5, tab6 = st.tabs([
-        "📈 総合", "👤 プレイヤー", "📋 プレイヤー詳細", "🏛️ 国家", "👔 重役", "🔗 組み合わせ", "🔢 番手"
-    ])
+    # 主要な統計表は集計キューブのセルを合計して求める（行を走査し直さない）
+    stats_cube = sync_stats_cube(snapshot_df)
+    period_bounds = get_period_bounds(selected_period, start_date, end_date)
+    cube_where = {
+        "Board": None if selected_board == "すべて" else selected_board,
+        "PlayerCount": None if selected_count == "すべて" else selected_count,
+        "DraftMethod": selected_method,
+    }
 
-    with tab1:
+    def cube_stats(keys, **where):
+        if stats_cube is None:
+            return None
+        return query_stats_cube(stats_cube, keys, period_bounds, {**cube_where, **where})
+
+    # プレイヤー・国家などの値ごとの行位置。詳細表示は選択した値の行だけを読む
+    def row_index(column):
+        return cached_result(("row_index", column), lambda: build_row_index(df, column))
+
+    def select_rows(**where):
+        rows = df
+        for i, (col, value) in enumerate(where.items()):
+            if i == 0:
+                rows = take_indexed_rows(df, row_index(col), value)
+            else:
+                rows = rows[rows[col] == value]
+        return rows
+
+    # 勝率・平均スコアの信頼区間（ゲーム単位のブートストラップ）も同じキーでキャッシュする
+    def group_ci(keys, **where):
+        def compute():
+            return bootstrap_group_ci(select_rows(**where), keys)
+
+        return cached_result(("ci", str(keys), tuple(sorted(where.items()))), compute)
+
+    # 各ゲームをバランス調整バージョンで1回だけタグ付けし、バージョン別の集計はこれを使い回す
+    balance_versions = build_balance_versions(balance_log)
+    balance_key = tuple(balance_versions["BalanceVersion"])
+
+    ci_caption = (
+        f"{WIN_RATE_CI_LABEL}・{MEAN_SCORE_CI_LABEL}: ゲームを単位に復元抽出した"
+        "ブートストラップによる95%信頼区間（使用回数が少ないほど幅が広くなります）"
+    )
+
+    # 各統計カテゴリはセクション関数にまとめ、表示するものだけを呼び出す
+    def render_overview():
         st.header("総合統計")
 
         # メトリクスカード
         col1, col2, col3, col4 = st.columns(4)
-        total_games = df["GameID"].nunique()
-        total_players = df["PlayerName"].nunique()
-        avg_score = df["FinalScore"].mean()
-        max_score = df["FinalScore"].max()
+        total_games, total_players, avg_score, max_score = cached_result(
+            "overview_metrics",
+            lambda: (
+                df["GameID"].nunique(),
+                df["PlayerName"].nunique(),
+                df["FinalScore"].mean(),
+                df["FinalScore"].max(),
+            ),
+        )
 
         col1.metric("総ゲーム数", total_games)
         col2.metric("参加プレイヤー数", total_players)
@@ -2177,34 +5874,67 @@ def show_stats_screen():
 
         st.divider()
 
-        # スコア分布グラフ
+        # スコア分布グラフ（ビンの集計はサーバー側で行い、ビン数分の行だけを送る）
         st.subheader("スコア分布")
-        score_hist = alt.Chart(df).mark_bar().encode(
-            alt.X("FinalScore:Q", bin=alt.Bin(maxbins=20), title="スコア"),
-            alt.Y("count()", title="回数"),
-            tooltip=["count()"]
-        ).properties(height=300)
-        st.altair_chart(score_hist, use_container_width=True)
+        score_bins = cached_result(
+            "score_histogram", lambda: build_score_histogram(df["FinalScore"])
+        )
+        if score_bins is not None:
+            score_hist = alt.Chart(score_bins).mark_bar().encode(
+                alt.X("BinStart:Q", bin="binned", title="スコア"),
+                alt.X2("BinEnd:Q"),
+                alt.Y("回数:Q", title="回数"),
+                tooltip=[
+                    alt.Tooltip("BinStart:Q", title="から"),
+                    alt.Tooltip("BinEnd:Q", title="未満"),
+                    "回数",
+                ]
+            ).properties(height=300)
+            st.altair_chart(score_hist, use_container_width=True)
 
         # 時系列グラフ（ゲームごとの平均スコア推移）
         if "Timestamp" in df.columns:
             st.subheader("平均スコア推移")
-            game_avg = df.groupby(["GameID", "Timestamp"]).agg({
-                "FinalScore": "mean"
-            }).reset_index().sort_values("Timestamp")
+            game_avg, total_games_in_series = cached_result(
+                "score_timeseries", lambda: build_score_timeseries(df)
+            )
 
-            line_chart = alt.Chart(game_avg).mark_line(point=True).encode(
-                alt.X("Timestamp:T", title="日時"),
-                alt.Y("FinalScore:Q", title="平均スコア"),
-                tooltip=["Timestamp:T", alt.Tooltip("FinalScore:Q", format=".1f")]
-            ).properties(height=300)
-            st.altair_chart(line_chart, use_container_width=True)
+            if game_avg is not None:
+                base = alt.Chart(game_avg).encode(alt.X("Timestamp:T", title="日時"))
+                line_chart = base.mark_line(point=True).encode(
+                    alt.Y("FinalScore:Q", title="平均スコア"),
+                    tooltip=[
+                        "Timestamp:T",
+                        alt.Tooltip("FinalScore:Q", format=".1f"),
+                        alt.Tooltip("Games:Q", title="ゲーム数"),
+                    ]
+                )
+                rolling_chart = base.mark_line(color="#FF9800", strokeDash=[4, 2]).encode(
+                    alt.Y("RollingScore:Q"),
+                    tooltip=[alt.Tooltip("RollingScore:Q", format=".1f", title="移動平均")],
+                )
+                st.altair_chart(
+                    (line_chart + rolling_chart).properties(height=300),
+                    use_container_width=True,
+                )
+                st.caption(
+                    f"点線は直近{CHART_ROLLING_WINDOW}ゲームの移動平均"
+                    + (
+                        f"（{total_games_in_series}ゲームを{len(game_avg)}点に集約して表示）"
+                        if total_games_in_series > len(game_avg)
+                        else ""
+                    )
+                )
 
-    with tab2:
+    def render_players():
         st.header("プレイヤー別統計")
-        player_stats = calculate_player_stats(df)
+        player_stats = cached_result(
+            "player_stats",
+            lambda: calculate_player_stats(df, cube_stats("PlayerName"), group_ci("PlayerName")),
+        )
         if player_stats is not None and not player_stats.empty:
             st.dataframe(player_stats, use_container_width=True, hide_index=True)
+            st.caption(ci_caption)
 
             # プレイヤー別平均スコアグラフ
             st.subheader("プレイヤー別平均スコア")
@@ -2218,13 +5948,24 @@ def show_stats_screen():
         else:
             st.info("データがありません。")
 
-    with tab2b:
+    def render_player_detail():
         st.header("プレイヤー詳細")
-        all_players = sorted(df["PlayerName"].unique().tolist())
+        all_players = cached_result(
+            "player_names", lambda: sorted(df["PlayerName"].unique().tolist())
+        )
         if all_players:
             selected_player = st.selectbox("プレイヤーを選択", all_players, key="player_detail_select")
             
-            nation_usage, exec_usage = calculate_player_nation_exec_usage(df, selected_player)
+            nation_usage, exec_usage = cached_result(
+                ("player_usage", selected_player),
+                lambda: calculate_player_nation_exec_usage(
+                    df,
+                    selected_player,
+                    nation_ci=group_ci("Nation", PlayerName=selected_player),
+                    exec_ci=group_ci("Executive", PlayerName=selected_player),
+                    player_index=row_index("PlayerName"),
+                ),
+            )
             
             col1, col2 = st.columns(2)
             
@@ -2259,14 +6000,34 @@ def show_stats_screen():
                     st.altair_chart(exec_chart, use_container_width=True)
                 else:
                     st.info("データがありません。")
+
+            st.subheader("🤝 プレイヤー別対戦成績")
+            head_to_head = cached_result(
+                ("player_head_to_head", selected_player),
+                lambda: calculate_player_head_to_head(
+                    df, selected_player, row_index("PlayerName"), row_index("GameID")
+                ),
+            )
+            if head_to_head is not None and not head_to_head.empty:
+                st.dataframe(
+                    head_to_head[["対戦相手", "対戦回数", "勝利", "敗北", "勝率", "平均スコア差"]],
+                    use_container_width=True,
+                    hide_index=True,
+                )
+            else:
+                st.info("データがありません。")
         else:
             st.info("プレイヤーデータがありません。")
 
-    with tab3:
+    def render_nations():
         st.header("国家別統計")
-        nation_stats = calculate_nation_stats(df)
+        nation_stats = cached_result(
+            "nation_stats",
+            lambda: calculate_nation_stats(df, cube_stats("Nation"), group_ci("Nation")),
+        )
         if nation_stats is not None and not nation_stats.empty:
             st.dataframe(nation_stats, use_container_width=True, hide_index=True)
+            st.caption(ci_caption)
 
             # 国家別使用回数グラフ
             st.subheader("国家別使用回数")
@@ -2286,34 +6047,31 @@ def show_stats_screen():
             def nation_breakdown_fragment():
                 selected_nation = st.selectbox("国家を選択", nation_stats["国家"].tolist(), key="nation_player_breakdown")
                 if selected_nation:
-                    # Rankは全体データで計算してからフィルタリング
-                    df_with_rank = df.copy()
-                    df_with_rank["Rank"] = df_with_rank.groupby("GameID")["FinalScore"].rank(ascending=False, method="min")
-                    nation_player_df = df_with_rank[df_with_rank["Nation"] == selected_nation]
-                    breakdown = []
-                    for player in nation_player_df["PlayerName"].unique():
-                        p_df = nation_player_df[nation_player_df["PlayerName"] == player]
-                        use_count = len(p_df)
-                        win_count = len(p_df[p_df["Rank"] == 1])
-                        breakdown.append({
-                            "プレイヤー": player,
-                            "使用回数": use_count,
-                            "勝利数": win_count,
-                            "勝率": f"{(win_count / use_count * 100):.1f}%" if use_count > 0 else "0%",
-                            "平均スコア": round(p_df["FinalScore"].mean(), 1),
-                        })
-                    breakdown_df = pd.DataFrame(breakdown).sort_values("使用回数", ascending=False)
-                    st.dataframe(breakdown_df, use_container_width=True, hide_index=True)
+                    breakdown_df = cached_result(
+                        ("nation_breakdown", selected_nation),
+                        lambda: calculate_player_breakdown(
+                            select_rows(Nation=selected_nation),
+                            "Nation",
+                            selected_nation,
+                            ci=group_ci("PlayerName", Nation=selected_nation),
+                        ),
+                    )
+                    if breakdown_df is not None:
+                        st.dataframe(breakdown_df, use_container_width=True, hide_index=True)
             
             nation_breakdown_fragment()
         else:
             st.info("データがありません。")
 
-    with tab4:
+    def render_executives():
         st.header("重役別統計")
-        exec_stats = calculate_executive_stats(df)
+        exec_stats = cached_result(
+            "exec_stats",
+            lambda: calculate_executive_stats(df, cube_stats("Executive"), group_ci("Executive")),
+        )
         if exec_stats is not None and not exec_stats.empty:
             st.dataframe(exec_stats, use_container_width=True, hide_index=True)
+            st.caption(ci_caption)
 
             # 重役別使用回数グラフ
             st.subheader("重役別使用回数")
@@ -2333,36 +6091,39 @@ def show_stats_screen():
             def exec_breakdown_fragment():
                 selected_exec = st.selectbox("重役を選択", exec_stats["重役"].tolist(), key="exec_player_breakdown")
                 if selected_exec:
-                    # Rankは全体データで計算してからフィルタリング
-                    df_with_rank = df.copy()
-                    df_with_rank["Rank"] = df_with_rank.groupby("GameID")["FinalScore"].rank(ascending=False, method="min")
-                    exec_player_df = df_with_rank[df_with_rank["Executive"] == selected_exec]
-                    breakdown = []
-                    for player in exec_player_df["PlayerName"].unique():
-                        p_df = exec_player_df[exec_player_df["PlayerName"] == player]
-                        use_count = len(p_df)
-                        win_count = len(p_df[p_df["Rank"] == 1])
-                        breakdown.append({
-                            "プレイヤー": player,
-                            "使用回数": use_count,
-                            "勝利数": win_count,
-                            "勝率": f"{(win_count / use_count * 100):.1f}%" if use_count > 0 else "0%",
-                            "平均スコア": round(p_df["FinalScore"].mean(), 1),
-                        })
-                    breakdown_df = pd.DataFrame(breakdown).sort_values("使用回数", ascending=False)
-                    st.dataframe(breakdown_df, use_container_width=True, hide_index=True)
+                    breakdown_df = cached_result(
+                        ("exec_breakdown", selected_exec),
+                        lambda: calculate_player_breakdown(
+                            select_rows(Executive=selected_exec),
+                            "Executive",
+                            selected_exec,
+                            ci=group_ci("PlayerName", Executive=selected_exec),
+                        ),
+                    )
+                    if breakdown_df is not None:
+                        st.dataframe(breakdown_df, use_container_width=True, hide_index=True)
             
             exec_breakdown_fragment()
         else:
             st.info("データがありません。")
 
-    with tab5:
+    def render_combinations():
         st.header("国家×重役 組み合わせ統計")
-        combo_stats = calculate_combination_stats(df)
+        combo_stats = cached_result(
+            "combo_stats",
+            lambda: calculate_combination_stats(
+                df, cube_stats(["Nation", "Executive"]), group_ci(["Nation", "Executive"])
+            ),
+        )
         if combo_stats is not None and not combo_stats.empty:
             # 表示用に列を選択
             display_cols = ["国家", "重役", "使用回数", "勝利数", "勝率", "平均スコア"]
-            st.dataframe(combo_stats[display_cols], use_container_width=True, hide_index=True)
+            st.dataframe(
+                select_table_columns(combo_stats, display_cols),
+                use_container_width=True,
+                hide_index=True,
+            )
+            st.caption(ci_caption)
 
             # 組み合わせ別平均スコアグラフ（上位10件）
             st.subheader("組み合わせ別平均スコア（使用回数上位10件）")
@@ -2380,63 +6141,21 @@ def show_stats_screen():
             st.subheader("⚔️ 組み合わせ同士の対戦分析")
             st.info("選択した組み合わせが、同じゲーム内の他の組み合わせに対してどのような成績を残しているかを分析します。")
             
+            # 全ペアの対戦成績は自己結合1回で行列にしておき、フラグメントでは切り出すだけにする
+            matchup_matrix = cached_result("matchup_matrix", lambda: build_matchup_matrix(df))
+
             @st.fragment
             def matchup_analysis_fragment():
                 combo_list = combo_stats["組み合わせ"].tolist()
                 selected_combo = st.selectbox("分析する組み合わせを選択", combo_list, key="matchup_combo_select")
                 
                 if selected_combo:
-                    # 組み合わせ列を追加した全データ
-                    df_combo = df.copy()
-                    df_combo["組み合わせ"] = df_combo["Nation"] + " × " + df_combo["Executive"]
-                    
-                    # 選択した組み合わせのゲームID一覧
-                    target_games = df_combo[df_combo["組み合わせ"] == selected_combo]["GameID"].unique()
-                    
-                    # マッチアップデータを構築
-                    matchup_data = []
-                    for game_id in target_games:
-                        game_df = df_combo[df_combo["GameID"] == game_id]
-                        target_row = game_df[game_df["組み合わせ"] == selected_combo]
-                        if target_row.empty:
-                            continue
-                        target_score = target_row["FinalScore"].iloc[0]
-                        target_player = target_row["PlayerName"].iloc[0]
-                        
-                        # 同じゲームの他のプレイヤー
-                        opponents = game_df[game_df["PlayerName"] != target_player]
-                        for _, opp in opponents.iterrows():
-                            matchup_data.append({
-                                "GameID": game_id,
-                                "対戦相手組み合わせ": opp["組み合わせ"],
-                                "自スコア": target_score,
-                                "相手スコア": opp["FinalScore"],
-                                "勝利": 1 if target_score > opp["FinalScore"] else 0,
-                                "スコア差": target_score - opp["FinalScore"],
-                            })
-                    
-                    if matchup_data:
-                        matchup_df = pd.DataFrame(matchup_data)
-                        
-                        # 対戦相手組み合わせごとに集計
-                        results = []
-                        for opp_combo in matchup_df["対戦相手組み合わせ"].unique():
-                            opp_df = matchup_df[matchup_df["対戦相手組み合わせ"] == opp_combo]
-                            total = len(opp_df)
-                            wins = opp_df["勝利"].sum()
-                            avg_diff = opp_df["スコア差"].mean()
-                            results.append({
-                                "対戦相手": opp_combo,
-                                "対戦回数": total,
-                                "勝利": int(wins),
-                                "敗北": total - int(wins),
-                                "勝率": f"{(wins / total * 100):.1f}%" if total > 0 else "0%",
-                                "勝率数値": (wins / total * 100) if total > 0 else 0,
-                                "平均スコア差": round(avg_diff, 1),
-                            })
-                        
-                        results_df = pd.DataFrame(results).sort_values("対戦回数", ascending=False)
-                        
+                    results_df = cached_result(
+                        ("matchup", selected_combo),
+                        lambda: calculate_matchup_results(df, selected_combo, matchup_matrix),
+                    )
+
+                    if results_df is not None:
                         # 相性の良い相手・悪い相手を表示
                         col1, col2 = st.columns(2)
                         with col1:
@@ -2480,17 +6199,46 @@ def show_stats_screen():
                         st.info("対戦データがありません。")
             
             matchup_analysis_fragment()
+
+            # 全組み合わせ同士の対戦ヒートマップ（使用回数上位のみ）
+            st.markdown("##### 🗺️ 組み合わせ同士の対戦ヒートマップ（使用回数上位20件）")
+            heatmap_combos = combo_stats.head(20)["組み合わせ"].tolist()
+            heatmap_data = cached_result(
+                "matchup_heatmap",
+                lambda: build_matchup_heatmap_data(matchup_matrix, heatmap_combos),
+            )
+            if heatmap_data is not None:
+                heatmap = alt.Chart(heatmap_data).mark_rect().encode(
+                    alt.X("対戦相手:N", sort=heatmap_combos, title="対戦相手", axis=alt.Axis(labelLimit=200)),
+                    alt.Y("組み合わせ:N", sort=heatmap_combos, title="組み合わせ", axis=alt.Axis(labelLimit=200)),
+                    color=alt.Color("勝率数値:Q", scale=alt.Scale(scheme="redyellowgreen", domain=[0, 100]), title="勝率(%)"),
+                    tooltip=["組み合わせ", "対戦相手", "対戦回数", "勝率数値", "平均スコア差"]
+                ).properties(height=500)
+                st.altair_chart(heatmap, use_container_width=True)
+            else:
+                st.caption("対戦データがありません。")
         else:
             st.info("データがありません。")
 
-    with tab6:
+    def render_turn_order():
         st.header("1ラウンド目 番手別統計")
         st.info("1ラウンド目の番手（TurnOrder1R）による勝率・スコアの違いを分析します。")
         
-        turn_order_stats = calculate_turn_order_stats(df)
+        turn_order_stats = cached_result(
+            "turn_order_stats",
+            lambda: calculate_turn_order_stats(
+                df, cube_stats("TurnOrder1R"), group_ci("TurnOrder1R")
+            ),
+        )
         if turn_order_stats is not None and not turn_order_stats.empty:
-            st.dataframe(turn_order_stats[["番手", "ゲーム数", "勝利数", "勝率", "平均スコア", "平均順位"]], 
-                        use_container_width=True, hide_index=True)
+            st.dataframe(
+                select_table_columns(
+                    turn_order_stats, ["番手", "ゲーム数", "勝利数", "勝率", "平均スコア", "平均順位"]
+                ),
+                use_container_width=True,
+                hide_index=True,
+            )
+            st.caption(ci_caption)
             
             st.divider()
             
@@ -2528,6 +6276,230 @@ def show_stats_screen():
         else:
             st.info("番手データがありません。")
 
+    def render_ratings():
+        st.header("レーティング")
+        st.info(
+            "全期間のゲームをGameID順に反映した多人数Eloレーティングです。"
+            "対戦相手の強さを考慮します（期間・条件フィルターの影響は受けません）。"
+        )
+        kind_label = st.radio(
+            "対象", list(RATING_KINDS.values()), horizontal=True, key="rating_kind"
+        )
+        kind = next(k for k, label in RATING_KINDS.items() if label == kind_label)
+
+        rating_table = stats_cache.get_or_compute(
+            (snapshot_version, "rating_table", kind),
+            lambda: calculate_rating_table(snapshot_df, kind),
+        )
+        if rating_table is None or rating_table.empty:
+            st.info("データがありません。")
+            return
+
+        st.dataframe(rating_table, use_container_width=True, hide_index=True)
+
+        st.subheader("レーティング推移")
+        selected_entities = st.multiselect(
+            f"表示する{kind_label}",
+            rating_table[kind_label].tolist(),
+            default=rating_table[kind_label].head(5).tolist(),
+            key=f"rating_history_select_{kind}",
+        )
+        history = stats_cache.get_or_compute(
+            (snapshot_version, "rating_history", kind, tuple(sorted(selected_entities))),
+            lambda: calculate_rating_history(snapshot_df, kind, selected_entities),
+        )
+        if history is not None and not history.empty:
+            rating_chart = alt.Chart(history).mark_line(point=True).encode(
+                alt.X("Timestamp:T", title="日時"),
+                alt.Y("Rating:Q", title="レーティング", scale=alt.Scale(zero=False)),
+                alt.Color("Entity:N", title=kind_label),
+                tooltip=[
+                    alt.Tooltip("Entity:N", title=kind_label),
+                    "Timestamp:T",
+                    alt.Tooltip("Rating:Q", format=".0f", title="レーティング"),
+                    alt.Tooltip("Delta:Q", format="+.1f", title="変動"),
+                ]
+            ).properties(height=350)
+            st.altair_chart(rating_chart, use_container_width=True)
+        else:
+            st.caption("表示する対象を選択してください。")
+
+    def render_rivalries():
+        st.header("プレイヤー同士の対戦成績")
+        # 絞り込みがなければ保存時に増分更新している全体の行列を使う
+        if len(df) == len(snapshot_df):
+            rivalry_matrix = sync_rivalry_matrix(snapshot_df)
+        else:
+            rivalry_matrix = cached_result("rivalry_matrix", lambda: build_rivalry_matrix(df))
+        if rivalry_matrix is None or rivalry_matrix.empty:
+            st.info("データがありません。")
+            return
+
+        # ヒートマップはゲーム数の多いプレイヤーに絞る
+        top_players = cached_result(
+            "rivalry_players",
+            lambda: df["PlayerName"].value_counts().head(15).index.tolist(),
+        )
+        heatmap_data = cached_result(
+            "rivalry_heatmap",
+            lambda: build_rivalry_table(rivalry_matrix, top_players),
+        )
+        if heatmap_data is not None:
+            st.markdown("##### 🗺️ 上位率ヒートマップ（行のプレイヤーが列の相手より上位だった割合）")
+            heatmap = alt.Chart(heatmap_data).mark_rect().encode(
+                alt.X("相手:N", sort=top_players, title="相手"),
+                alt.Y("プレイヤー:N", sort=top_players, title="プレイヤー"),
+                color=alt.Color(
+                    "上位率数値:Q",
+                    scale=alt.Scale(scheme="redyellowgreen", domain=[0, 100]),
+                    title="上位率(%)",
+                ),
+                tooltip=["プレイヤー", "相手", "同卓回数", "上位率", "平均スコア差"]
+            ).properties(height=450)
+            st.altair_chart(heatmap, use_container_width=True)
+
+        st.divider()
+        all_players = cached_result(
+            "player_names", lambda: sorted(df["PlayerName"].unique().tolist())
+        )
+        selected_player = st.selectbox("プレイヤーを選択", all_players, key="rivalry_player")
+        rivalry_table = cached_result(
+            "rivalry_table", lambda: build_rivalry_table(rivalry_matrix)
+        )
+        rivals = rivalry_table[rivalry_table["プレイヤー"] == selected_player].sort_values(
+            "同卓回数", ascending=False
+        )
+        if rivals.empty:
+            st.info("同卓したプレイヤーがいません。")
+            return
+        st.dataframe(
+            rivals[["相手", "同卓回数", "上位", "下位", "上位率", "平均スコア差"]],
+            use_container_width=True,
+            hide_index=True,
+        )
+
+        st.subheader("🔍 組み合わせ別の内訳")
+        selected_rival = st.selectbox("相手を選択", rivals["相手"].tolist(), key="rivalry_rival")
+        mine, theirs = cached_result(
+            ("rivalry_breakdown", selected_player, selected_rival),
+            lambda: calculate_rivalry_breakdown(
+                df, selected_player, selected_rival, row_index("PlayerName")
+            ),
+        )
+        if mine is None:
+            st.info("データがありません。")
+            return
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown(f"##### {selected_player} の組み合わせ別")
+            st.dataframe(mine, use_container_width=True, hide_index=True)
+        with col2:
+            st.markdown(f"##### {selected_rival} の組み合わせ別")
+            st.dataframe(theirs, use_container_width=True, hide_index=True)
+
+    def render_balance_versions():
+        st.header("バランス調整バージョン別比較")
+        if balance_versions.empty:
+            st.info("バランス調整履歴がありません。")
+            return
+
+        tagged = cached_result(
+            ("balance_tagged", balance_key), lambda: tag_balance_versions(df, balance_versions)
+        )
+        summary = cached_result(
+            ("balance_summary", balance_key), lambda: calculate_balance_version_summary(tagged)
+        )
+        st.dataframe(summary, use_container_width=True, hide_index=True)
+
+        present_versions = summary["バージョン"].tolist()
+        if len(present_versions) < 2:
+            st.info("比較には2つ以上のバージョンのデータが必要です。")
+            return
+
+        col1, col2 = st.columns(2)
+        before = col1.selectbox(
+            "比較元（前）", present_versions, index=len(present_versions) - 2, key="balance_before"
+        )
+        after = col2.selectbox(
+            "比較先（後）", present_versions, index=len(present_versions) - 1, key="balance_after"
+        )
+
+        for column, label, color in [("Nation", "国家", "#4CAF50"), ("Executive", "重役", "#2196F3")]:
+            st.subheader(f"{label}別の変化")
+            version_stats = cached_result(
+                ("balance_version_stats", balance_key, column),
+                lambda: aggregate_group_stats(tagged, ["BalanceVersion", column]),
+            )
+            comparison = cached_result(
+                ("balance_comparison", balance_key, column, before, after),
+                lambda: calculate_balance_comparison(version_stats, column, label, before, after),
+            )
+            if comparison is None or comparison.empty:
+                st.info("データがありません。")
+                continue
+
+            st.dataframe(comparison, use_container_width=True, hide_index=True)
+            diff_chart = alt.Chart(comparison.dropna(subset=["勝率差(pt)"])).mark_bar().encode(
+                alt.X(f"{label}:N", sort="-y", title=label),
+                alt.Y("勝率差(pt):Q", title="勝率の変化 (pt)"),
+                color=alt.condition(
+                    alt.datum["勝率差(pt)"] >= 0, alt.value(color), alt.value("#f44336")
+                ),
+                tooltip=[label, "使用回数(前)", "使用回数(後)", "勝率%(前)", "勝率%(後)", "勝率差(pt)"]
+            ).properties(height=250)
+            st.altair_chart(diff_chart, use_container_width=True)
+
+    def render_draft_events():
+        st.header("ドラフト傾向")
+        analytics = get_draft_event_analytics()
+        if analytics is None:
+            st.info("ドラフトログがありません。ゲーム開始時に記録されたドラフトから集計します。")
+            return
+        st.caption(
+            f"ドラフトログ {analytics['games']} ゲーム分の集計です（期間などのフィルタは適用されません）。"
+        )
+
+        st.subheader("候補の選択率")
+        st.caption("提示された候補のうち選ばれた割合と、最初の指名で選ばれた割合")
+        pick_kind = st.radio(
+            "集計単位", list(analytics["pick_rates"]), horizontal=True, key="pick_rate_kind"
+        )
+        pick_rates = analytics["pick_rates"][pick_kind]
+        if pick_rates is None:
+            st.info("ドラフトの記録がありません。")
+        else:
+            st.dataframe(pick_rates, use_container_width=True, hide_index=True)
+
+        st.subheader("手番ごとの落札額（オークション）")
+        winning_bids = analytics["winning_bids"]
+        if winning_bids is None:
+            st.info("オークションの記録がありません。")
+            return
+        st.dataframe(winning_bids, use_container_width=True, hide_index=True)
+        bid_chart = alt.Chart(winning_bids).mark_line(point=True).encode(
+            alt.X("手番:O", title="手番"),
+            alt.Y("平均落札額(VP):Q", title="平均落札額 (VP)"),
+            alt.Color("ボード:N"),
+            alt.StrokeDash("人数:N"),
+            tooltip=["ボード", "人数", "手番", "ゲーム数", "平均落札額(VP)", "最高落札額(VP)"],
+        ).properties(height=300)
+        st.altair_chart(bid_chart, use_container_width=True)
+
+    sections = [
+        ("📈 総合", render_overview),
+        ("👤 プレイヤー", render_players),
+        ("📋 プレイヤー詳細", render_player_detail),
+        ("🏛️ 国家", render_nations),
+        ("👔 重役", render_executives),
+        ("🔗 組み合わせ", render_combinations),
+        ("🔢 番手", render_turn_order),
+        ("🆚 プレイヤー対戦", render_rivalries),
+        ("⭐ レーティング", render_ratings),
+        ("🔖 バランス調整", render_balance_versions),
+        ("🎯 ドラフト傾向", render_draft_events),
+    ]
+    render_stats_sections(sections, lazy=lazy_sections, timing_placeholder=timing_placeholder)
+
 
 # --- メイン処理 ---
 def main():
@@ -2556,11 +6528,18 @@ def main():
     )
 
     initialize_session_state()
+    record_startup_phase("imports", IMPORTS_FINISHED_AT - SCRIPT_STARTED_AT)
+    start_cache_warmer()
+    # GameIDのノード番号は起動時に確保する（環境変数が未設定ならここで警告が出る）
+    get_game_id_state()
 
-    if st.session_state.active_game is None:
-        st.session_state.active_game = load_latest_game_from_sheet()
-
+    checkpoint_setup_session()
     screen = st.session_state.screen
+    if screen in SESSION_CHECKPOINT_SCREENS and "checkpointed" in st.session_state:
+        st.caption(
+            f"⏯️ 再開コード: **{st.session_state.resume_code}**（接続が切れたらトップ画面から再開できます。"
+            "このコードを知っていれば誰でもこのセットアップを開いて操作できるので、卓の外には教えないでください）"
+        )
 
     if screen == "landing":
         show_landing_screen()
@@ -2576,20 +6555,22 @@ def main():
         if contract_df is not None and nation_df is not None and exec_df is not None:
             show_setup_screen(contract_df, nation_df, exec_df)
     elif screen == "draft":
+        contract_df = get_master_data(CONTRACT_SHEET)
         nation_df = get_master_data(NATION_SHEET)
         exec_df = get_master_data(EXECUTIVE_SHEET)
-        if nation_df is not None and exec_df is not None:
-            show_draft_screen(nation_df, exec_df)
+        if contract_df is not None and nation_df is not None and exec_df is not None:
+            show_draft_screen(contract_df, nation_df, exec_df)
     elif screen == "draft_result":
         nation_df = get_master_data(NATION_SHEET)
         exec_df = get_master_data(EXECUTIVE_SHEET)
         if nation_df is not None and exec_df is not None:
             show_draft_result_screen(nation_df, exec_df)
     elif screen == "auction":
+        contract_df = get_master_data(CONTRACT_SHEET)
         nation_df = get_master_data(NATION_SHEET)
         exec_df = get_master_data(EXECUTIVE_SHEET)
-        if nation_df is not None and exec_df is not None:
-            show_auction_screen(nation_df, exec_df)
+        if contract_df is not None and nation_df is not None and exec_df is not None:
+            show_auction_screen(contract_df, nation_df, exec_df)
     elif screen == "score_input":
         show_score_input_screen()
     elif screen == "stats":
@@ -2600,6 +6581,9 @@ def main():
         st.session_state.screen = "landing"
         st.rerun()
 
+    # 描画中に決まった状態（セットアップ画面の抽選結果など）もこの実行のうちに保存する
+    checkpoint_setup_session()
+
 
 if __name__ == "__main__":
     main()
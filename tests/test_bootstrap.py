@@ -0,0 +1,130 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import barrage
+
+QUANTILES = [0.025, 0.975]
+
+
+def multinomial_bootstrap_quantiles(values, freqs, n_resamples=10000, seed=0):
+    """値ごとの抽出回数を多項分布で n_resamples 回引いたときの平均の分位点"""
+    count = int(freqs.sum())
+    rng = np.random.default_rng(seed)
+    draws = rng.multinomial(count, freqs / count, size=n_resamples)
+    return np.quantile(draws @ values / count, QUANTILES)
+
+
+@pytest.mark.parametrize("seed", range(12))
+@pytest.mark.parametrize("count", [3, 12, 40, 150, 600])
+def test_exact_quantiles_match_resampling(seed, count):
+    rng = np.random.default_rng(seed)
+    if seed % 2:
+        scores = rng.integers(0, 200, size=count)
+    else:
+        scores = np.round(rng.gamma(2, 30, size=count))
+    values, freqs = np.unique(scores, return_counts=True)
+    values, freqs = values.astype(float), freqs.astype(float)
+
+    exact = barrage.exact_bootstrap_mean_quantiles(values, freqs, QUANTILES)
+    sampled = multinomial_bootstrap_quantiles(values, freqs, seed=seed + 100)
+
+    # 10,000回の抽出による分位点の誤差は平均の標準誤差の数%程度
+    standard_error = scores.std() / np.sqrt(count)
+    assert np.abs(exact - sampled).max() <= 0.2 * standard_error + 1e-9
+
+
+@pytest.mark.parametrize("count, wins", [(10, 0), (10, 3), (25, 25), (80, 21), (400, 130)])
+def test_exact_win_rate_quantiles_match_resampling(count, wins):
+    values = np.array([0.0, 1.0])
+    freqs = np.array([count - wins, wins], dtype=float)
+
+    exact = barrage.exact_bootstrap_mean_quantiles(values, freqs, QUANTILES)
+    sampled = multinomial_bootstrap_quantiles(values, freqs)
+
+    standard_error = np.sqrt(wins / count * (1 - wins / count) / count)
+    assert np.abs(exact - sampled).max() <= 0.2 * standard_error + 1 / count
+
+
+def make_scores(n_games=120, seed=0):
+    rng = np.random.default_rng(seed)
+    nations = ["日本", "ドイツ", "フランス", "イタリア", "アメリカ"]
+    rows = []
+    for game_id in range(1, n_games + 1):
+        for player, nation in enumerate(rng.permutation(nations)[:4]):
+            rows.append({
+                "GameID": game_id,
+                "PlayerName": f"P{player}",
+                "Nation": nation,
+                "FinalScore": int(rng.integers(40, 160)),
+            })
+    return pd.DataFrame(rows)
+
+
+class BrokenPool:
+    """子プロセスが __main__ を解決できなかったときのように、計算を受け付けないプール"""
+
+    def __init__(self, max_workers=None, fail_on_submit=True):
+        self.fail_on_submit = fail_on_submit
+        self.shut_down = False
+
+    def submit(self, *args):
+        if self.fail_on_submit:
+            raise BrokenProcessPool("spawn できませんでした")
+        fn, *fn_args = args
+        future = Future()
+        future.set_result(fn(*fn_args))
+        return future
+
+    def map(self, *args):
+        raise BrokenProcessPool("ワーカーが終了しました")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+@pytest.fixture
+def clean_pool_cache():
+    barrage.get_bootstrap_pool.clear()
+    yield
+    barrage.get_bootstrap_pool.clear()
+
+
+def test_falls_back_when_pool_cannot_start(monkeypatch, clean_pool_cache):
+    df = make_scores()
+    expected = barrage.bootstrap_group_ci(df, "Nation", workers=0)
+    monkeypatch.setattr(barrage, "ProcessPoolExecutor", BrokenPool)
+
+    result = barrage.bootstrap_group_ci(df, "Nation", workers=2)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert barrage.get_bootstrap_pool(2) is None
+
+
+def test_falls_back_when_pool_breaks(monkeypatch, clean_pool_cache):
+    df = make_scores()
+    expected = barrage.bootstrap_group_ci(df, "Nation", workers=0)
+    pools = []
+
+    def make_pool(max_workers):
+        pools.append(BrokenPool(max_workers, fail_on_submit=False))
+        return pools[-1]
+
+    monkeypatch.setattr(barrage, "ProcessPoolExecutor", make_pool)
+
+    result = barrage.bootstrap_group_ci(df, "Nation", workers=2)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert pools[0].shut_down
+
+
+def test_process_pool_matches_single_process(clean_pool_cache):
+    df = make_scores()
+    expected = barrage.bootstrap_group_ci(df, "PlayerName", workers=0)
+
+    result = barrage.bootstrap_group_ci(df, "PlayerName", workers=2)
+
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,222 @@
+import random
+from collections import Counter
+from itertools import combinations, permutations
+
+import pandas as pd
+import pytest
+
+import barrage
+
+
+def is_valid(candidates, num_candidates, banned_pairs=(), required_executives=(),
+             player_banned_nations=None):
+    """候補のリストが制約をすべて満たすか（総当たりで確かめる）"""
+    nations = [nation for nation, _ in candidates]
+    executives = [executive for _, executive in candidates]
+    if len(candidates) != num_candidates:
+        return False
+    if len(set(nations)) != len(nations) or len(set(executives)) != len(executives):
+        return False
+    if set(map(tuple, banned_pairs)) & set(candidates):
+        return False
+    if required_executives and not set(required_executives) & set(executives):
+        return False
+    players = list(player_banned_nations or {})
+    return not players or any(
+        all(nation not in player_banned_nations[player] for player, nation in zip(players, order))
+        for order in permutations(nations, len(players))
+    )
+
+
+def enumerate_candidate_sets(nations, executives, num_candidates, **constraints):
+    """条件を満たす (国家の組, 重役の組) をすべて列挙する"""
+    found = set()
+    for chosen_nations in combinations(nations, num_candidates):
+        for chosen_execs in combinations(executives, num_candidates):
+            for order in permutations(chosen_execs):
+                if is_valid(list(zip(chosen_nations, order)), num_candidates, **constraints):
+                    found.add((frozenset(chosen_nations), frozenset(chosen_execs)))
+                    break
+    return found
+
+
+def random_instance(seed):
+    rng = random.Random(seed)
+    nations = [f"N{i}" for i in range(rng.randint(3, 6))]
+    executives = [f"E{i}" for i in range(rng.randint(3, 6))]
+    num_candidates = rng.randint(2, min(len(nations), len(executives)))
+    pairs = [(n, e) for n in nations for e in executives]
+    constraints = {
+        "banned_pairs": rng.sample(pairs, rng.randint(0, len(pairs) // 2)),
+        "required_executives": rng.sample(executives, rng.randint(0, 2)),
+        "player_banned_nations": {
+            f"P{p}": set(rng.sample(nations, rng.randint(0, len(nations) - 1)))
+            for p in range(rng.randint(0, num_candidates))
+        },
+    }
+    return nations, executives, num_candidates, constraints
+
+
+@pytest.mark.parametrize("seed", range(150))
+def test_feasibility_matches_enumeration(seed):
+    nations, executives, num_candidates, constraints = random_instance(seed)
+    expected = bool(enumerate_candidate_sets(nations, executives, num_candidates, **constraints))
+
+    checker = barrage.build_candidate_constraints(nations, executives, num_candidates, **constraints)
+    candidates, _, error = barrage.sample_constrained_candidates(
+        nations, executives, num_candidates, rng=random.Random(seed), **constraints
+    )
+
+    assert checker["nations"]([]) == expected
+    assert (candidates is not None) == expected
+    assert (error is None) == expected
+    if expected:
+        assert is_valid(candidates, num_candidates, **constraints)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_samples_always_satisfy_constraints(seed):
+    nations, executives, num_candidates, constraints = random_instance(seed)
+    if not enumerate_candidate_sets(nations, executives, num_candidates, **constraints):
+        pytest.skip("実行不能なケース")
+    rng = random.Random(seed)
+    for balanced in (False, True):
+        for _ in range(50):
+            candidates, _, error = barrage.sample_constrained_candidates(
+                nations, executives, num_candidates, balanced=balanced, rng=rng, **constraints
+            )
+            assert error is None
+            assert is_valid(candidates, num_candidates, **constraints)
+
+
+def test_reports_too_few_options():
+    candidates, spread, error = barrage.sample_constrained_candidates(["A", "B"], ["X", "Y", "Z"], 3)
+
+    assert candidates is None and spread is None
+    assert "少ない" in error
+
+
+@pytest.mark.parametrize("constraints, culprit", [
+    # 国家 A はどの重役とも組めない
+    ({"banned_pairs": [("A", "X"), ("A", "Y"), ("A", "Z")]}, "組み合わせ禁止"),
+    # 3人とも国家 A・B を避けるので、3人に別々の国家を割り当てられない
+    ({"player_banned_nations": {"P1": {"A", "B"}, "P2": {"A", "B"}, "P3": {"A", "B"}}},
+     "直近に使った国家を避ける"),
+])
+def test_reports_infeasible_constraint(constraints, culprit):
+    candidates, _, error = barrage.sample_constrained_candidates(
+        ["A", "B", "C"], ["X", "Y", "Z"], 3, **constraints
+    )
+
+    assert candidates is None
+    assert culprit in error
+
+
+def test_reports_infeasible_combination():
+    # 単独ならどちらも満たせるが、必須の重役 X はどの国家とも組めない
+    constraints = {
+        "banned_pairs": [("A", "X"), ("B", "X"), ("C", "X")],
+        "required_executives": ["X"],
+    }
+    candidates, _, error = barrage.sample_constrained_candidates(
+        ["A", "B", "C"], ["X", "Y", "Z", "W"], 2, **constraints
+    )
+
+    assert candidates is None
+    assert error == "制約の組み合わせを同時に満たす候補を作れません。"
+
+
+def test_unconstrained_sets_are_uniform():
+    nations = ["A", "B", "C", "D", "E"]
+    executives = ["V", "W", "X", "Y", "Z"]
+    rng = random.Random(0)
+    draws = 20000
+    nation_sets = Counter()
+    pairings = Counter()
+    for _ in range(draws):
+        candidates, _, _ = barrage.sample_constrained_candidates(nations, executives, 2, rng=rng)
+        nation_sets[frozenset(n for n, _ in candidates)] += 1
+        pairings[frozenset(candidates)] += 1
+
+    # 国家の組は C(5,2)=10 通り、国家・重役の組と割り当ては 10 × 10 × 2 = 200 通りが等確率
+    assert len(nation_sets) == 10
+    assert len(pairings) == 200
+    for counts, outcomes in ((nation_sets, 10), (pairings, 200)):
+        expected = draws / outcomes
+        chi2 = sum((count - expected) ** 2 / expected for count in counts.values())
+        # 自由度 9・199 のカイ二乗分布の上側 0.1% 点はおよそ 27.9・267
+        assert chi2 < {10: 27.9, 200: 267}[outcomes]
+
+
+def test_constrained_sampling_reaches_every_valid_set():
+    nations = ["A", "B", "C", "D"]
+    executives = ["X", "Y", "Z", "W"]
+    constraints = {
+        "banned_pairs": [("A", "X"), ("B", "Y")],
+        "required_executives": ["Z"],
+        "player_banned_nations": {"P1": {"A", "B"}, "P2": {"C"}},
+    }
+    expected = enumerate_candidate_sets(nations, executives, 2, **constraints)
+    rng = random.Random(1)
+    seen = Counter()
+    for _ in range(3000):
+        candidates, _, _ = barrage.sample_constrained_candidates(
+            nations, executives, 2, rng=rng, **constraints
+        )
+        seen[(frozenset(n for n, _ in candidates), frozenset(e for _, e in candidates))] += 1
+
+    assert set(seen) == expected
+
+
+def test_weighted_nations_follow_sequential_sampling():
+    nations = ["A", "B", "C"]
+    weights = {"A": 4.0, "B": 2.0, "C": 1.0}
+    rng = random.Random(2)
+    draws = 20000
+    firsts = Counter()
+    for _ in range(draws):
+        candidates, _, _ = barrage.sample_constrained_candidates(
+            nations, ["X", "Y", "Z"], 2, nation_weights=weights, rng=rng
+        )
+        firsts[frozenset(n for n, _ in candidates)] += 1
+
+    # 重み付きの非復元抽出で C が外れる確率 = 4/7 × 2/3 + 2/7 × 4/5
+    assert firsts[frozenset("AB")] / draws == pytest.approx(4 / 7 * 2 / 3 + 2 / 7 * 4 / 5, abs=0.015)
+
+
+@pytest.fixture
+def scored_games(monkeypatch):
+    rows = [
+        # (GameID, プレイヤー, ボード, 国家, 重役)
+        (1, "P1", "通常", "A", "X"),
+        (1, "P2", "通常", "B", "Y"),
+        (2, "P1", "ナイル", "C", "Z"),
+        (2, "P2", "ナイル", "A", "W"),
+    ]
+    df = pd.DataFrame(rows, columns=["GameID", "PlayerName", "Board", "Nation", "Executive"])
+    df["FinalScore"] = 100.0
+    monkeypatch.setattr(barrage, "load_all_scores_from_sheet", lambda: df)
+    barrage.get_recency_index_store.clear()
+    yield df
+    barrage.get_recency_index_store.clear()
+
+
+def test_recent_nations_span_boards(scored_games):
+    assert barrage.get_recent_player_nations(["P1", "P2"], 1) == {"P1": {"C"}, "P2": {"A"}}
+    assert barrage.get_recent_player_nations(["P1"], 2) == {"P1": {"A", "C"}}
+
+
+def test_recent_nations_include_saved_unscored_draft(scored_games):
+    barrage.get_recent_player_nations(["P1"], 1)
+    # 保存したがスコアがまだ入っていないドラフト（スコア記録のスナップショットには載らない）
+    barrage.add_draft_to_recency_index(3, "通常", [("P1", "D", "X"), ("P2", "B", "Z")])
+
+    recent = barrage.get_recent_player_nations(["P1", "P2"], 1)
+
+    assert recent == {"P1": {"D"}, "P2": {"B"}}
+    candidates, _, error = barrage.sample_constrained_candidates(
+        ["A", "B", "C", "D"], ["X", "Y", "Z", "W"], 2,
+        player_banned_nations=recent, rng=random.Random(0),
+    )
+    assert error is None
+    assert is_valid(candidates, 2, player_banned_nations=recent)
@@ -0,0 +1,114 @@
+import json
+
+import gspread
+import pytest
+
+import barrage
+
+SCORE_HEADERS = ["GameID", "Timestamp", "PlayerCount", "PlayerName", "TurnOrder1R",
+                 "DraftMethod", "Nation", "Executive", "Contract", "InitialScore",
+                 "FinalScore", "Board"]
+
+
+class FakeWorksheet:
+    def __init__(self, values):
+        self.values = [list(row) for row in values]
+
+    def get_all_values(self):
+        return [list(row) for row in self.values]
+
+    def delete_rows(self, start, end=None):
+        del self.values[start - 1:(end or start)]
+
+
+class FakeSpreadsheet:
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def worksheet(self, name):
+        if name not in self.sheets:
+            raise gspread.WorksheetNotFound(name)
+        return self.sheets[name]
+
+
+class FakeClient:
+    def __init__(self, sheets):
+        self.spreadsheet = FakeSpreadsheet(sheets)
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+
+def score_rows(game_id, players):
+    return [
+        [str(game_id), "2024-05-01 20:00:00", str(len(players)), player, str(i + 1), "normal",
+         nation, executive, "C0", "10", "100", "通常"]
+        for i, (player, nation, executive) in enumerate(players)
+    ]
+
+
+def draft_log_rows(game_id, candidates, picks):
+    start = {
+        "draft_method": "normal", "board": "通常", "player_count": len(picks),
+        "draft_order": [player for player, _, _ in picks], "candidates": candidates,
+        "contracts": [{"ID": str(i), "Name": f"C{i}"} for i in range(len(picks) + 1)],
+    }
+    rows = [[str(game_id), "0", "start", "", json.dumps(start, ensure_ascii=False)]]
+    for seq, (player, nation, executive) in enumerate(picks, start=1):
+        data = {"nation": nation, "executive": executive, "contract_id": str(seq - 1)}
+        rows.append([str(game_id), str(seq), "pick", player, json.dumps(data, ensure_ascii=False)])
+    return rows
+
+
+@pytest.fixture
+def sheets(monkeypatch):
+    deleted = [("P1", "日本", "E1"), ("P2", "ドイツ", "E2")]
+    kept = [("P1", "フランス", "E3"), ("P2", "イタリア", "E4")]
+    deleted_log = draft_log_rows(
+        101, [["日本", "E1"], ["ドイツ", "E2"], ["アメリカ", "E5"]], deleted
+    )
+    kept_log = draft_log_rows(
+        102, [["フランス", "E3"], ["イタリア", "E4"], ["アメリカ", "E5"]], kept
+    )
+    sheets = {
+        barrage.SCORE_SHEET: FakeWorksheet(
+            [SCORE_HEADERS] + score_rows(101, deleted) + score_rows(102, kept)
+        ),
+        # 削除するゲームの行が、別のゲームの行を挟んで2か所に分かれている場合も扱う
+        barrage.DRAFT_LOG_SHEET: FakeWorksheet(
+            [barrage.DRAFT_LOG_HEADERS] + deleted_log[:2] + kept_log + deleted_log[2:]
+        ),
+    }
+    client = FakeClient(sheets)
+    monkeypatch.setattr(barrage, "get_gspread_client", lambda: client)
+    barrage.st.cache_data.clear()
+    yield sheets
+    barrage.st.cache_data.clear()
+
+
+def test_delete_game_removes_draft_log_rows(sheets):
+    assert barrage.delete_game_from_sheet(101)
+
+    assert {row[0] for row in sheets[barrage.SCORE_SHEET].values[1:]} == {"102"}
+    log = sheets[barrage.DRAFT_LOG_SHEET].values
+    assert log[0] == barrage.DRAFT_LOG_HEADERS
+    assert [row[0] for row in log[1:]] == ["102"] * 3
+
+
+def test_deleted_game_is_not_in_draft_analytics(sheets):
+    before = barrage.get_draft_event_analytics()
+    assert before["games"] == 2
+    assert "日本" in set(before["pick_rates"]["国家"]["国家"])
+
+    barrage.delete_game_from_sheet(101)
+    after = barrage.get_draft_event_analytics()
+
+    assert after["games"] == 1
+    assert set(after["pick_rates"]["国家"]["国家"]) == {"フランス", "イタリア", "アメリカ"}
+
+
+def test_delete_game_without_draft_log_sheet(sheets):
+    del sheets[barrage.DRAFT_LOG_SHEET]
+
+    assert barrage.delete_game_from_sheet(101)
+    assert {row[0] for row in sheets[barrage.SCORE_SHEET].values[1:]} == {"102"}
@@ -0,0 +1,103 @@
+import multiprocessing
+import sqlite3
+import threading
+
+import pytest
+
+import barrage
+
+PROCESSES = 12
+THREADS = 4
+IDS_PER_THREAD = 300
+FIXED_SECOND = 1_700_000_000
+
+
+def generate_ids_in_process(db_path, start, queue):
+    """割り当て表からノード番号を確保し、複数スレッドで同じ秒のGameIDを採番する"""
+    barrage.GAME_ID_NODE_DB = db_path
+    barrage.get_game_id_state.clear()
+    start.wait()
+    ids = []
+    lock = threading.Lock()
+
+    def worker():
+        generated = [barrage.generate_game_id(FIXED_SECOND) for _ in range(IDS_PER_THREAD)]
+        with lock:
+            ids.extend(generated)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put((barrage.get_game_id_state()["node"], ids))
+
+
+@pytest.fixture
+def node_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "game_id_nodes.sqlite3")
+    monkeypatch.setattr(barrage, "GAME_ID_NODE_DB", path)
+    monkeypatch.delenv(barrage.GAME_ID_NODE_ENV, raising=False)
+    return path
+
+
+def test_processes_and_threads_never_share_game_ids(node_db):
+    ctx = multiprocessing.get_context()
+    start = ctx.Event()
+    queue = ctx.Queue()
+    processes = [
+        ctx.Process(target=generate_ids_in_process, args=(node_db, start, queue))
+        for _ in range(PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    start.set()
+    results = [queue.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join(timeout=30)
+
+    nodes = [node for node, _ in results]
+    ids = [game_id for _, game_ids in results for game_id in game_ids]
+    assert len(set(nodes)) == PROCESSES
+    assert len(ids) == PROCESSES * THREADS * IDS_PER_THREAD
+    assert len(set(ids)) == len(ids)
+
+
+def test_same_process_keeps_its_node(node_db):
+    assert barrage.allocate_game_id_node() == barrage.allocate_game_id_node()
+
+
+def test_node_of_finished_process_is_reclaimed(node_db):
+    process = multiprocessing.get_context().Process(
+        target=barrage.allocate_game_id_node, args=(node_db,)
+    )
+    process.start()
+    process.join()
+
+    # 終了したプロセスの番号 0 を回収し、このプロセスに割り当てる
+    assert barrage.allocate_game_id_node() == 0
+
+
+def test_released_node_is_removed_from_table(node_db):
+    node = barrage.allocate_game_id_node()
+    barrage.release_game_id_node(node)
+
+    conn = sqlite3.connect(node_db)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM game_id_nodes").fetchone() == (0,)
+    finally:
+        conn.close()
+
+
+def test_environment_node_takes_precedence(node_db, monkeypatch):
+    monkeypatch.setenv(barrage.GAME_ID_NODE_ENV, "142")
+
+    assert barrage.get_game_id_node() == 42
+
+
+def test_warns_when_node_is_not_configured(node_db, caplog):
+    with caplog.at_level("WARNING", logger="barrage"):
+        node = barrage.get_game_id_node()
+
+    assert barrage.GAME_ID_NODE_ENV in caplog.text
+    barrage.release_game_id_node(node)